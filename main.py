@@ -1,15 +1,90 @@
-import uvicorn
+import logging
+from contextlib import asynccontextmanager
+
 import redis.asyncio as redis
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi_limiter import FastAPILimiter
-from src.routes import users, auth, profile
+from src import server
+from src.routes import users, auth, profile, batch
 from src.conf.config import settings
+from src.database.db import replica_router, shard_map
+from src.services.query_tracer import query_tracing_middleware
+from src.services.profiler import ProfilerMiddleware
+from src.services.serialization import ORJSONResponse
+from src.services.compression import CompressionMiddleware
+from src.services.events import contact_events
+from src.services.idempotency import IdempotencyMiddleware, idempotency_store
+from src.services.load_shedding import LoadSheddingMiddleware, loop_monitor
+from src.services.logs import RequestIdMiddleware, log_pipeline
+from src.services.metrics import metrics
+from src.services.resilience import DependencyUnavailable, redis_calls
+from src.services.warmup import warm_up
+
 
+logger = logging.getLogger(__name__)
 
 origins = ["*"]
 
-app = FastAPI()
+
+async def initialize_limiter() -> redis.Redis:
+    """
+    Connect to Redis and set the rate limiter up.
+
+    A worker starting while Redis is down keeps the client: rate limiting and the other Redis
+    users fall back until the ``redis_calls`` circuit breaker finds Redis back.
+
+    :return: Redis client.
+    :rtype: redis.asyncio.Redis
+    """
+    options = dict(
+        host=settings.redis_host, port=settings.redis_port, db=0, encoding="utf-8", decode_responses=True,
+        socket_timeout=settings.redis_timeout_seconds, socket_connect_timeout=settings.redis_timeout_seconds,
+    )
+    max_connections = settings.redis_max_connections()
+    if max_connections is None:
+        r = await redis.Redis(**options)
+    else:
+        # Requests wait for a free connection instead of failing once the worker's share is in use;
+        # the share includes the connection the contact events subscription keeps.
+        r = await redis.Redis(connection_pool=redis.BlockingConnectionPool(max_connections=max_connections, **options))
+    try:
+        await redis_calls.call(FastAPILimiter.init, r)
+    except DependencyUnavailable as e:
+        logger.warning("Redis is unavailable, rate limiting starts once it is back: %s", e)
+    return r
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Connect the shared clients, warm the worker up, then report it ready until shutdown starts.
+
+    :param app: Application.
+    :type app: FastAPI
+    """
+    app.state.ready = False
+    log_pipeline.start()
+    await loop_monitor.start()
+    redis_client = await initialize_limiter()
+    await contact_events.start(redis_client)
+    idempotency_store.start(redis_client)
+    await replica_router.start(redis_client)
+    await warm_up([*shard_map.engines.values(), *replica_router.replicas], redis_client, settings.warmup_connections)
+    app.state.ready = True
+    try:
+        yield
+    finally:
+        app.state.ready = False
+        await contact_events.stop()
+        await replica_router.stop()
+        await redis_client.aclose()
+        await loop_monitor.stop()
+        log_pipeline.stop()
+
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -18,28 +93,45 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.middleware("http")(query_tracing_middleware)
+if settings.profiler_enabled:
+    app.add_middleware(ProfilerMiddleware)
+app.add_middleware(
+    IdempotencyMiddleware,
+    store=idempotency_store,
+    routes=[("POST", "/api/users/"), ("POST", "/api/auth/signup")],
+)
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=settings.compression_minimum_size,
+    level=settings.compression_level,
+    route_levels={"/api/users": settings.compression_list_level},
+)
+if settings.load_shedding_enabled:
+    # Added after the others, so it runs before them and a shed request costs almost nothing.
+    app.add_middleware(
+        LoadSheddingMiddleware,
+        monitor=loop_monitor,
+        max_lag=settings.load_shedding_max_lag_ms / 1000,
+        max_in_flight=settings.load_shedding_max_in_flight,
+        low_priority=[
+            ("GET", "/api/users/"),
+            ("GET", "/api/users/changes"),
+            ("GET", "/api/users/duplicates"),
+            ("GET", "/api/users/upcoming-birthdays"),
+            ("POST", "/api/batch"),
+        ],
+        critical=["/api/auth/refresh_token", "/api/profile/my_profile", "/ready", "/metrics"],
+        hard_factor=settings.load_shedding_hard_factor,
+        retry_after=settings.load_shedding_retry_after,
+    )
+# Outermost, so that shed requests and every log line of a request carry its id.
+app.add_middleware(RequestIdMiddleware)
 
 app.include_router(auth.router, prefix="/api")
 app.include_router(users.router, prefix="/api")
 app.include_router(profile.router, prefix='/api')
-
-async def initialize_limiter():
-    r = await redis.Redis(
-        host=settings.redis_host, 
-        port=settings.redis_port, 
-        db=0, 
-        encoding="utf-8", 
-        decode_responses=True
-    )
-    await FastAPILimiter.init(r)
-
-@app.on_event("startup")
-async def startup_event():
-    await initialize_limiter()
-
-@app.on_event("shutdown")
-async def shutdown_event():
-    await FastAPILimiter.redis.close()
+app.include_router(batch.router, prefix="/api")
 
 @app.get("/")
 def read_root():
@@ -51,5 +143,27 @@ def read_root():
     """
     return {"message": "USERS BOOK"}
 
+@app.get("/ready", include_in_schema=False)
+def read_ready():
+    """
+    Readiness probe: ``200`` once the worker is warmed up, ``503`` while it starts or shuts down.
+
+    :return: Readiness status.
+    :rtype: dict
+    """
+    if not getattr(app.state, "ready", False):
+        return ORJSONResponse({"status": "starting"}, status_code=503)
+    return {"status": "ready"}
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def read_metrics():
+    """
+    Metrics of this worker in the Prometheus text format.
+
+    :return: Metrics exposition.
+    :rtype: str
+    """
+    return metrics.render()
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    server.run()
@@ -5,8 +5,10 @@ from sqlalchemy import pool
 
 from alembic import context
 
+from src.conf.config import settings
 from src.database.models import Base
 from src.database.db import SQLALCHEMY_DATABASE_URL
+from src.database.shards import parse_shard_urls
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -48,6 +50,7 @@ def run_migrations_offline() -> None:
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        transaction_per_migration=True,
     )
 
     with context.begin_transaction():
@@ -60,22 +63,31 @@ def run_migrations_online() -> None:
     In this scenario we need to create an Engine
     and associate a connection with the context.
 
-    """
-    config.set_main_option("sqlalchemy.url", SQLALCHEMY_DATABASE_URL)
-    
-    connectable = engine_from_config(
-        config.get_section(config.config_ini_section, {}),
-        prefix="sqlalchemy.",
-        poolclass=pool.NullPool,
-    )
+    The primary database is migrated first, then every shard of
+    SHARD_DATABASE_URLS. Migrations read the name of their shard from
+    the ``shard_name`` option, None for the primary.
 
-    with connectable.connect() as connection:
-        context.configure(
-            connection=connection, target_metadata=target_metadata
+    """
+    urls = {None: SQLALCHEMY_DATABASE_URL, **parse_shard_urls(settings.shard_database_urls)}
+    for name, url in urls.items():
+        config.set_main_option("sqlalchemy.url", url)
+
+        connectable = engine_from_config(
+            config.get_section(config.config_ini_section, {}),
+            prefix="sqlalchemy.",
+            poolclass=pool.NullPool,
         )
 
-        with context.begin_transaction():
-            context.run_migrations()
+        with connectable.connect() as connection:
+            # Backfills commit batch by batch, see src/database/online.py: keep
+            # every migration in its own transaction around them.
+            context.configure(
+                connection=connection, target_metadata=target_metadata, shard_name=name,
+                transaction_per_migration=True,
+            )
+
+            with context.begin_transaction():
+                context.run_migrations()
 
 
 if context.is_offline_mode():
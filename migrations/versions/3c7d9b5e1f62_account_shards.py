@@ -0,0 +1,28 @@
+"""'Account shards'
+
+Revision ID: 3c7d9b5e1f62
+Revises: 9f3c2a71d4e8
+Create Date: 2026-10-19 16:41:09.530127
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c7d9b5e1f62'
+down_revision: Union[str, None] = '9f3c2a71d4e8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('accounts', sa.Column('shard', sa.String(length=50), nullable=True))
+    op.add_column('accounts', sa.Column('shard_locked', sa.Boolean(), server_default=sa.false(), nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('accounts', 'shard_locked')
+    op.drop_column('accounts', 'shard')
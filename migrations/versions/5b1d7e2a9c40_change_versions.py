@@ -0,0 +1,58 @@
+"""'Change versions'
+
+Revision ID: 5b1d7e2a9c40
+Revises: c8e290f36e13
+Create Date: 2026-10-19 10:12:31.402518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b1d7e2a9c40'
+down_revision: Union[str, None] = 'c8e290f36e13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('version', sa.BigInteger(), server_default='0', nullable=False))
+    op.add_column('users', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.create_index('ix_users_account_id_version', 'users', ['account_id', 'version'], unique=False)
+    op.create_table('account_versions',
+    sa.Column('account_id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.ForeignKeyConstraint(['account_id'], ['accounts.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('account_id')
+    )
+    op.create_table('user_tombstones',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('account_id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.Column('deleted_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['account_id'], ['accounts.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(
+        'ix_user_tombstones_account_id_version', 'user_tombstones', ['account_id', 'version'], unique=False
+    )
+    # Existing users all start at version 1, so a first sync with since=0 returns them.
+    op.execute("UPDATE users SET version = 1")
+    op.execute(
+        "INSERT INTO account_versions (account_id, version) "
+        "SELECT accounts.id, CASE WHEN EXISTS (SELECT 1 FROM users WHERE users.account_id = accounts.id) "
+        "THEN 1 ELSE 0 END FROM accounts"
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_user_tombstones_account_id_version', table_name='user_tombstones')
+    op.drop_table('user_tombstones')
+    op.drop_table('account_versions')
+    op.drop_index('ix_users_account_id_version', table_name='users')
+    op.drop_column('users', 'updated_at')
+    op.drop_column('users', 'version')
@@ -0,0 +1,125 @@
+"""'Additional data as JSONB'
+
+Revision ID: 7e4a1c9d2b83
+Revises: 3c7d9b5e1f62
+Create Date: 2026-10-19 18:02:44.871360
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from src.database import online, partitioning
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7e4a1c9d2b83'
+down_revision: Union[str, None] = '3c7d9b5e1f62'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 10_000
+
+# Free text that is not a JSON object is kept under a "note" attribute.
+TO_ATTRIBUTES = """
+CREATE OR REPLACE FUNCTION users_to_attributes(value text) RETURNS jsonb LANGUAGE plpgsql IMMUTABLE AS $$
+BEGIN
+    IF value IS NULL OR btrim(value) = '' THEN
+        RETURN NULL;
+    END IF;
+    BEGIN
+        IF jsonb_typeof(value::jsonb) = 'object' THEN
+            RETURN value::jsonb;
+        END IF;
+    EXCEPTION WHEN invalid_text_representation THEN
+        NULL;
+    END;
+    RETURN jsonb_build_object('note', value);
+END
+$$
+"""
+# Converts the rows written while the existing ones are copied.
+SYNC_ATTRIBUTES = """
+CREATE OR REPLACE FUNCTION users_sync_attributes() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.additional_data_jsonb := users_to_attributes(NEW.additional_data);
+    RETURN NEW;
+END
+$$
+"""
+
+
+def _tables(connection):
+    # users_partitioned exists while users is being copied into it, see tools/partition_users.py.
+    return [
+        table for table in ('users', 'users_partitioned')
+        if connection.execute(sa.text("SELECT to_regclass(:table)"), {"table": table}).scalar() is not None
+    ]
+
+
+def upgrade() -> None:
+    connection = op.get_bind()
+    if connection.dialect.name != 'postgresql':
+        op.execute("UPDATE users SET additional_data = NULL WHERE trim(additional_data) = ''")
+        op.execute(
+            "UPDATE users SET additional_data = json_object('note', additional_data) "
+            "WHERE additional_data IS NOT NULL "
+            "AND (NOT json_valid(additional_data) OR json_type(additional_data) != 'object')"
+        )
+        with op.batch_alter_table('users') as batch_op:
+            batch_op.alter_column('additional_data', type_=sa.JSON(), existing_nullable=True)
+        op.create_index('ix_users_additional_data', 'users', ['additional_data'], unique=False)
+        return
+    # The column is converted into a new one in batches rather than by a table rewrite that
+    # would lock users for its whole duration, then the columns are swapped.
+    tables = _tables(connection)
+    op.execute(TO_ATTRIBUTES)
+    op.execute(SYNC_ATTRIBUTES)
+    for table in tables:
+        op.add_column(table, sa.Column('additional_data_jsonb', postgresql.JSONB(), nullable=True))
+    op.execute(
+        "CREATE TRIGGER users_sync_attributes BEFORE INSERT OR UPDATE ON users "
+        "FOR EACH ROW EXECUTE FUNCTION users_sync_attributes()"
+    )
+    if 'users_partitioned' in tables:
+        partitioning.mirror(connection)
+
+    with op.get_context().autocommit_block():
+        last_id = op.get_bind().execute(sa.text("SELECT coalesce(max(id), 0) FROM users")).scalar()
+        for start in range(0, last_id, BATCH_SIZE):
+            op.get_bind().execute(sa.text(
+                "UPDATE users SET additional_data_jsonb = users_to_attributes(additional_data) "
+                "WHERE id > :start AND id <= :end"
+            ), {"start": start, "end": start + BATCH_SIZE})
+
+    op.execute("DROP TRIGGER users_sync_attributes ON users")
+    for table in tables:
+        op.drop_column(table, 'additional_data')
+        op.alter_column(table, 'additional_data_jsonb', new_column_name='additional_data')
+    if 'users_partitioned' in tables:
+        partitioning.mirror(connection)
+    op.execute("DROP FUNCTION users_sync_attributes()")
+    op.execute("DROP FUNCTION users_to_attributes(text)")
+
+    with op.get_context().autocommit_block():
+        for table in tables:
+            online.create_index_concurrently(
+                op.get_bind(), f'ix_{table}_additional_data', table, 'USING gin (additional_data jsonb_path_ops)'
+            )
+
+
+def downgrade() -> None:
+    connection = op.get_bind()
+    if connection.dialect.name != 'postgresql':
+        op.drop_index('ix_users_additional_data', table_name='users')
+        with op.batch_alter_table('users') as batch_op:
+            batch_op.alter_column('additional_data', type_=sa.Text(), existing_nullable=True)
+        return
+    for table in _tables(connection):
+        op.drop_index(f'ix_{table}_additional_data', table_name=table)
+        op.alter_column(
+            table, 'additional_data', type_=sa.Text(), existing_nullable=True,
+            postgresql_using='additional_data::text',
+        )
@@ -0,0 +1,89 @@
+"""'Partition users by account'
+
+Revision ID: 9f3c2a71d4e8
+Revises: 5b1d7e2a9c40
+Create Date: 2026-10-19 14:05:48.215904
+
+"""
+import logging
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from src.database import partitioning
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9f3c2a71d4e8'
+down_revision: Union[str, None] = '5b1d7e2a9c40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+logger = logging.getLogger("alembic.runtime.migration")
+
+# Larger tables are copied online with tools/partition_users.py instead of inside the migration.
+INLINE_COPY_LIMIT = 100_000
+BATCH_SIZE = 10_000
+
+
+def upgrade() -> None:
+    connection = op.get_bind()
+    if connection.dialect.name != "postgresql":
+        with op.batch_alter_table("users") as batch_op:
+            batch_op.alter_column("account_id", existing_type=sa.Integer(), nullable=False)
+        return
+    context = op.get_context()
+    with context.autocommit_block():
+        partitioning.require_account_ids(connection)
+    partitioning.create_partitioned_users(connection)
+    # Commits the new tables and the trigger, then every batch commits on its own.
+    with context.autocommit_block():
+        if partitioning.estimated_rows(connection, limit=INLINE_COPY_LIMIT) > INLINE_COPY_LIMIT:
+            logger.warning(
+                "users is large: writes are now mirrored into users_partitioned, "
+                "run tools/partition_users.py to copy the existing rows and swap the tables"
+            )
+            return
+        last_id = 0
+        while last_id is not None:
+            last_id = partitioning.backfill_batch(connection, last_id, BATCH_SIZE)
+    partitioning.swap(connection)
+
+
+def downgrade() -> None:
+    connection = op.get_bind()
+    if connection.dialect.name != "postgresql":
+        with op.batch_alter_table("users") as batch_op:
+            batch_op.alter_column("account_id", existing_type=sa.Integer(), nullable=True)
+        return
+    if not partitioning.is_partitioned(connection):
+        op.execute("DROP TRIGGER IF EXISTS users_mirror ON users")
+        op.execute("DROP FUNCTION IF EXISTS users_mirror_to_partitioned()")
+        op.execute("DROP TABLE IF EXISTS users_partitioned")
+        op.execute("ALTER TABLE users ALTER COLUMN account_id DROP NOT NULL")
+        return
+    # Rows written since the swap only exist in the partitioned table, so copy them back.
+    columns = partitioning.user_columns(connection)
+    op.execute("DROP TABLE IF EXISTS users_unpartitioned")
+    op.execute("ALTER TABLE users RENAME TO users_partitioned")
+    op.execute("ALTER INDEX users_pkey RENAME TO users_partitioned_pkey")
+    op.execute("ALTER INDEX ix_users_account_id_version RENAME TO ix_users_partitioned_account_id_version")
+    op.create_table('users',
+    sa.Column('id', sa.Integer(), server_default=sa.text("nextval('users_id_seq')"), nullable=False),
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('surname', sa.String(length=50), nullable=True),
+    sa.Column('email', sa.String(length=100), nullable=True),
+    sa.Column('phone', sa.String(length=20), nullable=True),
+    sa.Column('birthdate', sa.Date(), nullable=True),
+    sa.Column('additional_data', sa.Text(), nullable=True),
+    sa.Column('account_id', sa.Integer(), nullable=True),
+    sa.Column('version', sa.BigInteger(), server_default='0', nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['account_id'], ['accounts.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute(f"INSERT INTO users ({columns}) SELECT {columns} FROM users_partitioned")
+    op.execute("ALTER SEQUENCE users_id_seq OWNED BY users.id")
+    op.execute("DROP TABLE users_partitioned")
+    op.create_index('ix_users_account_id_version', 'users', ['account_id', 'version'], unique=False)
@@ -0,0 +1,74 @@
+"""'User phone keys'
+
+Revision ID: b2f8e6a4c1d9
+Revises: 7e4a1c9d2b83
+Create Date: 2026-10-19 19:27:13.094215
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from src.database import online, partitioning
+from src.services.phones import phone_keys
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b2f8e6a4c1d9'
+down_revision: Union[str, None] = '7e4a1c9d2b83'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+def _tables(connection):
+    if connection.dialect.name != 'postgresql':
+        return ['users']
+    # users_partitioned exists while users is being copied into it, see tools/partition_users.py.
+    return [
+        table for table in ('users', 'users_partitioned')
+        if connection.execute(sa.text("SELECT to_regclass(:table)"), {"table": table}).scalar() is not None
+    ]
+
+
+def upgrade() -> None:
+    connection = op.get_bind()
+    tables = _tables(connection)
+    for table in tables:
+        op.add_column(table, sa.Column('phone_e164', sa.String(length=16), nullable=True))
+        op.add_column(table, sa.Column('phone_suffix', sa.String(length=9), nullable=True))
+    if 'users_partitioned' in tables:
+        partitioning.mirror(connection)
+
+    with op.get_context().autocommit_block():
+        online.backfill_users(op.get_bind(), ['phone'], _phone_keys)
+
+    if connection.dialect.name != 'postgresql':
+        op.create_index('ix_users_account_id_phone_e164', 'users', ['account_id', 'phone_e164'], unique=False)
+        op.create_index('ix_users_account_id_phone_suffix', 'users', ['account_id', 'phone_suffix'], unique=False)
+        return
+    with op.get_context().autocommit_block():
+        for table in tables:
+            online.create_index_concurrently(
+                op.get_bind(), f'ix_{table}_account_id_phone_e164', table, '(account_id, phone_e164)'
+            )
+            online.create_index_concurrently(
+                op.get_bind(), f'ix_{table}_account_id_phone_suffix', table, '(account_id, phone_suffix)'
+            )
+
+
+def _phone_keys(row):
+    keys = phone_keys(row.phone)
+    return {'phone_e164': keys.e164, 'phone_suffix': keys.suffix}
+
+
+def downgrade() -> None:
+    connection = op.get_bind()
+    tables = _tables(connection)
+    for table in tables:
+        op.drop_index(f'ix_{table}_account_id_phone_suffix', table_name=table)
+        op.drop_index(f'ix_{table}_account_id_phone_e164', table_name=table)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('phone_suffix')
+            batch_op.drop_column('phone_e164')
+    if 'users_partitioned' in tables:
+        partitioning.mirror(connection)
@@ -0,0 +1,77 @@
+"""'User duplicate keys'
+
+Revision ID: d4a9c3e7f215
+Revises: b2f8e6a4c1d9
+Create Date: 2026-10-19 21:10:52.613384
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from src.database import online, partitioning
+from src.services.fingerprints import email_key, name_key
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4a9c3e7f215'
+down_revision: Union[str, None] = 'b2f8e6a4c1d9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+def _tables(connection):
+    if connection.dialect.name != 'postgresql':
+        return ['users']
+    # users_partitioned exists while users is being copied into it, see tools/partition_users.py.
+    return [
+        table for table in ('users', 'users_partitioned')
+        if connection.execute(sa.text("SELECT to_regclass(:table)"), {"table": table}).scalar() is not None
+    ]
+
+
+def upgrade() -> None:
+    connection = op.get_bind()
+    tables = _tables(connection)
+    for table in tables:
+        op.add_column(table, sa.Column('email_key', sa.String(length=100), nullable=True))
+        op.add_column(table, sa.Column('name_key', sa.String(length=50), nullable=True))
+        op.add_column(table, sa.Column('surname_key', sa.String(length=50), nullable=True))
+    if 'users_partitioned' in tables:
+        partitioning.mirror(connection)
+
+    with op.get_context().autocommit_block():
+        online.backfill_users(op.get_bind(), ['email', 'name', 'surname'], _duplicate_keys)
+
+    if connection.dialect.name != 'postgresql':
+        op.create_index('ix_users_account_id_email_key', 'users', ['account_id', 'email_key'], unique=False)
+        op.create_index(
+            'ix_users_account_id_name_key', 'users', ['account_id', 'name_key', 'surname_key'], unique=False
+        )
+        return
+    with op.get_context().autocommit_block():
+        for table in tables:
+            online.create_index_concurrently(
+                op.get_bind(), f'ix_{table}_account_id_email_key', table, '(account_id, email_key)'
+            )
+            online.create_index_concurrently(
+                op.get_bind(), f'ix_{table}_account_id_name_key', table, '(account_id, name_key, surname_key)'
+            )
+
+
+def _duplicate_keys(row):
+    return {'email_key': email_key(row.email), 'name_key': name_key(row.name), 'surname_key': name_key(row.surname)}
+
+
+def downgrade() -> None:
+    connection = op.get_bind()
+    tables = _tables(connection)
+    for table in tables:
+        op.drop_index(f'ix_{table}_account_id_name_key', table_name=table)
+        op.drop_index(f'ix_{table}_account_id_email_key', table_name=table)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('surname_key')
+            batch_op.drop_column('name_key')
+            batch_op.drop_column('email_key')
+    if 'users_partitioned' in tables:
+        partitioning.mirror(connection)
@@ -0,0 +1,30 @@
+"""'Tombstone retention'
+
+Revision ID: e6b2d8f4a310
+Revises: d4a9c3e7f215
+Create Date: 2026-10-20 09:41:17.208354
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e6b2d8f4a310'
+down_revision: Union[str, None] = 'd4a9c3e7f215'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'account_versions', sa.Column('pruned_version', sa.BigInteger(), server_default='0', nullable=False)
+    )
+    op.create_index('ix_user_tombstones_deleted_at', 'user_tombstones', ['deleted_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_user_tombstones_deleted_at', table_name='user_tombstones')
+    op.drop_column('account_versions', 'pruned_version')
@@ -0,0 +1,56 @@
+"""'Widen user IDs and give every shard its own block'
+
+Revision ID: f7a2c4e6b813
+Revises: e6b2d8f4a310
+Create Date: 2026-10-20 15:12:36.804127
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from src.database import shards
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f7a2c4e6b813'
+down_revision: Union[str, None] = 'e6b2d8f4a310'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    connection = op.get_bind()
+    if connection.dialect.name != "postgresql":
+        return
+    # Rewrites the tables: run it in a maintenance window on large databases.
+    op.execute("ALTER TABLE users ALTER COLUMN id TYPE BIGINT")
+    op.execute("ALTER TABLE user_tombstones ALTER COLUMN user_id TYPE BIGINT")
+    if connection.execute(sa.text("SELECT to_regclass('users_partitioned')")).scalar() is not None:
+        # Left by a partitioning of users still being copied, see tools/partition_users.py.
+        op.execute("ALTER TABLE users_partitioned ALTER COLUMN id TYPE BIGINT")
+    # migrations/env.py passes the shard name, None for the primary.
+    first, last = shards.user_id_range(op.get_context().opts.get("shard_name"))
+    sequence = connection.execute(sa.text("SELECT pg_get_serial_sequence('users', 'id')")).scalar()
+    top = connection.execute(
+        sa.text("SELECT coalesce(max(id), 0) FROM users WHERE id BETWEEN :first AND :last"),
+        {"first": first, "last": last},
+    ).scalar()
+    if top >= last:
+        raise RuntimeError(f"The user ID block {first}-{last} of this database is exhausted")
+    op.execute(
+        f"ALTER SEQUENCE {sequence} AS BIGINT MINVALUE {first} MAXVALUE {last} RESTART WITH {max(first, top + 1)}"
+    )
+
+
+def downgrade() -> None:
+    connection = op.get_bind()
+    if connection.dialect.name != "postgresql":
+        return
+    # Fails while users have IDs beyond the 32 bit range, e.g. in shards.
+    op.execute("ALTER TABLE user_tombstones ALTER COLUMN user_id TYPE INTEGER")
+    op.execute("ALTER TABLE users ALTER COLUMN id TYPE INTEGER")
+    sequence = connection.execute(sa.text("SELECT pg_get_serial_sequence('users', 'id')")).scalar()
+    top = connection.execute(sa.text("SELECT coalesce(max(id), 0) FROM users")).scalar()
+    op.execute(f"ALTER SEQUENCE {sequence} AS INTEGER NO MINVALUE NO MAXVALUE RESTART WITH {top + 1}")
@@ -1,3 +1,6 @@
+import os
+from typing import Optional
+
 from pydantic_settings import BaseSettings
 
 
@@ -8,6 +11,12 @@ class Settings(BaseSettings):
     postgres_port: int
 
     sqlalchemy_database_url: str
+    replica_database_urls: str = ""
+    replica_max_lag_seconds: float = 5.0
+    replica_check_seconds: float = 10.0
+    read_your_writes_seconds: float = 5.0
+    shard_database_urls: str = ""
+    shard_placement: str = ""
     secret_key: str
     algorithm: str
     mail_username: str
@@ -21,9 +30,103 @@ class Settings(BaseSettings):
     cloudinary_api_key: str
     cloudinary_api_secret: str
 
+    slow_query_ms: float = 100.0
+    n_plus_one_threshold: int = 5
+
+    profiler_enabled: bool = False
+    profiler_interval: float = 0.001
+    profiler_max_per_minute: int = 2
+    profiler_output_dir: Optional[str] = None
+
+    compression_minimum_size: int = 1024
+    compression_level: int = 5
+    compression_list_level: int = 4
+
+    events_buffer_size: int = 100
+    events_heartbeat_seconds: float = 15.0
+    tombstone_retention_days: int = 30
+
+    batch_max_operations: int = 20
+
+    phone_country_code: str = ""
+
+    idempotency_ttl_seconds: int = 86400
+    idempotency_lock_seconds: int = 60
+    idempotency_wait_seconds: float = 10.0
+
+    warmup_connections: int = 5
+
+    loop_lag_interval: float = 0.1
+    load_shedding_enabled: bool = True
+    load_shedding_max_lag_ms: float = 200.0
+    load_shedding_max_in_flight: int = 100
+    load_shedding_hard_factor: float = 2.0
+    load_shedding_retry_after: int = 5
+
+    cloudinary_timeout_seconds: float = 15.0
+    cloudinary_max_concurrent: int = 4
+    smtp_timeout_seconds: float = 10.0
+    smtp_max_concurrent: int = 4
+    redis_timeout_seconds: float = 0.5
+    redis_max_concurrent: int = 100
+    circuit_failure_threshold: int = 5
+    circuit_reset_seconds: float = 30.0
+
+    log_level: str = "INFO"
+    log_json: bool = True
+    log_debug_sample_rate: float = 0.1
+    log_queue_size: int = 10000
+
+    server_host: str = "0.0.0.0"
+    server_port: int = 8000
+    server_workers: int = 0
+    server_graceful_timeout: int = 30
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_connection_budget: int = 0
+    redis_connection_budget: int = 0
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
 
+    @property
+    def worker_count(self) -> int:
+        """
+        Number of server processes, one per CPU unless ``server_workers`` is set.
+
+        :rtype: int
+        """
+        return self.server_workers or os.cpu_count() or 1
+
+    def db_pool_options(self) -> dict:
+        """
+        Pool arguments of the engines of one worker.
+
+        With ``db_connection_budget`` set, the connections each database accepts from this
+        service are split between the workers, without overflow, so that adding workers
+        never exceeds the database limit. Otherwise every worker gets the fixed pool sizes.
+
+        :return: Keyword arguments of ``create_engine``.
+        :rtype: dict
+        """
+        if not self.db_connection_budget:
+            return {"pool_size": self.db_pool_size, "max_overflow": self.db_max_overflow}
+        return {"pool_size": max(1, self.db_connection_budget // self.worker_count), "max_overflow": 0}
+
+    def redis_max_connections(self) -> Optional[int]:
+        """
+        Redis connections of one worker, its share of ``redis_connection_budget``.
+
+        The contact events subscription holds one of them for good, see
+        :class:`src.services.events.ContactEventBus`; at least one more is left to the requests.
+
+        :return: Connection limit, None when unbounded.
+        :rtype: int or None
+        """
+        if not self.redis_connection_budget:
+            return None
+        return max(1, self.redis_connection_budget // self.worker_count - 1) + 1
+
 
 settings = Settings()
\ No newline at end of file
@@ -1,22 +1,140 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import time
+
+from fastapi import Request
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, sessionmaker
 from src.conf.config import settings
+from src.database.replicas import ReplicaRouter
+from src.database.shards import ShardMap, ShardedSession, parse_shard_urls
+from src.services.metrics import metrics
+from src.services.query_tracer import route_label
 
 
 SQLALCHEMY_DATABASE_URL = settings.sqlalchemy_database_url
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **settings.db_pool_options())
+
+# Loaded objects stay usable after a commit, without a reload checking a connection out again.
+SessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, bind=engine, class_=ShardedSession, expire_on_commit=False
+)
+
+ROUTE = "route"
+_HOLD_STARTS = "connection_hold_starts"
+_WRITTEN_ACCOUNTS = "written_accounts"
+
+metrics.describe("db_connection_holds_total", "Pooled connections checked out by request sessions")
+metrics.describe("db_connection_hold_seconds_total", "Time request sessions kept pooled connections checked out")
+
+shard_map = ShardMap(
+    engine,
+    {
+        name: create_engine(url, **settings.db_pool_options())
+        for name, url in parse_shard_urls(settings.shard_database_urls).items()
+    },
+    [name.strip() for name in settings.shard_placement.split(",") if name.strip()],
+)
+
+replica_router = ReplicaRouter(
+    [
+        create_engine(url.strip(), **settings.db_pool_options())
+        for url in settings.replica_database_urls.split(",") if url.strip()
+    ],
+    max_lag=settings.replica_max_lag_seconds,
+    sticky_seconds=settings.read_your_writes_seconds,
+    check_interval=settings.replica_check_seconds,
+)
+
+
+def track_connection_holds(session_factory: sessionmaker):
+    """
+    Count how long the sessions of a factory keep pool connections, per route.
+
+    A session checks a connection out when its transaction begins and returns it when the
+    transaction ends, so the hold time is measured between these two events.
+
+    :param session_factory: Session factory.
+    :type session_factory: sessionmaker
+    """
+
+    @event.listens_for(session_factory, "after_begin")
+    def _checked_out(session, transaction, connection):
+        session.info.setdefault(_HOLD_STARTS, []).append(time.perf_counter())
+
+    @event.listens_for(session_factory, "after_transaction_end")
+    def _returned(session, transaction):
+        if transaction.parent is not None:
+            return
+        starts = session.info.pop(_HOLD_STARTS, None)
+        if starts:
+            now = time.perf_counter()
+            route = session.info.get(ROUTE, "-")
+            metrics.inc("db_connection_holds_total", len(starts), route=route)
+            metrics.inc("db_connection_hold_seconds_total", sum(now - start for start in starts), route=route)
+
+
+track_connection_holds(SessionLocal)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+def note_write(db: Session, account_id: int):
+    """
+    Keep the reads of an account on the primary once the session commits its write.
+
+    Nothing is marked when the transaction rolls back, e.g. after a conditional write that
+    matched no row.
+
+    :param db: Session writing the account's users
+    :type db: Session
+    :param account_id: Account ID
+    :type account_id: int
+    """
+    db.info.setdefault(_WRITTEN_ACCOUNTS, set()).add(account_id)
+
+
+@event.listens_for(ShardedSession, "after_commit")
+def _mark_writes(session):
+    for account_id in session.info.pop(_WRITTEN_ACCOUNTS, ()):
+        replica_router.mark_write(account_id)
+
+
+@event.listens_for(ShardedSession, "after_soft_rollback")
+def _forget_writes(session, previous_transaction):
+    session.info.pop(_WRITTEN_ACCOUNTS, None)
 
-def get_db():
+
+def release(db: Session):
+    """
+    Ends the transaction of a session after read-only work, returning its connection to the pool.
+
+    Objects loaded by request sessions are not expired, so they stay usable and the session
+    only checks a connection out again for its next query. Only call it when the transaction
+    wrote nothing: it commits.
+
+    :param db: Session
+    :type db: Session
     """
-    Creates local database session
+    if db.in_transaction() and not (db.new or db.dirty or db.deleted):
+        db.commit()
+
+
+def get_db(request: Request):
+    """
+    Creates local database session, or reuses the session of the enclosing batch request.
+    The contacts queries go to the account shard once ``get_current_user`` resolved it.
+
+    The session checks a connection out at its first query and returns it at each commit, or
+    at :func:`release` after reads, so slow work later in the request (password hashing,
+    uploads, serialization) does not keep it from the pool.
     
+    :param request: Current request
+    :type request: Request
     :return: Session
     :rtype: sqlalchemy.orm.Session
     """
-    db = SessionLocal()
+    batch = request.scope.get("batch")
+    if batch is not None:
+        yield batch.db
+        return
+    db = SessionLocal(info={ROUTE: route_label(request.scope)})
     try:
         yield db
     finally:
@@ -1,6 +1,7 @@
-from sqlalchemy import Column, Integer, String, Date, Text, Boolean
+from sqlalchemy import Column, Integer, BigInteger, String, Date, DateTime, Boolean, Index, JSON, func, false
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.sql.schema import ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, backref
 from sqlalchemy.orm import declarative_base
 
 Base = declarative_base()
@@ -9,22 +10,84 @@ Base = declarative_base()
 class User(Base):
     """
     Model for Users in DB
+
+    On PostgreSQL the table is hash partitioned by ``account_id`` with the primary key
+    ``(account_id, id)``, see :mod:`src.database.partitioning`; ``id`` stays unique through
+    its sequence and remains the ORM identity. ``additional_data`` is a JSON object, stored as
+    ``JSONB`` with a GIN index for attribute filters. ``phone_e164`` and ``phone_suffix`` are
+    the lookup keys of ``phone``, see :mod:`src.services.phones`; ``email_key``, ``name_key``
+    and ``surname_key`` the duplicate detection keys, see :mod:`src.services.fingerprints`.
     """
     __tablename__ = "users"
-    id = Column(Integer, primary_key=True)
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
     name = Column(String(50), nullable=False)
     surname = Column(String(50))
     email = Column(String(100))
     phone = Column(String(20))
+    phone_e164 = Column(String(16), nullable=True)
+    phone_suffix = Column(String(9), nullable=True)
+    email_key = Column(String(100), nullable=True)
+    name_key = Column(String(50), nullable=True)
+    surname_key = Column(String(50), nullable=True)
     birthdate = Column(Date)
-    additional_data = Column(Text, nullable=True)
-    account_id = Column("account_id", ForeignKey("accounts.id", ondelete="CASCADE"), default=None)
+    additional_data = Column(
+        JSON(none_as_null=True).with_variant(JSONB(none_as_null=True), "postgresql"), nullable=True
+    )
+    account_id = Column("account_id", ForeignKey("accounts.id", ondelete="CASCADE"), nullable=False)
+    version = Column(BigInteger, nullable=False, default=0, server_default="0")
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
     login = relationship("Account", backref="users")
 
+    __table_args__ = (
+        Index("ix_users_account_id_version", "account_id", "version"),
+        Index("ix_users_account_id_phone_e164", "account_id", "phone_e164"),
+        Index("ix_users_account_id_phone_suffix", "account_id", "phone_suffix"),
+        Index("ix_users_account_id_email_key", "account_id", "email_key"),
+        Index("ix_users_account_id_name_key", "account_id", "name_key", "surname_key"),
+        Index(
+            "ix_users_additional_data", "additional_data",
+            postgresql_using="gin", postgresql_ops={"additional_data": "jsonb_path_ops"},
+        ),
+    )
+
+
+class UserTombstone(Base):
+    """
+    Model for deleted Users, kept so sync clients can learn about deletions
+    """
+    __tablename__ = "user_tombstones"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(BigInteger, nullable=False)
+    account_id = Column(ForeignKey("accounts.id", ondelete="CASCADE"), nullable=False)
+    version = Column(BigInteger, nullable=False)
+    deleted_at = Column(DateTime, default=func.now())
+
+    __table_args__ = (
+        Index("ix_user_tombstones_account_id_version", "account_id", "version"),
+        Index("ix_user_tombstones_deleted_at", "deleted_at"),
+    )
+
+
+class AccountVersion(Base):
+    """
+    Model for the last change version of an Account's users
+
+    ``pruned_version`` is the newest version whose tombstone was pruned: clients that last
+    synced before it may have missed a deletion and must sync again from scratch.
+    """
+    __tablename__ = "account_versions"
+    account_id = Column(ForeignKey("accounts.id", ondelete="CASCADE"), primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+    pruned_version = Column(BigInteger, nullable=False, default=0, server_default="0")
+    account = relationship("Account", backref=backref("version_counter", uselist=False))
+
 
 class Account(Base):
     """
     Model for Accounts in DB
+
+    ``shard`` names the database holding the account's contacts, None for the primary one,
+    see :mod:`src.database.shards`.
     """
     __tablename__ = "accounts"
     id = Column(Integer, primary_key=True)
@@ -34,3 +97,5 @@ class Account(Base):
     avatar = Column(String(255), nullable=True)
     refresh_token = Column(String(255), nullable=True)
     confirmed = Column(Boolean, default=False)
+    shard = Column(String(50), nullable=True)
+    shard_locked = Column(Boolean, nullable=False, default=False, server_default=false())
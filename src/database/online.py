@@ -0,0 +1,96 @@
+"""
+Changes to the ``users`` table that let the application keep writing, for migrations.
+
+Both helpers expect a connection in autocommit mode, inside
+``op.get_context().autocommit_block()``: every statement then commits on its own, so no
+lock is held for longer than one batch.
+"""
+from typing import Callable, Dict, Sequence
+
+import sqlalchemy as sa
+from sqlalchemy.engine import Connection, Row
+
+from src.database.partitioning import is_partitioned
+
+
+BATCH_SIZE = 10_000
+
+
+def backfill_users(
+    connection: Connection, columns: Sequence[str], compute: Callable[[Row], Dict], batch_size: int = BATCH_SIZE
+):
+    """
+    Write values computed in Python into every row of ``users``, in batches of increasing IDs.
+
+    Rows are updated on ``(account_id, id)``, so each update only touches one partition of a
+    partitioned ``users``. Rows without an account get their own ``account_id IS NULL``
+    statement, a comparison with NULL would never match them.
+
+    :param connection: Connection in autocommit mode.
+    :type connection: Connection
+    :param columns: Columns read besides ``id`` and ``account_id``.
+    :type columns: Sequence[str]
+    :param compute: Function of a row returning the new values by column name.
+    :type compute: Callable[[Row], dict]
+    :param batch_size: Rows per batch.
+    :type batch_size: int
+    """
+    source = sa.table("users", *(sa.column(name) for name in ("id", "account_id", *columns)))
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(*source.c).where(source.c.id > last_id).order_by(source.c.id).limit(batch_size)
+        ).all()
+        if not rows:
+            return
+        computed = [compute(row) for row in rows]
+        target = sa.table("users", *(sa.column(name) for name in ("id", "account_id", *computed[0])))
+        # Bind names must differ from the column names.
+        update = target.update().values({name: sa.bindparam(f"new_{name}") for name in computed[0]})
+        values = [
+            {"row_id": row.id, "row_account_id": row.account_id, **{f"new_{key}": value for key, value in new.items()}}
+            for row, new in zip(rows, computed)
+        ]
+        owned = [row for row in values if row["row_account_id"] is not None]
+        orphans = [row for row in values if row["row_account_id"] is None]
+        if owned:
+            connection.execute(update.where(
+                target.c.id == sa.bindparam("row_id"), target.c.account_id == sa.bindparam("row_account_id")
+            ), owned)
+        if orphans:
+            connection.execute(
+                update.where(target.c.id == sa.bindparam("row_id"), target.c.account_id.is_(None)), orphans,
+            )
+        last_id = rows[-1].id
+
+
+def create_index_concurrently(connection: Connection, name: str, table: str, definition: str):
+    """
+    Build an index without blocking the writes to the table (PostgreSQL).
+
+    Partitioned tables do not support ``CREATE INDEX CONCURRENTLY``: their index is created
+    invalid on the parent only, then built concurrently on every partition and attached, which
+    makes it valid once all partitions have theirs.
+
+    :param connection: Connection in autocommit mode.
+    :type connection: Connection
+    :param name: Index name.
+    :type name: str
+    :param table: Table name.
+    :type table: str
+    :param definition: Index definition following the table name, e.g. ``(account_id, phone_e164)``.
+    :type definition: str
+    """
+    if not is_partitioned(connection, table):
+        connection.execute(sa.text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {definition}"))
+        return
+    connection.execute(sa.text(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY {table} {definition}"))
+    partitions = connection.execute(sa.text(
+        "SELECT child.relname FROM pg_inherits JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid "
+        "WHERE pg_inherits.inhparent = CAST(:table AS regclass) ORDER BY child.relname"
+    ), {"table": table}).scalars().all()
+    for number, partition in enumerate(partitions):
+        connection.execute(sa.text(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name}_p{number} ON {partition} {definition}"
+        ))
+        connection.execute(sa.text(f"ALTER INDEX {name} ATTACH PARTITION {name}_p{number}"))
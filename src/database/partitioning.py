@@ -0,0 +1,234 @@
+"""
+Online conversion of ``users`` into a table hash partitioned by ``account_id`` (PostgreSQL).
+
+1. :func:`require_account_ids` makes ``users.account_id`` NOT NULL, one short transaction
+   per step.
+2. :func:`create_partitioned_users` creates ``users_partitioned`` with its partitions and a
+   trigger mirroring every write on ``users`` into it.
+3. :func:`backfill_batch` copies existing rows in primary key order, one short transaction
+   per batch, while the application keeps running.
+4. :func:`swap` renames the tables in one short transaction, ``users`` becomes partitioned.
+"""
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+
+USER_PARTITIONS = 16
+
+MIRROR_FUNCTION = """
+CREATE OR REPLACE FUNCTION users_mirror_to_partitioned() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM users_partitioned WHERE account_id = OLD.account_id AND id = OLD.id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO users_partitioned ({columns}) VALUES ({values})
+        ON CONFLICT (account_id, id) DO NOTHING;
+    END IF;
+    RETURN NULL;
+END
+$$
+"""
+
+
+def user_columns(connection: Connection) -> str:
+    """
+    Column list of the ``users`` table, read from the catalog so later migrations are mirrored too.
+
+    :param connection: Connection.
+    :type connection: Connection
+    :return: Comma separated column names.
+    :rtype: str
+    """
+    return ", ".join(connection.execute(text(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = 'users' ORDER BY ordinal_position"
+    )).scalars())
+
+
+def mirror(connection: Connection):
+    """
+    (Re)create the trigger mirroring every write on ``users`` into ``users_partitioned``.
+
+    Run it again after adding columns to both tables.
+
+    :param connection: Connection in a transaction.
+    :type connection: Connection
+    """
+    columns = user_columns(connection)
+    values = ", ".join(f"NEW.{column.strip()}" for column in columns.split(","))
+    connection.execute(text(MIRROR_FUNCTION.format(columns=columns, values=values)))
+    connection.execute(text("DROP TRIGGER IF EXISTS users_mirror ON users"))
+    connection.execute(text(
+        "CREATE TRIGGER users_mirror AFTER INSERT OR UPDATE OR DELETE ON users "
+        "FOR EACH ROW EXECUTE FUNCTION users_mirror_to_partitioned()"
+    ))
+
+
+def require_account_ids(connection: Connection):
+    """
+    Make ``users.account_id`` NOT NULL, a partition key cannot be NULL.
+
+    A ``NOT VALID`` check constraint first stops new NULL rows without scanning the table,
+    its validation then lets writes through, and PostgreSQL sets NOT NULL from the validated
+    constraint without a second scan. Every step commits on its own, so the exclusive locks
+    of the ``ALTER TABLE`` statements are only held for catalog changes, never for a scan.
+
+    :param connection: Connection in autocommit mode.
+    :type connection: Connection
+    :raises RuntimeError: If users without an account exist, they would never be copied.
+    """
+    connection.execute(text("ALTER TABLE users DROP CONSTRAINT IF EXISTS users_account_id_not_null"))
+    connection.execute(text(
+        "ALTER TABLE users ADD CONSTRAINT users_account_id_not_null CHECK (account_id IS NOT NULL) NOT VALID"
+    ))
+    orphans = connection.execute(text("SELECT count(*) FROM users WHERE account_id IS NULL")).scalar()
+    if orphans:
+        connection.execute(text("ALTER TABLE users DROP CONSTRAINT users_account_id_not_null"))
+        raise RuntimeError(
+            f"{orphans} users have no account_id and cannot be partitioned, delete them or assign them an account"
+        )
+    connection.execute(text("ALTER TABLE users VALIDATE CONSTRAINT users_account_id_not_null"))
+    connection.execute(text("ALTER TABLE users ALTER COLUMN account_id SET NOT NULL"))
+    connection.execute(text("ALTER TABLE users DROP CONSTRAINT users_account_id_not_null"))
+
+
+def create_partitioned_users(connection: Connection, partitions: int = USER_PARTITIONS):
+    """
+    Create ``users_partitioned`` and start mirroring the writes on ``users`` into it.
+
+    ``users.account_id`` must be NOT NULL already, see :func:`require_account_ids`. The table
+    copies the columns and defaults of ``users``. The primary key and the
+    ``(account_id, version)`` index are declared on the parent table, so every partition
+    gets its own local copy of them.
+
+    :param connection: Connection in a transaction.
+    :type connection: Connection
+    :param partitions: Number of hash partitions.
+    :type partitions: int
+    """
+    connection.execute(text("""
+        CREATE TABLE users_partitioned (
+            LIKE users INCLUDING DEFAULTS,
+            CONSTRAINT users_partitioned_pkey PRIMARY KEY (account_id, id),
+            CONSTRAINT users_partitioned_account_id_fkey FOREIGN KEY (account_id)
+                REFERENCES accounts (id) ON DELETE CASCADE
+        ) PARTITION BY HASH (account_id)
+    """))
+    for remainder in range(partitions):
+        connection.execute(text(
+            f"CREATE TABLE users_partitioned_p{remainder} PARTITION OF users_partitioned "
+            f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})"
+        ))
+    connection.execute(text(
+        "CREATE INDEX ix_users_partitioned_account_id_version ON users_partitioned (account_id, version)"
+    ))
+    mirror(connection)
+
+
+def estimated_rows(connection: Connection, table: str = "users", limit: int = 0) -> int:
+    """
+    Number of rows of a table, as estimated by the planner statistics.
+
+    A table never analyzed has no estimate: its rows are counted then, up to ``limit + 1``.
+
+    :param connection: Connection.
+    :type connection: Connection
+    :param table: Table name.
+    :type table: str
+    :param limit: Rows to count at most, plus one, when there is no estimate.
+    :type limit: int
+    :rtype: int
+    """
+    estimate = connection.execute(
+        text("SELECT reltuples FROM pg_class WHERE oid = CAST(:table AS regclass)"), {"table": table}
+    ).scalar()
+    if estimate >= 0:
+        return int(estimate)
+    return connection.execute(
+        text(f"SELECT count(*) FROM (SELECT 1 FROM {table} LIMIT :limit) AS sample"), {"limit": limit + 1}
+    ).scalar()
+
+
+def backfill_batch(connection: Connection, after_id: int, batch_size: int) -> Optional[int]:
+    """
+    Copy the next batch of existing users into ``users_partitioned``.
+
+    Source rows are locked ``FOR SHARE`` until the batch commits, so a concurrent update or
+    delete waits and is then mirrored by the trigger; rows the trigger already copied win.
+
+    :param connection: Connection in a transaction, commit it after every batch.
+    :type connection: Connection
+    :param after_id: Last user ID copied by the previous batch.
+    :type after_id: int
+    :param batch_size: Number of users per batch.
+    :type batch_size: int
+    :return: Last user ID of the batch, None when no users are left.
+    :rtype: int or None
+    """
+    columns = user_columns(connection)
+    return connection.execute(text(f"""
+        WITH batch AS (
+            SELECT {columns} FROM users
+            WHERE id > :after_id
+            ORDER BY id
+            LIMIT :batch_size
+            FOR SHARE
+        ), copied AS (
+            INSERT INTO users_partitioned ({columns})
+            SELECT {columns} FROM batch
+            ON CONFLICT (account_id, id) DO NOTHING
+        )
+        SELECT max(id) FROM batch
+    """), {"after_id": after_id, "batch_size": batch_size}).scalar()
+
+
+def swap(connection: Connection, partitions: int = USER_PARTITIONS):
+    """
+    Make the partitioned table the ``users`` table, keeping the old one as ``users_unpartitioned``.
+
+    Takes an exclusive lock on ``users`` for the duration of the renames only.
+
+    :param connection: Connection in a transaction.
+    :type connection: Connection
+    :param partitions: Number of hash partitions.
+    :type partitions: int
+    """
+    connection.execute(text("LOCK TABLE users IN ACCESS EXCLUSIVE MODE"))
+    connection.execute(text("DROP TRIGGER users_mirror ON users"))
+    connection.execute(text("DROP FUNCTION users_mirror_to_partitioned()"))
+    connection.execute(text("ALTER TABLE users RENAME TO users_unpartitioned"))
+    _rename_indexes(connection, "users_unpartitioned", "users", "users_unpartitioned")
+    connection.execute(text("ALTER TABLE users_partitioned RENAME TO users"))
+    _rename_indexes(connection, "users", "users_partitioned", "users")
+    for remainder in range(partitions):
+        connection.execute(text(f"ALTER TABLE users_partitioned_p{remainder} RENAME TO users_p{remainder}"))
+    connection.execute(text("ALTER SEQUENCE users_id_seq OWNED BY users.id"))
+
+
+def _rename_indexes(connection: Connection, table: str, old: str, new: str):
+    # users_pkey -> users_unpartitioned_pkey, ix_users_partitioned_version -> ix_users_version, ...
+    names = connection.execute(text(
+        "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = :table"
+    ), {"table": table}).scalars().all()
+    for name in names:
+        if name.startswith((f"{old}_", f"ix_{old}_")):
+            renamed = name.replace(old, new, 1)
+            connection.execute(text(f'ALTER INDEX "{name}" RENAME TO "{renamed}"'))
+
+
+def is_partitioned(connection: Connection, table: str = "users") -> bool:
+    """
+    Whether a table, by default ``users``, is partitioned.
+
+    :param connection: Connection.
+    :type connection: Connection
+    :param table: Table name.
+    :type table: str
+    :rtype: bool
+    """
+    return bool(connection.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = CAST(:table AS regclass))"
+    ), {"table": table}).scalar())
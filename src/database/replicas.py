@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Set
+
+from redis.exceptions import RedisError
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+from starlette.concurrency import run_in_threadpool
+
+
+logger = logging.getLogger(__name__)
+
+STICKY_PREFIX = "replicas:sticky:"
+POSTGRES_LAG = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+class ReplicaRouter:
+    """
+    Picks the engine for read-only repository queries.
+
+    Reads are spread round-robin over the replicas that passed the last health check and lag
+    behind the primary by at most ``max_lag`` seconds. After an account writes, its reads stay
+    on the primary for ``sticky_seconds``, so a client always reads its own writes. The sticky
+    mark is shared by the workers through Redis when it is available.
+
+    :param replicas: Replica engines, reads use the primary when empty.
+    :type replicas: list[Engine]
+    :param max_lag: Largest accepted replication lag, in seconds.
+    :type max_lag: float
+    :param sticky_seconds: How long an account reads from the primary after a write, in seconds.
+    :type sticky_seconds: float
+    :param check_interval: Health check period, in seconds.
+    :type check_interval: float
+    """
+
+    def __init__(self, replicas: List[Engine], max_lag: float, sticky_seconds: float, check_interval: float):
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.sticky_seconds = max(sticky_seconds, max_lag)
+        self.check_interval = check_interval
+        self.redis = None
+        self.lag: Dict[Engine, Optional[float]] = {engine: 0.0 for engine in replicas}
+        self._next = 0
+        self._sticky: Dict[int, float] = {}
+        self._shares: Set[asyncio.Task] = set()
+        self._checker = None
+
+    async def start(self, redis=None):
+        """
+        Check the replicas now and then every ``check_interval`` seconds.
+
+        :param redis: Redis client sharing sticky accounts between workers.
+        :type redis: redis.asyncio.Redis, optional
+        """
+        self.redis = redis
+        if self.replicas:
+            await self.check()
+            self._checker = asyncio.create_task(self._check_periodically())
+
+    async def stop(self):
+        """
+        Stop the health checks, after the sticky marks being shared reached Redis.
+        """
+        if self._checker is not None:
+            self._checker.cancel()
+            self._checker = None
+        if self._shares:
+            await asyncio.gather(*self._shares, return_exceptions=True)
+        self.redis = None
+
+    async def check(self):
+        """
+        Measure the lag of every replica, an unreachable replica gets no reads until the next check.
+        """
+        for engine in self.replicas:
+            try:
+                self.lag[engine] = await run_in_threadpool(_measure_lag, engine)
+            except SQLAlchemyError as e:
+                logger.warning("Replica %s is unavailable: %s", engine.url.render_as_string(), e)
+                self.lag[engine] = None
+
+    def healthy(self) -> List[Engine]:
+        """
+        Replicas eligible for reads.
+
+        :rtype: list[Engine]
+        """
+        return [engine for engine in self.replicas if self.lag[engine] is not None and self.lag[engine] <= self.max_lag]
+
+    def mark_write(self, account_id: int):
+        """
+        Keep the reads of an account on the primary for a while after it committed a write.
+
+        :param account_id: Account ID.
+        :type account_id: int
+        """
+        if not self.replicas:
+            return
+        self._sticky[account_id] = time.monotonic() + self.sticky_seconds
+        if self.redis is not None:
+            # The loop only keeps weak references to tasks, hold this one until it is done.
+            task = asyncio.get_running_loop().create_task(self._share_write(account_id))
+            self._shares.add(task)
+            task.add_done_callback(self._shares.discard)
+
+    async def read_bind(self, account_id: int) -> Optional[Engine]:
+        """
+        Engine for a read-only query of an account.
+
+        :param account_id: Account ID.
+        :type account_id: int
+        :return: Replica engine, or None to read from the primary.
+        :rtype: Engine or None
+        """
+        if not self.replicas:
+            return None
+        healthy = self.healthy()
+        if not healthy or await self._is_sticky(account_id):
+            return None
+        self._next = (self._next + 1) % len(healthy)
+        return healthy[self._next]
+
+    async def _is_sticky(self, account_id: int) -> bool:
+        deadline = self._sticky.get(account_id)
+        if deadline is not None:
+            if deadline > time.monotonic():
+                return True
+            del self._sticky[account_id]
+        if self.redis is not None:
+            try:
+                return bool(await self.redis.exists(f"{STICKY_PREFIX}{account_id}"))
+            except RedisError as e:
+                logger.warning("Could not read sticky account %s: %s", account_id, e)
+        return False
+
+    async def _share_write(self, account_id: int):
+        try:
+            await self.redis.set(f"{STICKY_PREFIX}{account_id}", 1, px=int(self.sticky_seconds * 1000))
+        except RedisError as e:
+            logger.warning("Could not share sticky account %s: %s", account_id, e)
+
+    async def _check_periodically(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            await self.check()
+
+
+def _measure_lag(engine: Engine) -> float:
+    with engine.connect() as connection:
+        if engine.dialect.name == "postgresql":
+            return float(connection.execute(POSTGRES_LAG).scalar() or 0.0)
+        connection.execute(text("SELECT 1"))
+        return 0.0
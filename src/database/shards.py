@@ -0,0 +1,385 @@
+"""
+Account based sharding of the contacts tables over several databases.
+
+The primary database keeps the ``accounts`` table, the directory of which shard holds the
+contacts of each account. The ``users``, ``user_tombstones`` and ``account_versions`` rows of
+an account all live in its shard, so every query of a request stays in one database.
+Shards run the same migrations as the primary and keep a credential-less copy of the
+``accounts`` row of their accounts, only referenced by the foreign keys.
+"""
+import logging
+import time
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, func, insert, select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from src.database.models import Account, AccountVersion, User, UserTombstone
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SHARD = "default"
+SHARDED_TABLES = frozenset((User.__tablename__, UserTombstone.__tablename__, AccountVersion.__tablename__))
+SHARD_BIND = "shard_bind"
+# Every database hands out user IDs from its own block of the 64 bit users.id, so users keep
+# their ID when their account moves to another shard. The primary has block 0, which holds
+# the IDs handed out before the blocks existed.
+USER_ID_BLOCK = 2 ** 40
+USER_ID_BLOCKS = 2 ** 63 // USER_ID_BLOCK
+BUMP_USER_IDS = text("""
+    SELECT setval(sequence.id, ids.max_id)
+    FROM (SELECT CAST(pg_get_serial_sequence('users', 'id') AS regclass) AS id) AS sequence
+    JOIN pg_sequences AS s ON CAST(format('%I.%I', s.schemaname, s.sequencename) AS regclass) = sequence.id
+    CROSS JOIN LATERAL (SELECT max(id) AS max_id FROM users WHERE id BETWEEN s.min_value AND s.max_value) AS ids
+    WHERE ids.max_id > coalesce(s.last_value, 0)
+""")
+
+
+class ShardUnavailable(Exception):
+    """
+    Raised for an account whose contacts are being moved to another shard.
+    """
+
+
+class ShardedSession(Session):
+    """
+    Session sending the queries on the contacts tables to the shard of the current account.
+
+    The shard is set by :meth:`ShardMap.bind` once the account is known, all other queries and
+    sessions without a shard use the session bind, the primary database.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        shard = self.info.get(SHARD_BIND)
+        if shard is not None and mapper is not None and mapper.local_table.name in SHARDED_TABLES:
+            return shard
+        return super().get_bind(mapper=mapper, clause=clause, **kw)
+
+
+def parse_shard_urls(value: str) -> Dict[str, str]:
+    """
+    Parses a ``name=url,name=url`` setting.
+
+    :param value: Setting value.
+    :type value: str
+    :return: Database URL by shard name.
+    :rtype: dict[str, str]
+    :raises ValueError: If an entry has no name or uses the reserved name.
+    """
+    urls = {}
+    for entry in value.split(","):
+        if not entry.strip():
+            continue
+        name, separator, url = entry.partition("=")
+        name = name.strip()
+        if not separator or not name or name == DEFAULT_SHARD:
+            raise ValueError(f"Invalid shard entry {entry.strip()!r}, expected name=url")
+        urls[name] = url.strip()
+    return urls
+
+
+class ShardMap:
+    """
+    Assigns accounts to databases.
+
+    :param primary: Engine of the primary database, which is also the ``default`` shard.
+    :type primary: Engine
+    :param shards: Engines of the other shards by name.
+    :type shards: dict[str, Engine]
+    :param placement: Shards receiving new accounts, all shards when empty.
+    :type placement: list[str]
+    """
+
+    def __init__(self, primary: Engine, shards: Dict[str, Engine], placement: Optional[List[str]] = None):
+        self.primary = primary
+        self.engines = {DEFAULT_SHARD: primary, **shards}
+        check_user_id_blocks(self.engines)
+        self.placement = placement or list(self.engines)
+        unknown = set(self.placement).difference(self.engines)
+        if unknown:
+            raise ValueError(f"Unknown shards in placement: {', '.join(sorted(unknown))}")
+
+    def engine(self, name: Optional[str]) -> Engine:
+        """
+        Engine of a shard.
+
+        :param name: Shard name, None for the default shard.
+        :type name: str, optional
+        :rtype: Engine
+        """
+        return self.engines[name or DEFAULT_SHARD]
+
+    def shard_engine(self, account: Account) -> Optional[Engine]:
+        """
+        Engine holding the contacts of an account.
+
+        :param account: Account.
+        :type account: Account
+        :return: Shard engine, None when the contacts live in the primary database.
+        :rtype: Engine or None
+        :raises ShardUnavailable: If the account is being moved.
+        """
+        if account.shard_locked:
+            raise ShardUnavailable(account.id)
+        if not account.shard or account.shard == DEFAULT_SHARD:
+            return None
+        return self.engine(account.shard)
+
+    def bind(self, db: Session, account: Account):
+        """
+        Route the contacts queries of a session to the shard of an account.
+
+        :param db: Request session.
+        :type db: Session
+        :param account: Authenticated account.
+        :type account: Account
+        :raises ShardUnavailable: If the account is being moved.
+        """
+        shard = self.shard_engine(account)
+        if shard is not None:
+            db.info[SHARD_BIND] = shard
+
+    def place(self, email: str) -> Optional[str]:
+        """
+        Shard of a new account, stable for an email address.
+
+        :param email: Account email.
+        :type email: str
+        :return: Shard name, None for the default shard.
+        :rtype: str or None
+        """
+        name = self.placement[zlib.crc32(email.lower().encode()) % len(self.placement)]
+        return None if name == DEFAULT_SHARD else name
+
+    def register(self, account: Account):
+        """
+        Prepare the shard of a new account: copy its ``accounts`` row and start its version counter.
+
+        :param account: Account committed in the primary database.
+        :type account: Account
+        """
+        if not account.shard or account.shard == DEFAULT_SHARD:
+            return
+        with Session(self.engine(account.shard)) as db:
+            _ensure_account_row(db, account)
+            ensure_version_counter(db, account.id)
+            db.commit()
+
+
+def is_sharded(db: Session) -> bool:
+    """
+    Whether the contacts of the session account live outside the primary database.
+
+    Read replicas only follow the primary, so these reads always go to the shard.
+
+    :param db: Request session.
+    :type db: Session
+    :rtype: bool
+    """
+    return SHARD_BIND in db.info
+
+
+def ensure_version_counter(db: Session, account_id: int):
+    """
+    Create the version counter row of an account, unless it exists.
+
+    Concurrent first writes of an account may both get here: the insert skips an existing
+    row instead of failing on the primary key.
+
+    :param db: Session
+    :type db: Session
+    :param account_id: Account ID.
+    :type account_id: int
+    """
+    dialect = db.get_bind(AccountVersion.__mapper__).dialect.name
+    stmt = (postgresql.insert if dialect == "postgresql" else sqlite.insert)(AccountVersion)
+    db.execute(stmt.values(account_id=account_id, version=0).on_conflict_do_nothing())
+
+
+def user_id_block(name: Optional[str]) -> int:
+    """
+    Block of user IDs of a database.
+
+    Shards get theirs from their name, which accounts refer to and which therefore never
+    changes, so adding, removing or reordering shards keeps every block in place.
+
+    :param name: Shard name, None for the primary database.
+    :type name: str, optional
+    :return: Block number, 0 for the primary database.
+    :rtype: int
+    """
+    if not name or name == DEFAULT_SHARD:
+        return 0
+    return 1 + zlib.crc32(name.encode()) % (USER_ID_BLOCKS - 1)
+
+
+def user_id_range(name: Optional[str]) -> Tuple[int, int]:
+    """
+    IDs a database hands out to new users.
+
+    :param name: Shard name, None for the primary database.
+    :type name: str, optional
+    :return: First and last ID of the block.
+    :rtype: tuple[int, int]
+    """
+    block = user_id_block(name)
+    return max(block * USER_ID_BLOCK, 1), (block + 1) * USER_ID_BLOCK - 1
+
+
+def check_user_id_blocks(names: Iterable[str]):
+    """
+    Make sure no two shards hand out IDs from the same block.
+
+    :param names: Shard names.
+    :type names: Iterable[str]
+    :raises ValueError: If two shards share a block, one of them must then be renamed before use.
+    """
+    blocks = {}
+    for name in names:
+        other = blocks.setdefault(user_id_block(name), name)
+        if other != name:
+            raise ValueError(f"Shards {other!r} and {name!r} share a user ID block, rename one of them")
+
+
+def _bump_user_ids(db: Session):
+    # Moved users keep their IDs, the sequence of the target must never hand them out again.
+    # SQLite picks max(id) + 1 by itself.
+    if db.get_bind(User.__mapper__).dialect.name == "postgresql":
+        db.execute(BUMP_USER_IDS)
+
+
+def _ensure_account_row(db: Session, account: Account):
+    if db.get(Account, account.id) is None:
+        db.add(Account(id=account.id, login=account.login, email=account.email, password="", confirmed=True))
+        db.flush()
+
+
+def _copy_rows(source: Session, target: Session, model, condition, batch_size: int) -> int:
+    copied = 0
+    key = model.__mapper__.primary_key[0]
+    columns = [column for column in model.__table__.columns if model is not UserTombstone or column.key != "id"]
+    last = None
+    while True:
+        stmt = select(*columns).where(condition).order_by(key).limit(batch_size)
+        if last is not None:
+            stmt = stmt.where(key > last)
+        rows = source.execute(stmt.add_columns(key.label("_key"))).all()
+        if not rows:
+            return copied
+        target.execute(insert(model), [{column.key: row[i] for i, column in enumerate(columns)} for row in rows])
+        target.commit()
+        copied += len(rows)
+        last = rows[-1]._key
+
+
+def move_account(shard_map: ShardMap, account_id: int, target: str, batch_size: int = 1000, grace: float = 5.0):
+    """
+    Move the contacts of an account to another shard, in batches, while the account stays online.
+
+    1. Copies the users existing at the start, one transaction per batch.
+    2. Locks the account: its requests answer ``503`` until the move ends. After ``grace``
+       seconds for requests in flight, copies the users changed meanwhile, the tombstones and
+       the version counter.
+    3. Points the account to the new shard and unlocks it.
+    4. Deletes the contacts from the old shard in batches.
+
+    User IDs are kept: every database hands out IDs from its own block, see
+    :func:`user_id_range`, and the ID sequence of the target is moved past the copied IDs.
+
+    :param shard_map: Shard map.
+    :type shard_map: ShardMap
+    :param account_id: Account ID.
+    :type account_id: int
+    :param target: Target shard name.
+    :type target: str
+    :param batch_size: Rows per transaction.
+    :type batch_size: int
+    :param grace: Seconds to wait for requests started before the lock.
+    :type grace: float
+    :return: Number of users moved.
+    :rtype: int
+    """
+    directory = Session(shard_map.primary)
+    account = directory.get(Account, account_id)
+    if account is None:
+        raise ValueError(f"Account {account_id} does not exist")
+    source_name = account.shard or DEFAULT_SHARD
+    if source_name == target:
+        return 0
+    source = Session(shard_map.engine(source_name))
+    destination = Session(shard_map.engine(target))
+    try:
+        # Leftovers of an aborted move.
+        for model in (User, UserTombstone, AccountVersion):
+            destination.execute(delete(model).where(model.account_id == account_id))
+        if target != DEFAULT_SHARD:
+            _ensure_account_row(destination, account)
+        destination.commit()
+
+        start_version = source.execute(
+            select(AccountVersion.version).where(AccountVersion.account_id == account_id)
+        ).scalar() or 0
+        source.rollback()
+        copied = _copy_rows(
+            source, destination, User, (User.account_id == account_id) & (User.version <= start_version), batch_size
+        )
+        logger.info("Copied %s users of account %s, locking it", copied, account_id)
+
+        directory.execute(update(Account).where(Account.id == account_id).values(shard_locked=True))
+        directory.commit()
+        try:
+            time.sleep(grace)
+            changed = [row.id for row in source.execute(
+                select(User.id).where(User.account_id == account_id, User.version > start_version)
+            )]
+            deleted = source.execute(
+                select(UserTombstone.user_id).where(
+                    UserTombstone.account_id == account_id, UserTombstone.version > start_version
+                )
+            ).scalars().all()
+            stale = set(changed).union(deleted)
+            if stale:
+                destination.execute(delete(User).where(User.account_id == account_id, User.id.in_(stale)))
+                destination.commit()
+            _copy_rows(
+                source, destination, User, (User.account_id == account_id) & (User.version > start_version),
+                batch_size,
+            )
+            _copy_rows(source, destination, UserTombstone, UserTombstone.account_id == account_id, batch_size)
+            _copy_rows(source, destination, AccountVersion, AccountVersion.account_id == account_id, batch_size)
+            _bump_user_ids(destination)
+            destination.commit()
+            source.rollback()
+            moved = destination.execute(select(func.count(User.id)).where(User.account_id == account_id)).scalar()
+            directory.execute(update(Account).where(Account.id == account_id).values(
+                shard=None if target == DEFAULT_SHARD else target, shard_locked=False
+            ))
+            directory.commit()
+        except BaseException:
+            directory.rollback()
+            directory.execute(update(Account).where(Account.id == account_id).values(shard_locked=False))
+            directory.commit()
+            raise
+        logger.info("Account %s now lives in shard %s, cleaning up %s", account_id, target, source_name)
+
+        for model in (User, UserTombstone):
+            key = model.__mapper__.primary_key[0]
+            while True:
+                ids = source.execute(
+                    select(key).where(model.account_id == account_id).limit(batch_size)
+                ).scalars().all()
+                if not ids:
+                    break
+                source.execute(delete(model).where(key.in_(ids)))
+                source.commit()
+        source.execute(delete(AccountVersion).where(AccountVersion.account_id == account_id))
+        source.commit()
+        return moved
+    finally:
+        destination.close()
+        source.close()
+        directory.close()
@@ -1,10 +1,15 @@
-from libgravatar import Gravatar
+import logging
+
 from sqlalchemy.orm import Session
 
-from src.database.models import Account
+from src.database.db import release, shard_map
+from src.database.models import Account, AccountVersion
 from src.schemas import AccountModel
 
 
+logger = logging.getLogger(__name__)
+
+
 async def get_user_by_email(email: str, db: Session):
     """
     Get user name by email
@@ -17,6 +22,7 @@ async def get_user_by_email(email: str, db: Session):
     :rtype: Account
     """
     result = db.query(Account).filter(Account.email == email).first()
+    release(db)
     return result
 
 
@@ -32,12 +38,13 @@ async def get_email_by_username(username: str, db: Session):
     :rtype: Account
     """
     result = db.query(Account).filter(Account.login == username).first()
+    release(db)
     return result
 
 
 async def create_account(body: AccountModel, db: Session):
     """
-    Creates new account
+    Creates new account, placed on the shard chosen for its email
 
     :param body: Scheme of account model
     :type body: AccountModel
@@ -46,16 +53,23 @@ async def create_account(body: AccountModel, db: Session):
     :return: New account
     :rtype: Account
     """
+    from libgravatar import Gravatar
+
     avatar = None
     try:
         g = Gravatar(body.email)
         avatar = g.get_image()
     except Exception as e:
-        print(e)
-    new_account = Account(**body.model_dump(), avatar=avatar)
+        logger.warning("Gravatar of %s unavailable: %s", body.email, e)
+    shard = shard_map.place(body.email)
+    new_account = Account(**body.model_dump(), avatar=avatar, shard=shard)
+    if shard is None:
+        new_account.version_counter = AccountVersion(version=0)
     db.add(new_account)
     db.commit()
     db.refresh(new_account)
+    release(db)
+    shard_map.register(new_account)
     return new_account
 
 
@@ -1,102 +1,112 @@
 import datetime
-from sqlalchemy import extract, or_, and_
+from typing import Dict, List, Optional
+
+from sqlalchemy import and_, update, delete, insert, select, func, case, literal
 from sqlalchemy.orm import Session
-from src.database.models import User, Account
-from src.schemas import UserModel, UserUpdate
+from src.database.db import note_write, release
+from src.database.models import User, Account, AccountVersion, UserTombstone
+from src.database.shards import ensure_version_counter
+from src.schemas import UserModel, UserUpdate, UserPatch, UserBulkPatchItem
+from src.services.events import contact_events, format_event
+from src.services.fingerprints import email_key, name_key
+from src.services.phones import phone_keys
 
 
-async def get_users(skip: int, limit: int, account: Account, db: Session):
-    """
-    Returns a list of users from the database.
-    
-    :param skip: Skip the first n users in the database
-    :type skip: int
-    :param limit: Limit the number of users returned
-    :type limit: int
-    :param account: User account
-    :type account: Account
-    :param db: DB session
-    :type db: Session
-    :return: A list of user objects
-    :rtype: list[User]
-    """
-    return db.query(User).filter(User.account_id == account.id).offset(skip).limit(limit).all()
+USER_COLUMNS = (
+    User.id, User.name, User.surname, User.email, User.phone, User.birthdate, User.additional_data, User.version
+)
 
 
-async def get_user(user_id: int, account: Account, db: Session):
+def next_version(account_id: int, db: Session, count: int = 1):
     """
-    Returns a user object from the database.
+    Reserves the next change version(s) of an account's users.
+
+    The counter row stays locked until the transaction commits, so versions of one account
+    become visible in increasing order and a sync watermark never skips a change. Every users
+    write goes through here, so it also keeps the account's reads on the primary for a while
+    once the transaction commits.
     
-    :param user_id: int: User ID
-    :type user_id: int
-    :param account: User account
-    :type account: Account
+    :param account_id: Account ID
+    :type account_id: int
     :param db: DB session
     :type db: Session
-    :return: A user object
-    :rtype: User
+    :param count: Number of versions to reserve
+    :type count: int
+    :return: The last reserved version, the reserved range is ``(result - count, result]``
+    :rtype: int
     """
-    return db.query(User).filter(and_(User.id == user_id, User.account_id == account.id)).first()
+    stmt = (
+        update(AccountVersion)
+        .where(AccountVersion.account_id == account_id)
+        .values(version=AccountVersion.version + count)
+        .returning(AccountVersion.version)
+    )
+    version = db.execute(stmt).scalar()
+    if version is None:
+        ensure_version_counter(db, account_id)
+        version = db.execute(stmt).scalar()
+    note_write(db, account_id)
+    return version
 
 
-async def find_user(user_name: str, user_surname: str, user_email: str, account: Account, db: Session):
+def lock_version_counter(account_id: int, db: Session):
     """
-    Finds a user by their first name, last name, and email address for the specified account
-    
-    :param user_name: Filter the query by user name
-    :type user_name: str
-    :param user_surname: sFilter the users by surname
-    :type user_surname: str
-    :param user_email: Filter the query by email
-    :type user_email: str
-    :param account: User account
-    :type account: Account
+    Locks the version counter row of an account until the transaction ends.
+
+    Writes lock the counter before any of the account's users rows, so concurrent writes of one
+    account always take their locks in the same order and cannot deadlock. Writes that only
+    know how many versions they need once their rows are changed lock it with this first, then
+    reserve the versions with :func:`next_version`.
+
+    :param account_id: Account ID
+    :type account_id: int
     :param db: DB session
     :type db: Session
-    :return: The first user found in the database with the given parameters
-    :rtype: User
     """
-    query = db.query(User)
+    stmt = select(AccountVersion.version).where(AccountVersion.account_id == account_id).with_for_update()
+    if db.execute(stmt).scalar() is None:
+        ensure_version_counter(db, account_id)
+        db.execute(stmt)
+
 
-    if user_name is not None:
-        query = query.filter(and_(User.name == user_name, User.account_id == account.id))
-    if user_surname is not None:
-        query = query.filter(and_(User.surname == user_surname, User.account_id == account.id))
-    if user_email is not None:
-        query = query.filter(and_(User.email == user_email, User.account_id == account.id))
+def with_lookup_keys(values: dict) -> dict:
+    """
+    Adds the normalized lookup keys of the changed fields to the written values.
 
-    return query.first()
+    :param values: Column values to write
+    :type values: dict
+    :return: The values with the phone, email and name keys of the fields they contain
+    :rtype: dict
+    """
+    keys = {}
+    if "phone" in values:
+        keys["phone_e164"], keys["phone_suffix"] = phone_keys(values["phone"])
+    if "email" in values:
+        keys["email_key"] = email_key(values["email"])
+    if "name" in values:
+        keys["name_key"] = name_key(values["name"])
+    if "surname" in values:
+        keys["surname_key"] = name_key(values["surname"])
+    return {**values, **keys}
 
 
-async def upcoming_birthdays(db: Session, account: Account, days: int = 7):
+def user_event(event: str, user: User) -> bytes:
     """
-    Returns a list of users whose birthdays are within the next 7 days
-    
-    :param db: DB session
-    :type db: Session
-    :param account: User account
-    :type account: Account
-    :param days: Determine how many days in the future to look for upcoming birthdays
-    :type days: int
-    :return: A list of users
-    :rtype: list[User]
-    """
-    current_date = datetime.date.today()
-    end_date = current_date + datetime.timedelta(days=days)
-
-    condition = or_(
-        and_(
-            extract("month", User.birthdate) == current_date.month, extract("day", User.birthdate) >= current_date.day
-        ),
-        and_(extract("month", User.birthdate) == end_date.month, extract("day", User.birthdate) <= end_date.day),
-    )
+    Renders a contact change event for a user.
 
-    return db.query(User).filter(and_(condition, User.account_id == account.id)).all()
+    :param event: Event name
+    :type event: str
+    :param user: Changed user
+    :type user: User
+    :return: Encoded event
+    :rtype: bytes
+    """
+    return format_event(event, {column.key: getattr(user, column.key) for column in USER_COLUMNS}, user.version)
 
 
 async def create_user(body: UserModel, current_user: Account, db: Session):
     """
-    Creates a new user for current Account
+    Creates a new user for current Account, with the normalized lookup keys of its fields
     
     :param body: Get the data from the request body
     :type body: UserModel
@@ -108,23 +118,42 @@ async def create_user(body: UserModel, current_user: Account, db: Session):
     :rtype: User
     """
     user = User(
-        name=body.name,
-        surname=body.surname,
-        email=body.email,
-        phone=body.phone,
-        birthdate=body.birthdate,
-        additional_data=body.additional_data,
+        **with_lookup_keys(body.model_dump()),
         account_id=current_user.id,
+        version=next_version(current_user.id, db),
     )
     db.add(user)
     db.commit()
     db.refresh(user)
+    release(db)
+    await contact_events.publish(user.account_id, user_event("created", user))
     return user
 
 
-async def remove_user(user_id: int, account: Account, db: Session):
+class VersionConflict(Exception):
+    """
+    Raised when a user exists but its version differs from the expected one
+    """
+
+
+def _precondition_failed(user_id: int, account_id: int, db: Session, expected_version: Optional[int]):
     """
-    Removes a user from the database.
+    Tells a failed conditional write apart from a missing user.
+    
+    :raises VersionConflict: If the user exists with another version
+    """
+    if expected_version is None:
+        return
+    current = db.execute(
+        select(User.version).where(and_(User.id == user_id, User.account_id == account_id))
+    ).scalar()
+    if current is not None:
+        raise VersionConflict(current)
+
+
+async def remove_user(user_id: int, account: Account, db: Session, expected_version: Optional[int] = None):
+    """
+    Removes a user from the database with a single ``DELETE ... RETURNING`` statement.
     
     :param user_id: Identify the user to be removed
     :type user_id: int
@@ -132,19 +161,58 @@ async def remove_user(user_id: int, account: Account, db: Session):
     :type account: Account
     :param db: DB session
     :type db: Session
-    :return: Removed user object or None (if user not exist)
-    :rtype: User or None
+    :param expected_version: Remove only if the user still has this version
+    :type expected_version: int, optional
+    :return: Removed user row or None (if user not exist)
+    :rtype: Row or None
+    :raises VersionConflict: If the user has another version than ``expected_version``
     """
-    user = db.query(User).filter(and_(User.id == user_id, User.account_id == account.id)).first()
-    if user:
-        db.delete(user)
-        db.commit()
+    account_id = account.id
+    version = next_version(account_id, db)
+    conditions = [User.id == user_id, User.account_id == account_id]
+    if expected_version is not None:
+        conditions.append(User.version == expected_version)
+    user = db.execute(
+        delete(User).where(*conditions).returning(*USER_COLUMNS).execution_options(synchronize_session=False)
+    ).first()
+    if user is None:
+        db.rollback()
+        _precondition_failed(user_id, account_id, db, expected_version)
+        return None
+    db.add(UserTombstone(user_id=user.id, account_id=account_id, version=version))
+    db.commit()
+    await contact_events.publish(account_id, format_event("deleted", {"id": user.id, "version": version}, version))
     return user
 
 
-async def update_user(user_id: int, body: UserUpdate, account: Account, db: Session):
+async def _update_fields(
+    user_id: int, values: dict, account: Account, db: Session, expected_version: Optional[int]
+):
+    account_id = account.id
+    conditions = [User.id == user_id, User.account_id == account_id]
+    if expected_version is not None:
+        conditions.append(User.version == expected_version)
+    user = db.execute(
+        update(User)
+        .where(*conditions)
+        .values(**with_lookup_keys(values), version=next_version(account_id, db), updated_at=func.now())
+        .returning(*USER_COLUMNS)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if user is None:
+        db.rollback()
+        _precondition_failed(user_id, account_id, db, expected_version)
+        return None
+    db.commit()
+    await contact_events.publish(account_id, user_event("updated", user))
+    return user
+
+
+async def update_user(
+    user_id: int, body: UserUpdate, account: Account, db: Session, expected_version: Optional[int] = None
+):
     """
-    Updates a user in the database.
+    Updates a user in the database with a single ``UPDATE ... RETURNING`` statement.
     
     :param user_id: Identify the user to be updated
     :type user_id: int
@@ -154,16 +222,273 @@ async def update_user(user_id: int, body: UserUpdate, account: Account, db: Sess
     :type account: Account
     :param db: DB session
     :type db: Session
-    :return: Updated user object or None (if user not exist)
-    :rtype: User or None
-    """
-    user = db.query(User).filter(and_(User.id == user_id, User.account_id == account.id)).first()
-    if user:
-        user.name = body.name
-        user.surname = body.surname
-        user.email = body.email
-        user.phone = body.phone
-        user.birthdate = body.birthdate
-        user.additional_data = body.additional_data
-        db.commit()
+    :param expected_version: Update only if the user still has this version
+    :type expected_version: int, optional
+    :return: Updated user row or None (if user not exist)
+    :rtype: Row or None
+    :raises VersionConflict: If the user has another version than ``expected_version``
+    """
+    return await _update_fields(user_id, body.model_dump(), account, db, expected_version)
+
+
+async def patch_user(
+    user_id: int, body: UserPatch, account: Account, db: Session, expected_version: Optional[int] = None
+):
+    """
+    Updates only the fields present in the request body.
+    
+    :param user_id: Identify the user to be updated
+    :type user_id: int
+    :param body: Fields to update
+    :type body: UserPatch
+    :param account: User account
+    :type account: Account
+    :param db: DB session
+    :type db: Session
+    :param expected_version: Update only if the user still has this version
+    :type expected_version: int, optional
+    :return: Updated user row or None (if user not exist)
+    :rtype: Row or None
+    :raises VersionConflict: If the user has another version than ``expected_version``
+    """
+    return await _update_fields(user_id, body.model_dump(exclude_unset=True), account, db, expected_version)
+
+
+BULK_CHUNK_SIZE = 500
+
+
+async def bulk_remove_users(ids: List[int], account: Account, db: Session):
+    """
+    Removes several users of an account in one transaction.
+
+    Users are removed in chunks of ``BULK_CHUNK_SIZE``, one ``DELETE ... RETURNING`` per chunk,
+    which keeps each statement under the driver's parameter limits. The version counter is
+    locked before the first chunk, like in every other write.
+    
+    :param ids: IDs of the users to remove
+    :type ids: list[int]
+    :param account: User account
+    :type account: Account
+    :param db: DB session
+    :type db: Session
+    :return: Outcome per requested ID, in request order: ``deleted`` with the removal version or ``not_found``
+    :rtype: list[dict]
+    """
+    account_id = account.id
+    ids = list(dict.fromkeys(ids))
+    lock_version_counter(account_id, db)
+    removed = []
+    for start in range(0, len(ids), BULK_CHUNK_SIZE):
+        removed += db.execute(
+            delete(User)
+            .where(User.account_id == account_id, User.id.in_(ids[start:start + BULK_CHUNK_SIZE]))
+            .returning(User.id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+    versions = {}
+    if removed:
+        last = next_version(account_id, db, count=len(removed))
+        versions = {user_id: last - len(removed) + n for n, user_id in enumerate(removed, 1)}
+        db.execute(
+            insert(UserTombstone),
+            [{"user_id": user_id, "account_id": account_id, "version": version} for user_id, version in versions.items()],
+        )
+    db.commit()
+    await contact_events.publish_many(
+        account_id,
+        [format_event("deleted", {"id": user_id, "version": version}, version) for user_id, version in versions.items()],
+    )
+    return [
+        {"id": user_id, "status": "deleted", "version": versions[user_id]} if user_id in versions
+        else {"id": user_id, "status": "not_found", "version": None}
+        for user_id in ids
+    ]
+
+
+def _bulk_update_statement(items: List[UserBulkPatchItem], versions: Dict[int, int], account_id: int):
+    """
+    Builds one ``UPDATE ... RETURNING`` for a chunk of patches, each column set with a ``CASE`` on the user ID.
+    """
+    changes = {item.id: with_lookup_keys(item.changes.model_dump(exclude_unset=True)) for item in items}
+    values = {"version": case(versions, value=User.id), "updated_at": func.now()}
+    for field in {field for patch in changes.values() for field in patch}:
+        column = getattr(User, field)
+        values[field] = case(
+            {user_id: literal(patch[field], column.type) for user_id, patch in changes.items() if field in patch},
+            value=User.id, else_=column,
+        )
+    conditions = [User.account_id == account_id, User.id.in_(changes)]
+    expected = {item.id: item.version for item in items if item.version is not None}
+    if expected:
+        conditions.append(User.version == case(expected, value=User.id, else_=User.version))
+    return (
+        update(User)
+        .where(*conditions)
+        .values(**values)
+        .returning(*USER_COLUMNS)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def bulk_patch_users(items: List[UserBulkPatchItem], account: Account, db: Session):
+    """
+    Updates the given fields of several users of an account in one transaction.
+    
+    Patches are applied in chunks of ``BULK_CHUNK_SIZE`` users, one set-based ``UPDATE`` per chunk.
+    
+    :param items: Patches with unique user IDs and optional expected versions
+    :type items: list[UserBulkPatchItem]
+    :param account: User account
+    :type account: Account
+    :param db: DB session
+    :type db: Session
+    :return: Outcome per requested ID, in request order: ``updated`` with the new version,
+        ``conflict`` with the current version or ``not_found``
+    :rtype: list[dict]
+    """
+    account_id = account.id
+    last = next_version(account_id, db, count=len(items))
+    versions = {item.id: last - len(items) + n for n, item in enumerate(items, 1)}
+    updated = {}
+    for start in range(0, len(items), BULK_CHUNK_SIZE):
+        chunk = items[start:start + BULK_CHUNK_SIZE]
+        stmt = _bulk_update_statement(chunk, {item.id: versions[item.id] for item in chunk}, account_id)
+        updated.update((user.id, user) for user in db.execute(stmt))
+    conflicts = {}
+    missed = [item.id for item in items if item.id not in updated and item.version is not None]
+    if missed:
+        conflicts = dict(db.execute(
+            select(User.id, User.version).where(User.account_id == account_id, User.id.in_(missed))
+        ).all())
+    db.commit()
+    await contact_events.publish_many(
+        account_id, [user_event("updated", user) for user in sorted(updated.values(), key=lambda user: user.version)]
+    )
+    results = []
+    for item in items:
+        if item.id in updated:
+            results.append({"id": item.id, "status": "updated", "version": updated[item.id].version})
+        elif item.id in conflicts:
+            results.append({"id": item.id, "status": "conflict", "version": conflicts[item.id]})
+        else:
+            results.append({"id": item.id, "status": "not_found", "version": None})
+    return results
+
+
+MERGED_FIELDS = ("surname", "email", "phone", "birthdate")
+
+
+async def merge_users(primary_id: int, duplicate_ids: List[int], account: Account, db: Session):
+    """
+    Merges duplicate users into one of them in a single transaction.
+
+    The primary user keeps its fields and gets the empty ones filled from the duplicates, in
+    order. Its ``additional_data`` gets the attributes of the duplicates it lacks. The
+    duplicates are then removed, leaving tombstones for sync clients.
+
+    :param primary_id: ID of the user to keep
+    :type primary_id: int
+    :param duplicate_ids: IDs of the users to merge into it, in priority order
+    :type duplicate_ids: list[int]
+    :param account: User account
+    :type account: Account
+    :param db: DB session
+    :type db: Session
+    :return: Merged user row or None (if one of the users does not exist)
+    :rtype: Row or None
+    """
+    account_id = account.id
+    ids = [primary_id, *duplicate_ids]
+    # The counter is locked before the users rows, like in every other write.
+    last = next_version(account_id, db, count=len(ids))
+    rows = {
+        row.id: row for row in db.execute(
+            select(User.id, *(getattr(User, field) for field in MERGED_FIELDS), User.additional_data)
+            .where(User.account_id == account_id, User.id.in_(ids))
+            .with_for_update()
+        )
+    }
+    if len(rows) != len(ids):
+        db.rollback()
+        return None
+    primary = rows[primary_id]
+    duplicates = [rows[user_id] for user_id in duplicate_ids]
+    values = {}
+    for field in MERGED_FIELDS:
+        if getattr(primary, field) in (None, ""):
+            values[field] = next(
+                (getattr(row, field) for row in duplicates if getattr(row, field) not in (None, "")), None
+            )
+    additional_data = {}
+    for row in reversed(duplicates):
+        additional_data.update(row.additional_data or {})
+    additional_data.update(primary.additional_data or {})
+    if additional_data != (primary.additional_data or {}):
+        values["additional_data"] = additional_data
+    values = {field: value for field, value in values.items() if value is not None}
+
+    db.execute(
+        delete(User)
+        .where(User.account_id == account_id, User.id.in_(duplicate_ids))
+        .execution_options(synchronize_session=False)
+    )
+    versions = {user_id: last - len(ids) + n for n, user_id in enumerate(duplicate_ids, 1)}
+    db.execute(
+        insert(UserTombstone),
+        [{"user_id": user_id, "account_id": account_id, "version": version} for user_id, version in versions.items()],
+    )
+    user = db.execute(
+        update(User)
+        .where(User.account_id == account_id, User.id == primary_id)
+        .values(**with_lookup_keys(values), version=last, updated_at=func.now())
+        .returning(*USER_COLUMNS)
+        .execution_options(synchronize_session=False)
+    ).first()
+    db.commit()
+    await contact_events.publish_many(
+        account_id,
+        [format_event("deleted", {"id": user_id, "version": version}, version) for user_id, version in versions.items()]
+        + [user_event("updated", user)],
+    )
     return user
+
+
+def prune_tombstones(db: Session, before: datetime.datetime, batch_size: int = 1000) -> int:
+    """
+    Deletes the tombstones of users deleted before ``before``, one transaction per batch.
+
+    The ``pruned_version`` of each account is raised to its newest pruned tombstone first,
+    so the changes feed asks clients that last synced before it to sync from scratch
+    instead of silently missing the deletions.
+
+    :param db: DB session
+    :type db: Session
+    :param before: Tombstones of users deleted before this time are pruned
+    :type before: datetime.datetime
+    :param batch_size: Tombstones per transaction
+    :type batch_size: int
+    :return: Number of pruned tombstones
+    :rtype: int
+    """
+    pruned = 0
+    while True:
+        rows = db.execute(
+            select(UserTombstone.id, UserTombstone.account_id, UserTombstone.version)
+            .where(UserTombstone.deleted_at < before)
+            .order_by(UserTombstone.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return pruned
+        horizons = {}
+        for row in rows:
+            horizons[row.account_id] = max(horizons.get(row.account_id, 0), row.version)
+        for account_id, version in horizons.items():
+            db.execute(
+                update(AccountVersion)
+                .where(AccountVersion.account_id == account_id, AccountVersion.pruned_version < version)
+                .values(pruned_version=version)
+            )
+        db.execute(delete(UserTombstone).where(UserTombstone.id.in_([row.id for row in rows])))
+        db.commit()
+        pruned += len(rows)
@@ -0,0 +1,668 @@
+import datetime
+from collections import OrderedDict, defaultdict, namedtuple
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import orjson
+from sqlalchemy import select, and_, or_, extract, func, literal
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from src.database.db import release, replica_router
+from src.database.models import User, Account, AccountVersion, UserTombstone
+from src.database.shards import is_sharded
+from src.services.phones import has_country_code, phone_keys
+from src.repository.users import USER_COLUMNS
+from src.services.coalescing import SingleFlight
+
+
+class UserRow(NamedTuple):
+    """
+    Read-only user row.
+
+    Selected with SQLAlchemy Core, so it is never added to the session identity map
+    and carries no change tracking state.
+    """
+    id: int
+    name: str
+    surname: Optional[str]
+    email: str
+    phone: str
+    birthdate: datetime.date
+    additional_data: Optional[Dict[str, Any]]
+    version: int
+
+
+class DuplicateGroup(NamedTuple):
+    """
+    Users that are probably the same contact, with the keys they share.
+    """
+    reasons: List[str]
+    users: List[UserRow]
+
+
+class ChangeSet(NamedTuple):
+    """
+    Page of the users change feed.
+    """
+    changed: List[UserRow]
+    deleted: List[int]
+    version: int
+    has_more: bool
+
+
+class ResyncRequired(Exception):
+    """
+    Raised when deletions after the client's version were pruned, see :func:`src.repository.users.prune_tombstones`.
+
+    :param pruned_version: Newest pruned version.
+    :type pruned_version: int
+    """
+
+    def __init__(self, pruned_version: int):
+        super().__init__(f"Changes up to version {pruned_version} were pruned")
+        self.pruned_version = pruned_version
+
+
+class DuplicateGroupsCache:
+    """
+    Duplicate groups of the accounts paged through last, each with the account version they
+    were detected at.
+
+    The cache is bounded by the user IDs its groups hold rather than by accounts: the least
+    recently used accounts are evicted once the total exceeds ``max_ids``, and the groups of
+    an account holding more than that on their own are never kept.
+
+    :param max_ids: User IDs held at most.
+    :type max_ids: int
+    """
+
+    def __init__(self, max_ids: int):
+        self.max_ids = max_ids
+        self.ids = 0
+        # (contacts engine, account ID) -> (account version, groups, user IDs in the groups)
+        self._entries: "OrderedDict[tuple, Tuple[int, list, int]]" = OrderedDict()
+
+    def get(self, key: tuple, version: int) -> Optional[list]:
+        """
+        Groups detected at ``version`` or later.
+
+        :param key: Contacts engine and account ID.
+        :type key: tuple
+        :param version: Current account version.
+        :type version: int
+        :return: Groups, None when missing or outdated.
+        :rtype: list, optional
+        """
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < version:
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: tuple, version: int, groups: list):
+        """
+        Keep the groups detected at ``version``, unless newer ones are kept already.
+
+        :param key: Contacts engine and account ID.
+        :type key: tuple
+        :param version: Account version the groups were detected at.
+        :type version: int
+        :param groups: Groups of user IDs with their reasons.
+        :type groups: list
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] >= version:
+                return
+            del self._entries[key]
+            self.ids -= entry[2]
+        weight = sum(len(ids) for ids, _ in groups)
+        if weight > self.max_ids:
+            return
+        self._entries[key] = (version, groups, weight)
+        self.ids += weight
+        while self.ids > self.max_ids:
+            _, (_, _, evicted) = self._entries.popitem(last=False)
+            self.ids -= evicted
+
+
+USER_FIELDS = UserRow._fields
+DATA_PREFIX = "data."
+MAX_DATA_FILTERS = 10
+MAX_PHONE_MATCHES = 100
+# Blocking keys of duplicate detection, users sharing one of them are candidate duplicates.
+DUPLICATE_KEYS = (
+    ("email", (User.email_key,)),
+    ("phone", (User.phone_suffix,)),
+    ("name", (User.name_key, User.surname_key)),
+)
+# Larger buckets, e.g. a switchboard number shared by a whole company, tell nothing about duplicates.
+MAX_BUCKET_SIZE = 1000
+STREAM_BATCH_SIZE = 10_000
+# Duplicate groups are kept for the accounts paged through last, until their next write,
+# up to this many user IDs per worker (a few dozen MB).
+MAX_CACHED_DUPLICATE_IDS = 1_000_000
+_columns = {column.key: column for column in USER_COLUMNS}
+list_reads = SingleFlight("users_read")
+_duplicate_groups_cache = DuplicateGroupsCache(MAX_CACHED_DUPLICATE_IDS)
+
+
+def parse_fields(fields: Optional[str]) -> Tuple[str, ...]:
+    """
+    Normalizes a ``name,phone`` style sparse fieldset.
+
+    :param fields: Comma separated field names or None for all fields
+    :type fields: str, optional
+    :return: Requested fields in ``USER_FIELDS`` order, always including ``id`` and ``version``
+    :rtype: tuple[str, ...]
+    :raises ValueError: If a field name is unknown
+    """
+    if not fields:
+        return USER_FIELDS
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = requested.difference(USER_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    requested.update(("id", "version"))
+    return tuple(name for name in USER_FIELDS if name in requested)
+
+
+def parse_data_filters(params: Iterable[Tuple[str, str]]) -> Tuple[Tuple[Tuple[str, ...], str], ...]:
+    """
+    Collects the ``data.<attribute>=<value>`` query parameters filtering on ``additional_data``.
+
+    Dots in the attribute name select nested attributes, e.g. ``data.address.city=Kyiv``.
+
+    :param params: Query parameters as ``(name, value)`` pairs
+    :type params: Iterable[tuple[str, str]]
+    :return: Sorted ``(attribute path, value)`` pairs
+    :rtype: tuple[tuple[tuple[str, ...], str], ...]
+    :raises ValueError: If an attribute name is empty or there are too many filters
+    """
+    filters = []
+    for name, value in params:
+        if not name.startswith(DATA_PREFIX):
+            continue
+        path = tuple(name[len(DATA_PREFIX):].split("."))
+        if not all(path) or any('"' in key for key in path):
+            raise ValueError(f"Invalid attribute filter {name}")
+        filters.append((path, value))
+    if len(filters) > MAX_DATA_FILTERS:
+        raise ValueError(f"No more than {MAX_DATA_FILTERS} attribute filters")
+    return tuple(sorted(filters))
+
+
+def _filter_values(value: str) -> List[Any]:
+    # Query values are strings, "30" or "true" also match the JSON number or boolean.
+    values = [value]
+    try:
+        parsed = orjson.loads(value)
+    except orjson.JSONDecodeError:
+        return values
+    if isinstance(parsed, (bool, int, float)):
+        values.append(parsed)
+    return values
+
+
+def _nested(path: Tuple[str, ...], value) -> dict:
+    for key in reversed(path):
+        value = {key: value}
+    return value
+
+
+def data_condition(filters: Tuple[Tuple[Tuple[str, ...], str], ...], dialect: str):
+    """
+    Builds the ``WHERE`` condition of attribute filters, see :func:`parse_data_filters`.
+
+    PostgreSQL gets ``additional_data @> '{...}'`` containment tests served by the GIN index,
+    other databases compare ``json_extract`` values.
+
+    :param filters: Attribute filters
+    :type filters: tuple[tuple[tuple[str, ...], str], ...]
+    :param dialect: Database dialect name
+    :type dialect: str
+    :return: Condition matching users with all the attributes
+    """
+    conditions = []
+    for path, value in filters:
+        if dialect == "postgresql":
+            options = [
+                User.additional_data.op("@>")(literal(_nested(path, option), JSONB)) for option in _filter_values(value)
+            ]
+        else:
+            extracted = func.json_extract(User.additional_data, "$" + "".join(f'."{key}"' for key in path))
+            options = [extracted == option for option in _filter_values(value)]
+        conditions.append(or_(*options))
+    return and_(*conditions)
+
+
+@lru_cache(maxsize=128)
+def _row_type(fields: Tuple[str, ...]):
+    if fields == USER_FIELDS:
+        return UserRow
+    return namedtuple("PartialUserRow", fields)
+
+
+def _select_users(fields: Tuple[str, ...]):
+    return select(*(_columns[name] for name in fields))
+
+
+def _shareable(db: Session) -> bool:
+    # A session bound to an open transaction, e.g. of an atomic batch, or holding unflushed
+    # changes reads its own writes: its reads must not be handed to other requests.
+    return isinstance(db.get_bind(User.__mapper__), Engine) and not (db.new or db.dirty or db.deleted)
+
+
+async def _read_bind(db: Session, account_id: int) -> Optional[Engine]:
+    # Replicas follow the primary database, contacts of sharded accounts are read from their shard.
+    if is_sharded(db) or not _shareable(db):
+        return None
+    return await replica_router.read_bind(account_id)
+
+
+def _bind_arguments(bind: Optional[Engine]):
+    return {"bind": bind} if bind is not None else None
+
+
+def _rows(db: Session, stmt, fields: Tuple[str, ...], bind: Optional[Engine] = None):
+    row_type = _row_type(fields)
+    rows = [row_type._make(row) for row in db.execute(stmt, bind_arguments=_bind_arguments(bind))]
+    release(db)
+    return rows
+
+
+def _in_session(db: Session, read: Callable[[Any], Any]):
+    result = read(db)
+    release(db)
+    return result
+
+
+def _on_connection(engine: Engine, read: Callable[[Any], Any]):
+    with engine.connect() as connection:
+        return read(connection)
+
+
+async def _shared(key: tuple, db: Session, account_id: int, read: Callable[[Any], Any]):
+    """
+    Runs a read off the event loop, shared by concurrent identical reads.
+
+    While ``read`` runs in a worker thread the loop keeps serving requests, and the ones with
+    the same ``key`` reading from the same kind of database, replica or primary, await it
+    instead of running their own. The shared read gets a connection of its own, never a
+    caller's session, which may be closed while the others still wait. Sessions that must
+    see their own uncommitted writes read alone, in their session.
+
+    :param read: Function running the queries on a ``Connection`` or ``Session``.
+    """
+    if not _shareable(db):
+        return await run_in_threadpool(_in_session, db, read)
+    replica = await _read_bind(db, account_id)
+    engine = replica or db.get_bind(User.__mapper__)
+    release(db)
+    # An account reading its own writes from the primary must not join a read of a lagging replica.
+    return await list_reads.do(key + (replica is not None,), lambda: run_in_threadpool(_on_connection, engine, read))
+
+
+async def _shared_rows(key: tuple, db: Session, stmt, fields: Tuple[str, ...], account_id: int):
+    row_type = _row_type(fields)
+    return await _shared(key, db, account_id, lambda executor: [row_type._make(row) for row in executor.execute(stmt)])
+
+
+async def _first(db: Session, stmt, fields: Tuple[str, ...], account_id: int):
+    bind = await _read_bind(db, account_id)
+    row = db.execute(stmt.limit(1), bind_arguments=_bind_arguments(bind)).first()
+    release(db)
+    return _row_type(fields)._make(row) if row is not None else None
+
+
+async def get_users(
+    skip: int, limit: int, account: Account, db: Session, fields: Tuple[str, ...] = USER_FIELDS,
+    data: Tuple[Tuple[Tuple[str, ...], str], ...] = (),
+):
+    """
+    Returns a list of users from the database, optionally filtered on their ``additional_data`` attributes.
+
+    Concurrent identical calls for the same account share one query.
+
+    :param skip: Skip the first n users in the database
+    :type skip: int
+    :param limit: Limit the number of users returned
+    :type limit: int
+    :param account: User account
+    :type account: Account
+    :param db: DB session
+    :type db: Session
+    :param fields: Selected columns, see :func:`parse_fields`
+    :type fields: tuple[str, ...]
+    :param data: Attribute filters, see :func:`parse_data_filters`
+    :type data: tuple
+    :return: A list of user rows with the selected fields
+    :rtype: list[UserRow]
+    """
+    account_id = account.id
+    stmt = _select_users(fields).where(User.account_id == account_id)
+    if data:
+        stmt = stmt.where(data_condition(data, db.get_bind(User.__mapper__).dialect.name))
+    stmt = stmt.offset(skip).limit(limit)
+    return await _shared_rows(("get_users", account_id, skip, limit, fields, data), db, stmt, fields, account_id)
+
+
+async def get_user(user_id: int, account: Account, db: Session, fields: Tuple[str, ...] = USER_FIELDS):
+    """
+    Returns a user row from the database.
+
+    :param user_id: User ID
+    :type user_id: int
+    :param account: User account
+    :type account: Account
+    :param db: DB session
+    :type db: Session
+    :param fields: Selected columns, see :func:`parse_fields`
+    :type fields: tuple[str, ...]
+    :return: A user row or None
+    :rtype: UserRow or None
+    """
+    account_id = account.id
+    stmt = _select_users(fields).where(and_(User.id == user_id, User.account_id == account_id))
+    return await _first(db, stmt, fields, account_id)
+
+
+async def find_by_phone(number: str, account: Account, db: Session, fields: Tuple[str, ...] = USER_FIELDS):
+    """
+    Finds the users of an account with a phone number, through an index lookup.
+
+    An international number matches its E.164 form, and the stored numbers that could not be
+    normalized by their last digits. A national number, without country code, matches on its
+    last digits, whatever country code the stored number has.
+
+    :param number: Phone number in any format
+    :type number: str
+    :param account: User account
+    :type account: Account
+    :param db: DB session
+    :type db: Session
+    :param fields: Selected columns, see :func:`parse_fields`
+    :type fields: tuple[str, ...]
+    :return: Matching user rows, at most ``MAX_PHONE_MATCHES``
+    :rtype: list[UserRow]
+    """
+    account_id = account.id
+    keys = phone_keys(number)
+    if keys.suffix is None:
+        return []
+    if keys.e164 is not None and has_country_code(number):
+        condition = or_(
+            User.phone_e164 == keys.e164, and_(User.phone_e164.is_(None), User.phone_suffix == keys.suffix)
+        )
+    else:
+        condition = User.phone_suffix == keys.suffix
+    stmt = _select_users(fields).where(User.account_id == account_id, condition).order_by(User.id).limit(MAX_PHONE_MATCHES)
+    bind = await _read_bind(db, account_id)
+    return _rows(db, stmt, fields, bind)
+
+
+async def find_user(
+    user_name: str, user_surname: str, user_email: str, account: Account, db: Session,
+    fields: Tuple[str, ...] = USER_FIELDS,
+):
+    """
+    Finds a user by their first name, last name, and email address for the specified account
+
+    :param user_name: Filter the query by user name
+    :type user_name: str
+    :param user_surname: Filter the users by surname
+    :type user_surname: str
+    :param user_email: Filter the query by email
+    :type user_email: str
+    :param account: User account
+    :type account: Account
+    :param db: DB session
+    :type db: Session
+    :param fields: Selected columns, see :func:`parse_fields`
+    :type fields: tuple[str, ...]
+    :return: The first user row found with the given parameters
+    :rtype: UserRow or None
+    """
+    stmt = _select_users(fields).where(User.account_id == account.id)
+
+    if user_name is not None:
+        stmt = stmt.where(User.name == user_name)
+    if user_surname is not None:
+        stmt = stmt.where(User.surname == user_surname)
+    if user_email is not None:
+        stmt = stmt.where(User.email == user_email)
+
+    return await _first(db, stmt, fields, account.id)
+
+
+def birthdays_condition(days: int):
+    """
+    Builds the filter for users whose birthdays are within the next ``days`` days
+    
+    :param days: Determine how many days in the future to look for upcoming birthdays
+    :type days: int
+    :return: SQL condition
+    :rtype: ColumnElement[bool]
+    """
+    current_date = datetime.date.today()
+    end_date = current_date + datetime.timedelta(days=days)
+
+    return or_(
+        and_(
+            extract("month", User.birthdate) == current_date.month, extract("day", User.birthdate) >= current_date.day
+        ),
+        and_(extract("month", User.birthdate) == end_date.month, extract("day", User.birthdate) <= end_date.day),
+    )
+
+
+async def upcoming_birthdays(db: Session, account: Account, days: int = 7, fields: Tuple[str, ...] = USER_FIELDS):
+    """
+    Returns a list of users whose birthdays are within the next 7 days
+
+    Concurrent identical calls for the same account share one query.
+
+    :param db: DB session
+    :type db: Session
+    :param account: User account
+    :type account: Account
+    :param days: Determine how many days in the future to look for upcoming birthdays
+    :type days: int
+    :param fields: Selected columns, see :func:`parse_fields`
+    :type fields: tuple[str, ...]
+    :return: A list of user rows with the selected fields
+    :rtype: list[UserRow]
+    """
+    account_id = account.id
+    stmt = _select_users(fields).where(and_(birthdays_condition(days), User.account_id == account_id))
+    key = ("upcoming_birthdays", account_id, datetime.date.today(), days, fields)
+    return await _shared_rows(key, db, stmt, fields, account_id)
+
+
+async def get_changes(since: int, limit: int, account: Account, db: Session):
+    """
+    Returns users changed and deleted after the ``since`` version, oldest change first.
+
+    The account version is read before the rows, and only changes up to it are returned:
+    versions are handed out under a row lock, so everything up to that version is committed
+    and the returned watermark never skips a change. For the same reason it always reads
+    from the primary, never from a replica.
+
+    :param since: Last version the client has seen
+    :type since: int
+    :param limit: Maximum number of changes (updates and deletions) in the page
+    :type limit: int
+    :param account: User account
+    :type account: Account
+    :param db: DB session
+    :type db: Session
+    :return: Changed rows, deleted IDs and the new watermark
+    :rtype: ChangeSet
+    :raises ResyncRequired: If tombstones newer than ``since`` were pruned
+    """
+    counter = db.execute(
+        select(AccountVersion.version, AccountVersion.pruned_version).where(AccountVersion.account_id == account.id)
+    ).first()
+    current, pruned = counter if counter is not None else (0, 0)
+    if 0 < since < pruned:
+        release(db)
+        raise ResyncRequired(pruned)
+    window = and_(User.account_id == account.id, User.version > since, User.version <= current)
+    changed = _rows(db, _select_users(USER_FIELDS).where(window).order_by(User.version).limit(limit + 1), USER_FIELDS)
+    deleted = db.execute(
+        select(UserTombstone.user_id, UserTombstone.version)
+        .where(and_(
+            UserTombstone.account_id == account.id, UserTombstone.version > since, UserTombstone.version <= current
+        ))
+        .order_by(UserTombstone.version)
+        .limit(limit + 1)
+    ).all()
+    release(db)
+
+    changes = sorted(
+        [(row.version, row) for row in changed] + [(row.version, row.user_id) for row in deleted],
+        key=lambda change: change[0],
+    )
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    watermark = changes[-1][0] if has_more else max(current, since)
+    return ChangeSet(
+        changed=[change for _, change in changes if isinstance(change, UserRow)],
+        deleted=[change for _, change in changes if not isinstance(change, UserRow)],
+        version=watermark,
+        has_more=has_more,
+    )
+
+
+def _buckets(executor, account_id: int, columns: tuple):
+    """
+    Yields the IDs of the users sharing a key, scanning the account's key index in order.
+
+    Only the current bucket is held in memory, so the scan is linear in the number of users.
+    """
+    stmt = (
+        select(*columns, User.id)
+        .where(User.account_id == account_id, columns[0].is_not(None))
+        .order_by(*columns, User.id)
+        .execution_options(yield_per=STREAM_BATCH_SIZE)
+    )
+    key, ids = None, []
+    for row in executor.execute(stmt):
+        row_key = tuple(row[:-1])
+        if row_key != key:
+            if 1 < len(ids) <= MAX_BUCKET_SIZE:
+                yield ids
+            key, ids = row_key, []
+        if len(ids) <= MAX_BUCKET_SIZE:
+            ids.append(row.id)
+    if 1 < len(ids) <= MAX_BUCKET_SIZE:
+        yield ids
+
+
+def _duplicate_groups(executor, account_id: int) -> List[Tuple[List[int], List[str]]]:
+    """
+    Joins the buckets of all blocking keys into groups with a union-find over the duplicate IDs.
+    """
+    parent = {}
+
+    def find(user_id):
+        root = user_id
+        while parent.setdefault(root, root) != root:
+            root = parent[root]
+        while user_id != root:
+            parent[user_id], user_id = root, parent[user_id]
+        return root
+
+    matches = []
+    for reason, columns in DUPLICATE_KEYS:
+        for ids in _buckets(executor, account_id, columns):
+            root = find(ids[0])
+            for user_id in ids[1:]:
+                other = find(user_id)
+                if other != root:
+                    parent[other] = root
+            matches.append((reason, ids[0]))
+    members = defaultdict(list)
+    for user_id in parent:
+        members[find(user_id)].append(user_id)
+    reasons = defaultdict(set)
+    for reason, user_id in matches:
+        reasons[find(user_id)].add(reason)
+    groups = [
+        (sorted(ids), [reason for reason, _ in DUPLICATE_KEYS if reason in reasons[root]])
+        for root, ids in members.items()
+    ]
+    return sorted(groups, key=lambda group: group[0][0])
+
+
+def _versioned_duplicate_groups(executor, account_id: int) -> Tuple[int, List[Tuple[List[int], List[str]]]]:
+    # The version is read first, the groups are at least as recent as it.
+    version = executor.execute(
+        select(AccountVersion.version).where(AccountVersion.account_id == account_id)
+    ).scalar() or 0
+    return version, _duplicate_groups(executor, account_id)
+
+
+async def _cached_duplicate_groups(db: Session, account_id: int) -> List[Tuple[List[int], List[str]]]:
+    """
+    Duplicate groups of an account, detected again only after the account's users changed.
+
+    Every write bumps the account version, so groups detected at the current version or a
+    later one are still exact and pages are cut from them without scanning the key indexes.
+    Sessions that must see their own uncommitted writes neither use nor fill the cache.
+    """
+    def read(executor):
+        return _versioned_duplicate_groups(executor, account_id)
+
+    if not _shareable(db):
+        return (await _shared(("find_duplicates", account_id), db, account_id, read))[1]
+    key = (db.get_bind(User.__mapper__), account_id)
+    version = db.execute(
+        select(AccountVersion.version).where(AccountVersion.account_id == account_id),
+        bind_arguments=_bind_arguments(await _read_bind(db, account_id)),
+    ).scalar() or 0
+    groups = _duplicate_groups_cache.get(key, version)
+    if groups is not None:
+        return groups
+    version, groups = await _shared(("find_duplicates", account_id, version), db, account_id, read)
+    _duplicate_groups_cache.put(key, version, groups)
+    return groups
+
+
+async def find_duplicates(
+    skip: int, limit: int, account: Account, db: Session, fields: Tuple[str, ...] = USER_FIELDS
+):
+    """
+    Returns groups of users that are probably the same contact.
+
+    Users are bucketed by normalized email, phone number suffix and name fingerprints, without
+    comparing them pairwise, and users linked through any key end up in one group. Concurrent
+    calls for the same account share one detection, and its groups are kept until the account's
+    users change, so paging through them does not run it again.
+
+    :param skip: Skip the first n groups
+    :type skip: int
+    :param limit: Limit the number of groups returned
+    :type limit: int
+    :param account: User account
+    :type account: Account
+    :param db: DB session
+    :type db: Session
+    :param fields: Selected columns, see :func:`parse_fields`
+    :type fields: tuple[str, ...]
+    :return: Groups ordered by their lowest user ID
+    :rtype: list[DuplicateGroup]
+    """
+    account_id = account.id
+    groups = await _cached_duplicate_groups(db, account_id)
+    page = groups[skip:skip + limit]
+    ids = [user_id for members, _ in page for user_id in members]
+    if not ids:
+        return []
+    stmt = _select_users(fields).where(User.account_id == account_id, User.id.in_(ids))
+    rows = {row.id: row for row in _rows(db, stmt, fields, await _read_bind(db, account_id))}
+    return [
+        DuplicateGroup(reasons, [rows[user_id] for user_id in members if user_id in rows]) for members, reasons in page
+    ]
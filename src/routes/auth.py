@@ -1,15 +1,19 @@
+import logging
 from typing import List
 
 from fastapi import APIRouter, HTTPException, Depends, status, Security, BackgroundTasks, Request
 from fastapi.security import OAuth2PasswordRequestForm, HTTPAuthorizationCredentials, HTTPBearer
 from sqlalchemy.orm import Session
-from fastapi_limiter.depends import RateLimiter
 
 from src.database.db import get_db
 from src.schemas import AccountModel, AccountResponse, TokenModel, RequestEmail
 from src.repository import accounts
 from src.services.auth import auth_service
 from src.services.email import send_email
+from src.services.resilience import FailOpenRateLimiter
+
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 security = HTTPBearer()
@@ -17,7 +21,7 @@ security = HTTPBearer()
 
 @router.post("/signup", response_model=AccountResponse, status_code=status.HTTP_201_CREATED, 
             description='No more than 1 account per minute',
-            dependencies=[Depends(RateLimiter(times=1, seconds=60))]
+            dependencies=[Depends(FailOpenRateLimiter(times=1, seconds=60))]
 )
 async def signup(body: AccountModel, background_tasks: BackgroundTasks, request: Request, db: Session = Depends(get_db)):
     """
@@ -57,7 +61,6 @@ async def login(body: OAuth2PasswordRequestForm = Depends(), db: Session = Depen
     """
     acc = await accounts.get_email_by_username(body.username, db)
     user = await accounts.get_user_by_email(acc.email, db)
-    print(type(body.username))
     if user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid email!")
     if not user.confirmed:
@@ -108,13 +111,13 @@ async def confirmed_email(token: str, db: Session = Depends(get_db)):
     :rtype: dict
     """
     email = await auth_service.get_email_from_token(token)
-    print("email ", email)
+    logger.debug("Confirming email %s", email)
     user = await accounts.get_user_by_email(email, db)
     if user is None:
-        print("user error")
+        logger.info("Email confirmation for unknown account %s", email)
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Verification error")
     if user.confirmed:
-        print("conf error")
+        logger.debug("Email %s already confirmed", email)
         return {"message": "Your email is already confirmed"}
     await accounts.confirmed_email(email, db)
     return {"message": "Email confirmed"}
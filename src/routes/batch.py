@@ -0,0 +1,54 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from sqlalchemy.orm import Session
+
+from src.conf.config import settings
+from src.database.db import get_db
+from src.database.models import Account
+from src.schemas import BatchRequest, BatchResponse
+from src.services import batch
+from src.services.auth import auth_service
+from src.services.serialization import batch_json_response
+
+
+router = APIRouter(prefix="/batch", tags=["batch"])
+
+
+@router.post("", response_model=BatchResponse)
+async def run_batch(
+    body: BatchRequest,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: Account = Depends(auth_service.get_current_user),
+):
+    """
+    Execute several API calls in one round trip.
+
+    The caller is authenticated once, and all calls share one database session. With ``atomic``
+    the calls run in one transaction and the first failing call rolls all of them back.
+
+    :param body: Calls to execute.
+    :type body: BatchRequest
+    :param request: Batch request.
+    :type request: Request
+    :param db: Database session.
+    :type db: Session
+    :param current_user: Current authenticated user.
+    :type current_user: Account
+    :return: Responses of the calls.
+    :rtype: BatchResponse
+    """
+    if len(body.operations) > settings.batch_max_operations:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"No more than {settings.batch_max_operations} operations per batch",
+        )
+    for operation in body.operations:
+        if operation.path.partition("?")[0].rstrip("/").startswith(batch.EXCLUDED_PATHS):
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"{operation.path} can not be batched"
+            )
+    engine = db.get_bind()
+    # The account is loaded, release the connection while the operations run on the batch session.
+    db.close()
+    results, committed = await batch.run_batch(request, body.operations, current_user, engine, body.atomic)
+    return batch_json_response(results, committed)
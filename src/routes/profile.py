@@ -1,7 +1,4 @@
-import cloudinary
-import cloudinary.uploader
-
-from fastapi import UploadFile, File, APIRouter, Depends
+from fastapi import UploadFile, File, APIRouter, Depends, HTTPException, status
 
 from sqlalchemy.orm import Session
 
@@ -10,6 +7,7 @@ from src.conf.config import settings
 from src.repository import accounts
 from src.schemas import AccountDb
 from src.services.auth import auth_service
+from src.services.resilience import DependencyUnavailable, cloudinary_calls
 from src.database.models import Account
 
 
@@ -42,7 +40,11 @@ async def update_avatar_user(file: UploadFile = File(), current_user: Account =
     :type db: Session
     :return: Updated user's profile information.
     :rtype: AccountDb
+    :raises HTTPException: ``503`` while Cloudinary is slow or failing; the avatar is unchanged.
     """
+    import cloudinary
+    import cloudinary.uploader
+
     cloudinary.config(
         cloud_name=settings.cloudinary_name,
         api_key=settings.cloudinary_api_key,
@@ -50,7 +52,17 @@ async def update_avatar_user(file: UploadFile = File(), current_user: Account =
         secure=True
     )
 
-    r = cloudinary.uploader.upload(file.file, public_id=f'Profile/{current_user.login}', overwrite=True)
+    try:
+        r = await cloudinary_calls.call_sync(
+            cloudinary.uploader.upload, file.file, public_id=f'Profile/{current_user.login}', overwrite=True,
+            timeout=settings.cloudinary_timeout_seconds,
+        )
+    except DependencyUnavailable:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Avatar storage is unavailable, retry later",
+            headers={"Retry-After": str(int(settings.circuit_reset_seconds))},
+        )
     src_url = cloudinary.CloudinaryImage(f'Profile/{current_user.login}').build_url(width=250, height=250, crop='fill', version=r.get('version'))
     user = await accounts.update_avatar(current_user.email, src_url, db)
     return user
\ No newline at end of file
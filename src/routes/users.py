@@ -1,37 +1,91 @@
+import asyncio
 from typing import List
 
-from fastapi import APIRouter, HTTPException, Depends, status, Query
-from fastapi_limiter.depends import RateLimiter
+from fastapi import APIRouter, HTTPException, Depends, status, Query, Header, Request
+from fastapi.responses import StreamingResponse
 
 from sqlalchemy.orm import Session
 
 from src.database.db import get_db
-from src.schemas import UserModel, UserResponse, UserUpdate
+from src.schemas import (
+    UserModel, UserResponse, UserUpdate, UserPatch, UserChanges, UserBulkDelete, UserBulkPatch, BulkResult,
+    UserMerge, DuplicateGroup,
+)
 from src.repository import users as users_repo
+from src.repository import users_read
 from src.database.models import User, Account
 from src.services.auth import auth_service
+from src.services.events import contact_events
+from src.services.resilience import FailOpenRateLimiter
+from src.conf.config import settings
+from src.services.serialization import (
+    users_json_response, user_json_response, changes_json_response, bulk_json_response, duplicates_json_response,
+)
 
 
 router = APIRouter(prefix="/users")
 
 
+async def sparse_fields(
+    fields: str = Query(default=None, description="Comma separated fields to return, e.g. name,phone")
+):
+    """
+    Parse the ``fields`` query parameter of the read endpoints.
+
+    :param fields: Comma separated field names.
+    :type fields: str
+    :return: Selected fields.
+    :rtype: tuple[str, ...]
+    :raises HTTPException: If a field name is unknown.
+    """
+    try:
+        return users_read.parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+
+
+async def data_filters(request: Request):
+    """
+    Parse the ``data.<attribute>=<value>`` query parameters of the list endpoint.
+
+    :param request: Current request.
+    :type request: Request
+    :return: Attribute filters.
+    :rtype: tuple
+    :raises HTTPException: If a filter is invalid.
+    """
+    try:
+        return users_read.parse_data_filters(request.query_params.multi_items())
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+
+
 @router.get("/", response_model=List[UserResponse], 
             description='No more than 5 requests per minute',
-            dependencies=[Depends(RateLimiter(times=5, seconds=60))]
+            dependencies=[Depends(FailOpenRateLimiter(times=5, seconds=60))]
             )
 async def read_users(
     skip: int = 0,
     limit: int = 100,
+    fields: tuple = Depends(sparse_fields),
+    data: tuple = Depends(data_filters),
     db: Session = Depends(get_db),
     current_user: Account = Depends(auth_service.get_current_user),
 ):
     """
     Retrieve a list of users.
 
+    Query parameters like ``data.company=Acme`` keep the users whose ``additional_data``
+    has these attribute values.
+
     :param skip: Number of records to skip.
     :type skip: int
     :param limit: Maximum number of records to retrieve.
     :type limit: int
+    :param fields: Fields to return.
+    :type fields: tuple[str, ...]
+    :param data: Attribute filters.
+    :type data: tuple
     :param db: Database session.
     :type db: Session
     :param current_user: Current authenticated user.
@@ -39,13 +93,106 @@ async def read_users(
     :return: List of users.
     :rtype: List[UserResponse]
     """
-    users = await users_repo.get_users(skip, limit, current_user, db)
-    return users
+    users = await users_read.get_users(skip, limit, current_user, db, fields, data)
+    return users_json_response(users, fields)
+
+
+async def expected_version(
+    if_match: str = Header(default=None, description='ETag of the user, e.g. "3", to update only that version')
+):
+    """
+    Parse the ``If-Match`` header of conditional writes.
+
+    :param if_match: ETag sent by the client.
+    :type if_match: str
+    :return: Expected user version or None for unconditional writes.
+    :rtype: int or None
+    :raises HTTPException: If the header is not a user ETag.
+    """
+    if if_match is None or if_match.strip() == "*":
+        return None
+    tag = if_match.strip().removeprefix("W/").strip('"')
+    if not tag.isdigit():
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail="Invalid If-Match header")
+    return int(tag)
+
+
+@router.get("/changes", response_model=UserChanges)
+async def read_changes(
+    since: int = Query(default=0, ge=0, description="Last version the client has seen"),
+    limit: int = Query(default=500, ge=1, le=5000),
+    db: Session = Depends(get_db),
+    current_user: Account = Depends(auth_service.get_current_user),
+):
+    """
+    Retrieve users created, updated or deleted after a version.
+
+    :param since: Last version the client has seen.
+    :type since: int
+    :param limit: Maximum number of changes to retrieve.
+    :type limit: int
+    :param db: Database session.
+    :type db: Session
+    :param current_user: Current authenticated user.
+    :type current_user: Account
+    :return: Changed users, deleted user IDs and the new watermark.
+    :rtype: UserChanges
+    :raises HTTPException: ``410`` if deletions after ``since`` are no longer kept: the client
+        must drop its copy and sync again from ``since=0``.
+    """
+    try:
+        changes = await users_read.get_changes(since, limit, current_user, db)
+    except users_read.ResyncRequired:
+        raise HTTPException(status_code=status.HTTP_410_GONE, detail="Resync required, sync again from version 0")
+    return changes_json_response(changes)
+
+
+async def event_stream(account_id: int):
+    """
+    Stream the contact change events of an account, with a heartbeat comment while idle.
+
+    :param account_id: Account ID.
+    :type account_id: int
+    :return: Server-Sent Events.
+    :rtype: AsyncIterator[bytes]
+    """
+    with contact_events.subscribe(account_id) as queue:
+        yield b"retry: 5000\n\n"
+        while True:
+            try:
+                yield await asyncio.wait_for(queue.get(), timeout=settings.events_heartbeat_seconds)
+            except asyncio.TimeoutError:
+                yield b": ping\n\n"
+
+
+@router.get("/events", response_class=StreamingResponse)
+async def read_events(db: Session = Depends(get_db), current_user: Account = Depends(auth_service.get_current_user)):
+    """
+    Subscribe to created, updated and deleted events of the current account's users (Server-Sent Events).
+
+    Event ids are change versions; after a reconnect or a ``resync`` event the client
+    catches up through ``GET /users/changes``.
+
+    :param db: Database session.
+    :type db: Session
+    :param current_user: Current authenticated user.
+    :type current_user: Account
+    :return: Event stream.
+    :rtype: StreamingResponse
+    """
+    account_id = current_user.id
+    db.close()
+    return StreamingResponse(
+        event_stream(account_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @router.get("/{user_id:int}", response_model=UserResponse)
 async def read_users(
     user_id: int,
+    fields: tuple = Depends(sparse_fields),
     db: Session = Depends(get_db), 
     current_user: Account = Depends(auth_service.get_current_user)
 ):
@@ -54,6 +201,8 @@ async def read_users(
 
     :param user_id: ID of the user to retrieve.
     :type user_id: int
+    :param fields: Fields to return.
+    :type fields: tuple[str, ...]
     :param db: Database session.
     :type db: Session
     :param current_user: Current authenticated user.
@@ -61,10 +210,10 @@ async def read_users(
     :return: User information.
     :rtype: UserResponse
     """
-    user = await users_repo.get_user(user_id, current_user, db)
+    user = await users_read.get_user(user_id, current_user, db, fields)
     if user is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    return user
+    return user_json_response(user, fields)
 
 
 @router.get("/find", response_model=UserResponse)
@@ -72,6 +221,7 @@ async def find_user(
     user_name: str = Query(title="User Name", default=None),
     user_surname: str = Query(title="User Surname", default=None),
     user_email: str = Query(title="User Email", default=None),
+    fields: tuple = Depends(sparse_fields),
     db: Session = Depends(get_db),
     current_user: Account = Depends(auth_service.get_current_user)
 ):
@@ -84,6 +234,8 @@ async def find_user(
     :type user_surname: str
     :param user_email: Email of the user.
     :type user_email: str
+    :param fields: Fields to return.
+    :type fields: tuple[str, ...]
     :param db: Database session.
     :type db: Session
     :param current_user: Current authenticated user.
@@ -91,16 +243,95 @@ async def find_user(
     :return: User information.
     :rtype: UserResponse
     """
-    user = await users_repo.find_user(user_name, user_surname, user_email, current_user, db)
+    user = await users_read.find_user(user_name, user_surname, user_email, current_user, db, fields)
     if user is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    return user
+    return user_json_response(user, fields)
+
+
+@router.get("/by-phone/{number}", response_model=List[UserResponse])
+async def find_by_phone(
+    number: str,
+    fields: tuple = Depends(sparse_fields),
+    db: Session = Depends(get_db),
+    current_user: Account = Depends(auth_service.get_current_user),
+):
+    """
+    Find users by phone number, in any format, e.g. ``+380671234567`` or ``067 123 45 67``.
+
+    Numbers without a country code match on their last digits.
+
+    :param number: Phone number.
+    :type number: str
+    :param fields: Fields to return.
+    :type fields: tuple[str, ...]
+    :param db: Database session.
+    :type db: Session
+    :param current_user: Current authenticated user.
+    :type current_user: Account
+    :return: Users with this number.
+    :rtype: List[UserResponse]
+    """
+    users = await users_read.find_by_phone(number, current_user, db, fields)
+    return users_json_response(users, fields)
+
+
+@router.get("/duplicates", response_model=List[DuplicateGroup])
+async def read_duplicates(
+    skip: int = 0,
+    limit: int = Query(default=50, le=500),
+    fields: tuple = Depends(sparse_fields),
+    db: Session = Depends(get_db),
+    current_user: Account = Depends(auth_service.get_current_user),
+):
+    """
+    Retrieve groups of users that share an email, a phone number or a name, to review and merge.
+
+    :param skip: Number of groups to skip.
+    :type skip: int
+    :param limit: Maximum number of groups to retrieve.
+    :type limit: int
+    :param fields: Fields of the users to return.
+    :type fields: tuple[str, ...]
+    :param db: Database session.
+    :type db: Session
+    :param current_user: Current authenticated user.
+    :type current_user: Account
+    :return: Duplicate groups.
+    :rtype: List[DuplicateGroup]
+    """
+    groups = await users_read.find_duplicates(skip, limit, current_user, db, fields)
+    return duplicates_json_response(groups, fields)
+
+
+@router.post("/merge", response_model=UserResponse)
+async def merge_users(
+    body: UserMerge, db: Session = Depends(get_db), current_user: Account = Depends(auth_service.get_current_user)
+):
+    """
+    Merge duplicate users into one of them and remove the others, in one transaction.
+
+    :param body: User to keep and users to merge into it.
+    :type body: UserMerge
+    :param db: Database session.
+    :type db: Session
+    :param current_user: Current authenticated user.
+    :type current_user: Account
+    :return: Merged user.
+    :rtype: UserResponse
+    :raises HTTPException: If one of the users does not exist.
+    """
+    user = await users_repo.merge_users(body.primary_id, body.duplicate_ids, current_user, db)
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    return user_json_response(user)
 
 
 @router.put("/{user_id}", response_model=UserResponse)
 async def update_user(
     body: UserUpdate,
     user_id: int,
+    version: int = Depends(expected_version),
     db: Session = Depends(get_db),
     current_user: Account = Depends(auth_service.get_current_user),
 ):
@@ -111,6 +342,8 @@ async def update_user(
     :type user_id: int
     :param body: Updated user information.
     :type body: UserUpdate
+    :param version: Expected user version from the ``If-Match`` header.
+    :type version: int or None
     :param db: Database session.
     :type db: Session
     :param current_user: Current authenticated user.
@@ -118,10 +351,88 @@ async def update_user(
     :return: Updated user information.
     :rtype: UserResponse
     """
-    user = await users_repo.update_user(user_id, body, current_user, db)
+    try:
+        user = await users_repo.update_user(user_id, body, current_user, db, version)
+    except users_repo.VersionConflict:
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail="User was modified")
     if user is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    return user
+    return user_json_response(user)
+
+
+@router.post("/bulk-delete", response_model=List[BulkResult])
+async def bulk_remove_users(
+    body: UserBulkDelete, db: Session = Depends(get_db), current_user: Account = Depends(auth_service.get_current_user)
+):
+    """
+    Remove several users in one transaction.
+
+    :param body: IDs of the users to remove.
+    :type body: UserBulkDelete
+    :param db: Database session.
+    :type db: Session
+    :param current_user: Current authenticated user.
+    :type current_user: Account
+    :return: Outcome per user ID.
+    :rtype: List[BulkResult]
+    """
+    results = await users_repo.bulk_remove_users(body.ids, current_user, db)
+    return bulk_json_response(results)
+
+
+@router.patch("/bulk", response_model=List[BulkResult])
+async def bulk_patch_users(
+    body: UserBulkPatch, db: Session = Depends(get_db), current_user: Account = Depends(auth_service.get_current_user)
+):
+    """
+    Update the given fields of several users in one transaction.
+
+    Users whose version differs from the given one are reported as ``conflict`` and left unchanged.
+
+    :param body: Patches per user ID.
+    :type body: UserBulkPatch
+    :param db: Database session.
+    :type db: Session
+    :param current_user: Current authenticated user.
+    :type current_user: Account
+    :return: Outcome per user ID.
+    :rtype: List[BulkResult]
+    """
+    results = await users_repo.bulk_patch_users(body.items, current_user, db)
+    return bulk_json_response(results)
+
+
+@router.patch("/{user_id}", response_model=UserResponse)
+async def patch_user(
+    body: UserPatch,
+    user_id: int,
+    version: int = Depends(expected_version),
+    db: Session = Depends(get_db),
+    current_user: Account = Depends(auth_service.get_current_user),
+):
+    """
+    Update only the given fields of a user.
+
+    :param user_id: ID of the user to update.
+    :type user_id: int
+    :param body: Fields to update.
+    :type body: UserPatch
+    :param version: Expected user version from the ``If-Match`` header.
+    :type version: int or None
+    :param db: Database session.
+    :type db: Session
+    :param current_user: Current authenticated user.
+    :type current_user: Account
+    :return: Updated user information.
+    :rtype: UserResponse
+    """
+    try:
+        user = await users_repo.patch_user(user_id, body, current_user, db, version)
+    except users_repo.VersionConflict:
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail="User was modified")
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    return user_json_response(user)
 
 
 @router.post("/", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
@@ -155,19 +466,24 @@ async def upcoming_birthdays_list(db: Session = Depends(get_db), current_user: A
     :return: List of users with upcoming birthdays.
     :rtype: List[UserResponse]
     """
-    users = await users_repo.upcoming_birthdays(db, current_user)
-    return users
+    users = await users_read.upcoming_birthdays(db, current_user)
+    return users_json_response(users)
 
 
 @router.delete("/{user_id}", response_model=UserResponse)
 async def remove_user(
-    user_id: int, db: Session = Depends(get_db), current_user: Account = Depends(auth_service.get_current_user)
+    user_id: int,
+    version: int = Depends(expected_version),
+    db: Session = Depends(get_db),
+    current_user: Account = Depends(auth_service.get_current_user),
 ):
     """
     Remove a user.
 
     :param user_id: ID of the user to remove.
     :type user_id: int
+    :param version: Expected user version from the ``If-Match`` header.
+    :type version: int or None
     :param db: Database session.
     :type db: Session
     :param current_user: Current authenticated user.
@@ -175,7 +491,10 @@ async def remove_user(
     :return: Removed user information.
     :rtype: UserResponse
     """
-    user = await users_repo.remove_user(user_id, current_user, db)
+    try:
+        user = await users_repo.remove_user(user_id, current_user, db, version)
+    except users_repo.VersionConflict:
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail="User was modified")
     if user is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    return user
+    return user_json_response(user)
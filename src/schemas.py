@@ -1,6 +1,6 @@
 from datetime import date
-from pydantic import BaseModel, Field, EmailStr, ConfigDict
-from typing import Optional
+from pydantic import BaseModel, Field, EmailStr, ConfigDict, field_validator, model_validator
+from typing import Any, Dict, List, Literal, Optional
 
 
 class UserModel(BaseModel):
@@ -17,15 +17,15 @@ class UserModel(BaseModel):
     :type phone: str
     :param birthdate: The user's date of birth.
     :type birthdate: date
-    :param additional_data: Additional data about the user.
-    :type additional_data: str, optional
+    :param additional_data: Custom attributes of the user, a JSON object.
+    :type additional_data: dict, optional
     """
     name: str = Field(max_length=50)
     surname: str = Field(None, max_length=50)
     email: EmailStr
     phone: str = Field(max_length=20)
     birthdate: date
-    additional_data: str = None
+    additional_data: Optional[Dict[str, Any]] = None
 
     class Config(ConfigDict):
         from_attributes = True
@@ -47,8 +47,10 @@ class UserResponse(BaseModel):
     :type phone: str
     :param birthdate: The user's date of birth.
     :type birthdate: date
-    :param additional_data: Additional data about the user.
-    :type additional_data: str, optional
+    :param additional_data: Custom attributes of the user, a JSON object.
+    :type additional_data: dict, optional
+    :param version: Change version of the user.
+    :type version: int
     """
     id: int
     id: int
@@ -57,7 +59,8 @@ class UserResponse(BaseModel):
     email: EmailStr
     phone: str
     birthdate: date
-    additional_data: Optional[str]
+    additional_data: Optional[Dict[str, Any]]
+    version: int = 0
 
     class Config(ConfigDict):
         from_attributes = True
@@ -70,6 +73,230 @@ class UserUpdate(UserModel):
     ...
 
 
+class UserPatch(BaseModel):
+    """
+    Represents a model for partially updating user data, only the fields sent are changed.
+
+    :param name: The user's first name.
+    :type name: str, optional
+    :param surname: The user's last name.
+    :type surname: str, optional
+    :param email: The user's email address.
+    :type email: EmailStr, optional
+    :param phone: The user's phone number.
+    :type phone: str, optional
+    :param birthdate: The user's date of birth.
+    :type birthdate: date, optional
+    :param additional_data: Custom attributes of the user, a JSON object.
+    :type additional_data: dict, optional
+    """
+    name: Optional[str] = Field(None, max_length=50)
+    surname: Optional[str] = Field(None, max_length=50)
+    email: Optional[EmailStr] = None
+    phone: Optional[str] = Field(None, max_length=20)
+    birthdate: Optional[date] = None
+    additional_data: Optional[Dict[str, Any]] = None
+
+    @field_validator("name", "email", "phone", "birthdate")
+    @classmethod
+    def not_null(cls, value):
+        """
+        Reject explicit nulls for required user fields.
+        """
+        if value is None:
+            raise ValueError("field can not be null")
+        return value
+
+    @model_validator(mode="after")
+    def not_empty(self):
+        """
+        Reject patches without any field.
+        """
+        if not self.model_fields_set:
+            raise ValueError("at least one field is required")
+        return self
+
+
+MAX_BULK_ITEMS = 5000
+
+
+class UserBulkDelete(BaseModel):
+    """
+    Represents a request to remove several users at once.
+
+    :param ids: IDs of the users to remove.
+    :type ids: List[int]
+    """
+    ids: List[int] = Field(min_length=1, max_length=MAX_BULK_ITEMS)
+
+
+class UserBulkPatchItem(BaseModel):
+    """
+    Represents one user of a bulk partial update.
+
+    :param id: ID of the user to update.
+    :type id: int
+    :param version: Update only if the user still has this version.
+    :type version: int, optional
+    :param changes: Fields to update.
+    :type changes: UserPatch
+    """
+    id: int
+    version: Optional[int] = None
+    changes: UserPatch
+
+
+class UserBulkPatch(BaseModel):
+    """
+    Represents a request to partially update several users at once.
+
+    :param items: Users to update, every ID at most once.
+    :type items: List[UserBulkPatchItem]
+    """
+    items: List[UserBulkPatchItem] = Field(min_length=1, max_length=MAX_BULK_ITEMS)
+
+    @model_validator(mode="after")
+    def unique_ids(self):
+        """
+        Reject requests updating the same user twice.
+        """
+        if len({item.id for item in self.items}) != len(self.items):
+            raise ValueError("user ids must be unique")
+        return self
+
+
+class UserMerge(BaseModel):
+    """
+    Represents a request to merge duplicate users into one of them.
+
+    :param primary_id: ID of the user to keep.
+    :type primary_id: int
+    :param duplicate_ids: IDs of the users to merge into it and remove, in priority order.
+    :type duplicate_ids: List[int]
+    """
+    primary_id: int
+    duplicate_ids: List[int] = Field(min_length=1, max_length=MAX_BULK_ITEMS)
+
+    @model_validator(mode="after")
+    def distinct_ids(self):
+        """
+        Reject repeated users.
+        """
+        ids = [self.primary_id, *self.duplicate_ids]
+        if len(set(ids)) != len(ids):
+            raise ValueError("user ids must be unique")
+        return self
+
+
+class DuplicateGroup(BaseModel):
+    """
+    Represents users that are probably the same contact.
+
+    :param reasons: Shared keys, among ``email``, ``phone`` and ``name``.
+    :type reasons: List[str]
+    :param users: Users of the group, by ID.
+    :type users: List[UserResponse]
+    """
+    reasons: List[str]
+    users: List[UserResponse]
+
+
+class BulkResult(BaseModel):
+    """
+    Represents the outcome of a bulk operation for one user.
+
+    :param id: ID of the user.
+    :type id: int
+    :param status: ``updated``, ``deleted``, ``not_found`` or ``conflict``.
+    :type status: str
+    :param version: Change version of the update or removal, or the current version on conflict.
+    :type version: int, optional
+    """
+    id: int
+    status: str
+    version: Optional[int] = None
+
+
+class UserChanges(BaseModel):
+    """
+    Represents a page of the users change feed.
+
+    :param changed: Users created or updated since the requested version.
+    :type changed: List[UserResponse]
+    :param deleted: IDs of users deleted since the requested version.
+    :type deleted: List[int]
+    :param version: Watermark to pass as ``since`` in the next request.
+    :type version: int
+    :param has_more: True if more changes are available after ``version``.
+    :type has_more: bool
+    """
+    changed: List[UserResponse]
+    deleted: List[int]
+    version: int
+    has_more: bool
+
+
+class BatchOperation(BaseModel):
+    """
+    Represents one API call of a batch request.
+
+    :param method: HTTP method.
+    :type method: str
+    :param path: API path with an optional query string, e.g. ``/api/users/?limit=10``.
+    :type path: str
+    :param headers: Extra request headers, e.g. ``If-Match``.
+    :type headers: Dict[str, str]
+    :param body: JSON request body.
+    :type body: Any, optional
+    """
+    method: Literal["GET", "POST", "PUT", "PATCH", "DELETE"]
+    path: str = Field(pattern=r"^/api/")
+    headers: Dict[str, str] = {}
+    body: Any = None
+
+
+class BatchRequest(BaseModel):
+    """
+    Represents several API calls executed in one round trip.
+
+    :param operations: Calls executed in order.
+    :type operations: List[BatchOperation]
+    :param atomic: Run all calls in one transaction, rolled back if any call fails.
+    :type atomic: bool
+    """
+    operations: List[BatchOperation] = Field(min_length=1)
+    atomic: bool = False
+
+
+class BatchOperationResponse(BaseModel):
+    """
+    Represents the response of one call of a batch request.
+
+    :param status: HTTP status code.
+    :type status: int
+    :param headers: Response headers.
+    :type headers: Dict[str, str]
+    :param body: Response body.
+    :type body: Any
+    """
+    status: int
+    headers: Dict[str, str]
+    body: Any
+
+
+class BatchResponse(BaseModel):
+    """
+    Represents the responses of a batch request.
+
+    :param responses: Responses in the order of the calls.
+    :type responses: List[BatchOperationResponse]
+    :param committed: False if an atomic batch was rolled back.
+    :type committed: bool
+    """
+    responses: List[BatchOperationResponse]
+    committed: bool
+
+
 class UserNameQuery(BaseModel):
     """
     Represents a model for querying users by username.
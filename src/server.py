@@ -0,0 +1,68 @@
+"""
+Production launcher: ``python main.py``.
+
+Starts ``settings.worker_count`` uvicorn worker processes, one per CPU by default, on uvloop
+and httptools when they are installed. The database and Redis pools of every worker are its
+share of the connection budgets, see :meth:`Settings.db_pool_options`.
+
+Signals sent to the parent process:
+
+* ``SIGHUP`` replaces the workers one at a time. Each new worker is warmed up and ready
+  before the old one stops, so a reload with new code or settings drops no request.
+* ``SIGTERM`` / ``SIGINT`` stop accepting connections. The requests in flight and their
+  background tasks get ``server_graceful_timeout`` seconds to finish, then the lifespan
+  shutdown closes the shared clients.
+* ``SIGTTIN`` / ``SIGTTOU`` add or remove a worker.
+"""
+import importlib.util
+import os
+
+import uvicorn
+
+from src.conf.config import settings
+
+
+WORKERS_ENV = "SERVER_WORKERS"
+
+
+def _installed(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def event_loop() -> str:
+    """
+    Event loop of the workers: uvloop when installed, else asyncio.
+
+    :rtype: str
+    """
+    return "uvloop" if _installed("uvloop") else "asyncio"
+
+
+def http_protocol() -> str:
+    """
+    HTTP parser of the workers: httptools when installed, else h11.
+
+    :rtype: str
+    """
+    return "httptools" if _installed("httptools") else "h11"
+
+
+def run(app: str = "main:app"):
+    """
+    Serve the application with the configured workers until a termination signal.
+
+    :param app: Import string of the ASGI application, imported by every worker.
+    :type app: str
+    """
+    workers = settings.worker_count
+    # Workers read the resolved count from their environment to size their pools.
+    os.environ[WORKERS_ENV] = str(workers)
+    uvicorn.run(
+        app,
+        host=settings.server_host,
+        port=settings.server_port,
+        workers=workers,
+        loop=event_loop(),
+        http=http_protocol(),
+        timeout_graceful_shutdown=settings.server_graceful_timeout,
+    )
@@ -1,42 +1,66 @@
+import logging
+from functools import cached_property
 from typing import Optional
 
 from jose import JWTError, jwt
-from fastapi import HTTPException, status, Depends
+from fastapi import HTTPException, status, Depends, Request
 from fastapi.security import OAuth2PasswordBearer
-from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
 
-from src.database.db import get_db
+from src.database.db import get_db, shard_map
+from src.database.shards import ShardUnavailable
 from src.repository import accounts
 from src.conf.config import settings
 
 
+logger = logging.getLogger(__name__)
+
+
 class Auth:
     """
     Provides authentication and token management functionality.
 
     Attributes:
-        pwd_context (CryptContext): Password hashing context.
+        pwd_context (CryptContext): Password hashing context, created on first use.
         SECRET_KEY (str): Secret key for token encoding and decoding.
         ALGORITHM (str): Algorithm used for token encoding and decoding.
         oauth2_scheme (OAuth2PasswordBearer): OAuth2 password bearer scheme.
 
     Methods:
+        warm_up: Load the password hashing backend ahead of the first request.
         verify_password: Verify a plain password against a hashed password.
         get_password_hash: Generate a hashed password from a plain password.
         create_access_token: Create an access token with the given data and expiration delta.
         create_refresh_token: Create a refresh token with the given data and expiration delta.
         decode_refresh_token: Decode a refresh token to retrieve the email.
         get_current_user: Retrieve the current user from the access token.
+        access_token_subject: Retrieve the subject of the access token in an Authorization header.
         create_email_token: Create an email verification token with the given data.
         get_email_from_token: Retrieve the email from an email verification token.
     """
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
     SECRET_KEY = settings.secret_key
     ALGORITHM = settings.algorithm
     oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
+    @cached_property
+    def pwd_context(self):
+        """
+        Password hashing context, created on first use to keep passlib out of the startup path.
+
+        :return: Hashing context.
+        :rtype: passlib.context.CryptContext
+        """
+        from passlib.context import CryptContext
+
+        return CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+    def warm_up(self):
+        """
+        Load the bcrypt backend, which passlib only does at the first hash.
+        """
+        self.pwd_context.hash("warm-up")
+
     def verify_password(self, plain_password, hashed_password):
         """
         Verify a plain password against a hashed password.
@@ -120,23 +144,34 @@ class Auth:
         except JWTError:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials")
 
-    async def get_current_user(self, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    async def get_current_user(
+        self, request: Request, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)
+    ):
         """
         Retrieve the current user from the access token.
 
+        Operations of a batch request reuse the account authenticated for the whole batch.
+        The session is then routed to the shard holding the account's contacts.
+
+        :param request: Current request.
+        :type request: Request
         :param token: Access token.
         :type token: str
         :param db: Database session.
         :type db: Session
         :return: Current authenticated user.
         :rtype: Account
-        :raises HTTPException: If the token validation fails or the user does not exist.
+        :raises HTTPException: If the token validation fails or the user does not exist,
+            or with ``503`` while the account's contacts move to another shard.
         """
         credentials_exception = HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
+        batch = request.scope.get("batch")
+        if batch is not None:
+            return batch.account
 
         try:
             payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
@@ -152,7 +187,35 @@ class Auth:
         user = await accounts.get_user_by_email(email, db)
         if user is None:
             raise credentials_exception
+        try:
+            shard_map.bind(db, user)
+        except ShardUnavailable:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Contacts are being moved, retry shortly",
+                headers={"Retry-After": "5"},
+            )
         return user
+
+    def access_token_subject(self, authorization: bytes) -> Optional[str]:
+        """
+        Retrieve the subject of the access token in an ``Authorization`` header, without a database lookup.
+
+        :param authorization: Raw ``Authorization`` header value.
+        :type authorization: bytes
+        :return: Email of the account, or None if the header holds no valid access token.
+        :rtype: str, optional
+        """
+        scheme, _, token = authorization.decode("latin-1").partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            return None
+        try:
+            payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
+        except JWTError:
+            return None
+        if payload.get("scope") != "access_token":
+            return None
+        return payload.get("sub")
     
 
     def create_email_token(self, data: dict):
@@ -189,7 +252,7 @@ class Auth:
             email = payload["sub"]
             return email
         except JWTError as e:
-            print(e)
+            logger.info("Invalid email verification token: %s", e)
             raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
                                 detail="Invalid token for email verification")
 
@@ -0,0 +1,186 @@
+import asyncio
+from contextlib import nullcontext
+from typing import Dict, List, NamedTuple, Optional
+
+import orjson
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from src.database.db import shard_map
+from src.database.models import Account
+from src.database.shards import SHARD_BIND, ShardedSession
+from src.services.events import contact_events
+
+
+EXCLUDED_PATHS = ("/api/batch", "/api/users/events")
+FORWARDED_HEADERS = (b"authorization", b"user-agent", b"x-forwarded-for")
+
+
+class BatchContext(NamedTuple):
+    """
+    State shared by the operations of one batch request, read by ``get_db`` and ``get_current_user``.
+    """
+    db: Session
+    account: Account
+
+
+class OperationResult(NamedTuple):
+    """
+    Response of one batch operation.
+    """
+    status: int
+    headers: Dict[str, str]
+    body: bytes
+    content_type: str
+
+
+SKIPPED = OperationResult(424, {}, b'{"detail":"Not executed, an earlier operation failed"}', "application/json")
+
+
+async def dispatch(
+    app, parent_scope: dict, method: str, path: str, headers: Dict[str, str], body: Optional[bytes],
+    context: BatchContext,
+) -> OperationResult:
+    """
+    Run one operation through the application in process, without a network round trip.
+
+    :param app: ASGI application.
+    :param parent_scope: ASGI scope of the batch request.
+    :type parent_scope: dict
+    :param method: HTTP method.
+    :type method: str
+    :param path: Path with an optional query string.
+    :type path: str
+    :param headers: Extra request headers, e.g. ``If-Match``.
+    :type headers: dict[str, str]
+    :param body: JSON request body.
+    :type body: bytes, optional
+    :param context: Shared session and account.
+    :type context: BatchContext
+    :return: Operation response.
+    :rtype: OperationResult
+    """
+    path, _, query = path.partition("?")
+    request_headers = [(name, value) for name, value in parent_scope["headers"] if name in FORWARDED_HEADERS]
+    request_headers += [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers.items()]
+    if body is not None:
+        request_headers += [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    scope = {
+        "type": "http",
+        "asgi": parent_scope.get("asgi", {"version": "3.0"}),
+        "http_version": parent_scope.get("http_version", "1.1"),
+        "method": method,
+        "scheme": parent_scope.get("scheme", "http"),
+        "server": parent_scope.get("server"),
+        "client": parent_scope.get("client"),
+        "root_path": parent_scope.get("root_path", ""),
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "headers": request_headers,
+        "state": dict(parent_scope.get("state", {})),
+        "batch": context,
+    }
+    complete = asyncio.Event()
+    received = False
+    start = {}
+    chunks = []
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": body or b"", "more_body": False}
+        await complete.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            start.update(message)
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                complete.set()
+
+    try:
+        await app(scope, receive, send)
+    except Exception:
+        # ServerErrorMiddleware re-raises after sending the 500 response.
+        if not start:
+            raise
+    finally:
+        complete.set()
+
+    response_headers = {
+        name.decode("latin-1"): value.decode("latin-1") for name, value in start.get("headers", [])
+        if name not in (b"content-length", b"content-type", b"server-timing")
+    }
+    content_type = next(
+        (value.decode("latin-1") for name, value in start.get("headers", []) if name == b"content-type"), ""
+    )
+    return OperationResult(start["status"], response_headers, b"".join(chunks), content_type)
+
+
+async def run_batch(request, operations: List, account: Account, engine: Engine, atomic: bool = False):
+    """
+    Run the operations of a batch request in order, sharing one session and the authenticated account.
+
+    In atomic mode all operations run in one transaction: the first operation answering with an error
+    status rolls the whole batch back, the remaining operations are skipped with ``424``, and change
+    events are only published once the transaction commits.
+
+    :param request: Batch request.
+    :type request: Request
+    :param operations: Operations with ``method``, ``path``, ``headers`` and ``body``.
+    :type operations: list[BatchOperation]
+    :param account: Authenticated account.
+    :type account: Account
+    :param engine: Engine of the primary database.
+    :type engine: Engine
+    :param atomic: Run all operations in one transaction.
+    :type atomic: bool
+    :return: Operation results and whether their changes were committed.
+    :rtype: tuple[list[OperationResult], bool]
+    """
+    shard = shard_map.shard_engine(account)
+    connection = transaction = None
+    if atomic:
+        # The transaction covers the contacts, so it runs in the account shard.
+        connection = (shard or engine).connect()
+        transaction = connection.begin()
+        # Commits inside the routes only release savepoints, the batch owns the outer transaction.
+        db = ShardedSession(
+            bind=engine if shard is not None else connection,
+            join_transaction_mode="create_savepoint", autoflush=False, expire_on_commit=False,
+        )
+        if shard is not None:
+            db.info[SHARD_BIND] = connection
+    else:
+        db = ShardedSession(bind=engine, autoflush=False, expire_on_commit=False)
+        shard_map.bind(db, account)
+    context = BatchContext(db, account)
+    results = []
+    failed = False
+    try:
+        with contact_events.deferred() if atomic else nullcontext() as pending:
+            for operation in operations:
+                if failed:
+                    results.append(SKIPPED)
+                    continue
+                body = orjson.dumps(operation.body) if operation.body is not None else None
+                result = await dispatch(
+                    request.app, request.scope, operation.method, operation.path, operation.headers, body, context
+                )
+                results.append(result)
+                failed = atomic and result.status >= 400
+        if atomic:
+            if failed:
+                transaction.rollback()
+            else:
+                transaction.commit()
+                await contact_events.flush(pending)
+    finally:
+        db.close()
+        if connection is not None:
+            connection.close()
+    return results, not failed
@@ -0,0 +1,61 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from src.services.metrics import metrics
+
+
+metrics.describe("coalesced_reads_total", "Reads served by joining an identical in-flight query")
+metrics.describe("executed_reads_total", "Reads that ran their own query")
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: while a call for a key is running, callers with the
+    same key await its result instead of starting another one.
+
+    Nothing is cached, the key is forgotten as soon as the call finishes. Results are shared,
+    so they must not be mutated by the callers.
+
+    :param name: Metrics label.
+    :type name: str
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable[Any]]):
+        """
+        Run ``call`` unless an identical call is in flight, then share its result.
+
+        :param key: Identity of the call, e.g. account, function and parameters.
+        :type key: Hashable
+        :param call: Factory of the awaitable to run.
+        :type call: Callable[[], Awaitable]
+        :return: Result of the call.
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(call())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+            metrics.inc("executed_reads_total", flight=self.name)
+        else:
+            metrics.inc("coalesced_reads_total", flight=self.name)
+        # Shielded, so a caller going away does not cancel the query the others wait for.
+        return await asyncio.shield(task)
+
+    def in_flight(self) -> int:
+        """
+        Number of calls currently running.
+
+        :rtype: int
+        """
+        return len(self._calls)
+
+    def _forget(self, key: Hashable, task: asyncio.Future):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved when every caller went away.
+            task.exception()
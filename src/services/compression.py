@@ -0,0 +1,226 @@
+import zlib
+from typing import Dict, Optional
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class GzipEncoder:
+    """
+    Incremental gzip compressor.
+    """
+    encoding = "gzip"
+
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(min(max(level, 1), 9), zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class BrotliEncoder:
+    """
+    Incremental brotli compressor, level is used as brotli quality.
+    """
+    encoding = "br"
+
+    def __init__(self, level: int):
+        self._compressor = brotli.Compressor(quality=min(max(level, 0), 11))
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class ZstdEncoder:
+    """
+    Incremental zstd compressor.
+    """
+    encoding = "zstd"
+
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=min(max(level, 1), 22)).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+ENCODERS = {"gzip": GzipEncoder}
+if zstandard is not None:
+    ENCODERS["zstd"] = ZstdEncoder
+if brotli is not None:
+    ENCODERS["br"] = BrotliEncoder
+
+PREFERENCE = ("br", "zstd", "gzip")
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "application/x-ndjson")
+UNCOMPRESSED_TYPES = ("text/event-stream",)
+BODYLESS_STATUSES = (204, 304)
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    Choose the response encoding from an ``Accept-Encoding`` header.
+
+    :param accept_encoding: Header value.
+    :type accept_encoding: str
+    :return: Supported encoding with the highest client weight, or None.
+    :rtype: str or None
+    """
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name] = weight
+    candidates = [
+        encoding for encoding in PREFERENCE
+        if encoding in ENCODERS and weights.get(encoding, weights.get("*", 0.0)) > 0
+    ]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda encoding: weights.get(encoding, weights.get("*", 0.0)))
+
+
+class CompressionMiddleware:
+    """
+    Compresses responses with gzip, brotli or zstd negotiated via ``Accept-Encoding``.
+
+    Complete bodies smaller than ``minimum_size`` are sent as is. Streaming bodies are
+    compressed chunk by chunk and flushed after every chunk, so clients see data as soon
+    as the application produces it.
+
+    :param app: ASGI application.
+    :param minimum_size: Smallest body worth compressing, in bytes.
+    :type minimum_size: int
+    :param level: Default compression level.
+    :type level: int
+    :param route_levels: Compression level per path prefix, the longest matching prefix wins.
+    :type route_levels: dict[str, int], optional
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, level: int = 6, route_levels: Optional[Dict[str, int]] = None):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.level = level
+        self.route_levels = sorted((route_levels or {}).items(), key=lambda item: len(item[0]), reverse=True)
+
+    def level_for(self, path: str) -> int:
+        """
+        Compression level for a request path.
+
+        :param path: URL path.
+        :type path: str
+        :return: Compression level.
+        :rtype: int
+        """
+        for prefix, level in self.route_levels:
+            if path.startswith(prefix):
+                return level
+        return self.level
+
+    async def __call__(self, scope, receive, send):
+        # HEAD responses have no body to compress, only the length of the uncompressed one.
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            return await self.app(scope, receive, send)
+        accept_encoding = ""
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+                break
+        encoding = negotiate_encoding(accept_encoding)
+        if encoding is None:
+            return await self.app(scope, receive, send)
+        responder = _CompressingResponder(send, ENCODERS[encoding], self.level_for(scope["path"]), self.minimum_size)
+        await self.app(scope, receive, responder)
+
+
+class _CompressingResponder:
+    def __init__(self, send, encoder_class, level: int, minimum_size: int):
+        self.send = send
+        self.encoder_class = encoder_class
+        self.level = level
+        self.minimum_size = minimum_size
+        self.encoder = None
+        self.start = None
+        self.compressing = None
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.start":
+            self.start = message
+            return
+        if message["type"] != "http.response.body" or self.compressing is False:
+            return await self.send(message)
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.compressing is None:
+            self.compressing = self._should_compress(len(body), more_body)
+            if not self.compressing:
+                await self.send(self.start)
+                return await self.send(message)
+            self.encoder = self.encoder_class(self.level)
+            if not more_body:
+                compressed = self.encoder.compress(body) + self.encoder.finish()
+                await self.send(self._compressed_start(len(compressed)))
+                return await self.send({"type": "http.response.body", "body": compressed})
+            await self.send(self._compressed_start(None))
+
+        chunk = self.encoder.compress(body) if body else b""
+        if not more_body:
+            chunk += self.encoder.finish()
+        await self.send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+    def _should_compress(self, size: int, more_body: bool) -> bool:
+        if self.start["status"] in BODYLESS_STATUSES:
+            return False
+        headers = {name.lower(): value for name, value in self.start.get("headers", [])}
+        if b"content-encoding" in headers:
+            return False
+        content_type = headers.get(b"content-type", b"").decode("latin-1")
+        if not content_type.startswith(COMPRESSIBLE_TYPES) or content_type.startswith(UNCOMPRESSED_TYPES):
+            return False
+        content_length = headers.get(b"content-length")
+        if content_length is not None:
+            return int(content_length) >= self.minimum_size
+        return more_body or size >= self.minimum_size
+
+    def _compressed_start(self, content_length: Optional[int]):
+        headers = [
+            (name, value) for name, value in self.start.get("headers", [])
+            if name.lower() not in (b"content-length", b"content-encoding", b"vary")
+        ]
+        headers.append((b"content-encoding", self.encoder.encoding.encode()))
+        headers.append((b"vary", _vary(self.start.get("headers", []))))
+        if content_length is not None:
+            headers.append((b"content-length", str(content_length).encode()))
+        return {**self.start, "headers": headers}
+
+
+def _vary(headers) -> bytes:
+    # Merge into the Vary header of the response: a second one would be folded anyway.
+    values = [value.decode("latin-1") for name, value in headers if name.lower() == b"vary"]
+    fields = [field.strip() for value in values for field in value.split(",") if field.strip()]
+    if not any(field == "*" or field.lower() == "accept-encoding" for field in fields):
+        fields.append("Accept-Encoding")
+    return ", ".join(fields).encode("latin-1")
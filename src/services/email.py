@@ -1,32 +1,73 @@
+import logging
+import math
+from functools import lru_cache
 from pathlib import Path
 
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
-from fastapi_mail.errors import ConnectionErrors
 from pydantic import EmailStr
 
 from src.services.auth import auth_service
 from src.conf.config import settings
+from src.services.resilience import DependencyUnavailable, smtp_calls
 
 
-conf = ConnectionConfig(
-    MAIL_USERNAME=settings.mail_username,
-    MAIL_PASSWORD=settings.mail_password,
-    MAIL_FROM=settings.mail_from,
-    MAIL_PORT=settings.mail_port,
-    MAIL_SERVER=settings.mail_server,
-    MAIL_FROM_NAME="Admin",
-    MAIL_STARTTLS=False,
-    MAIL_SSL_TLS=True,
-    USE_CREDENTIALS=True,
-    VALIDATE_CERTS=True,
-    TEMPLATE_FOLDER=Path(__file__).parent / 'templates',
-)
+logger = logging.getLogger(__name__)
+
+CONFIRMATION_TEMPLATE = "email_template.html"
+
+
+@lru_cache(maxsize=None)
+def mail_client():
+    """
+    SMTP client, built on first use: ``fastapi_mail`` takes longer to import than the rest of the app.
+
+    :return: Mail client.
+    :rtype: fastapi_mail.FastMail
+    """
+    from fastapi_mail import FastMail, ConnectionConfig
+
+    return FastMail(ConnectionConfig(
+        MAIL_USERNAME=settings.mail_username,
+        MAIL_PASSWORD=settings.mail_password,
+        MAIL_FROM=settings.mail_from,
+        MAIL_PORT=settings.mail_port,
+        MAIL_SERVER=settings.mail_server,
+        MAIL_FROM_NAME="Admin",
+        MAIL_STARTTLS=False,
+        MAIL_SSL_TLS=True,
+        USE_CREDENTIALS=True,
+        VALIDATE_CERTS=True,
+        TIMEOUT=math.ceil(settings.smtp_timeout_seconds),
+        TEMPLATE_FOLDER=Path(__file__).parent / 'templates',
+    ))
+
+
+@lru_cache(maxsize=None)
+def templates():
+    """
+    Template environment of the emails, kept for the process so every template is compiled once.
+
+    :return: Jinja environment.
+    :rtype: jinja2.Environment
+    """
+    return mail_client().config.template_engine()
+
+
+def warm_up():
+    """
+    Import the mail client and compile the email templates before the first email is sent.
+    """
+    environment = templates()
+    for name in environment.list_templates():
+        environment.get_template(name)
 
 
 async def send_email(email: EmailStr, login: str, host: str):
     """
     Send an email for email confirmation.
 
+    While the SMTP server is slow or failing the email is skipped, the user can ask for
+    another one with ``/api/auth/request_email``.
+
     :param email: The email address to which the confirmation email will be sent.
     :type email: EmailStr
     :param login: The login associated with the user for email confirmation.
@@ -36,16 +77,19 @@ async def send_email(email: EmailStr, login: str, host: str):
     :return: None
     :rtype: None
     """
+    from fastapi_mail import MessageSchema, MessageType
+
     try:
         token_verification = auth_service.create_email_token({"sub": email})
         message = MessageSchema(
             subject="Confirm your email ",
             recipients=[email],
-            template_body={"host": host, "login": login, "token": token_verification},
+            body=templates().get_template(CONFIRMATION_TEMPLATE).render(
+                host=host, login=login, token=token_verification
+            ),
             subtype=MessageType.html
         )
 
-        fm = FastMail(conf)
-        await fm.send_message(message, template_name="email_template.html")
-    except ConnectionErrors as err:
-        print(err)
\ No newline at end of file
+        await smtp_calls.call(mail_client().send_message, message)
+    except DependencyUnavailable as err:
+        logger.warning("Confirmation email to %s not sent: %s", email, err)
\ No newline at end of file
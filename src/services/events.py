@@ -0,0 +1,252 @@
+import asyncio
+import logging
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional, Tuple
+
+import orjson
+from redis.exceptions import RedisError
+
+from src.conf.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = "contacts:"
+RESYNC = b"event: resync\ndata: {}\n\n"
+# Seconds between attempts to reach Redis again.
+RECONNECT_DELAY = 1
+
+_deferred: ContextVar[Optional[List[Tuple[int, bytes]]]] = ContextVar("deferred_events", default=None)
+
+
+def format_event(event: str, data: dict, version: int = None) -> bytes:
+    """
+    Render a Server-Sent Event.
+
+    :param event: Event name.
+    :type event: str
+    :param data: Event payload.
+    :type data: dict
+    :param version: Change version, sent as the event id.
+    :type version: int, optional
+    :return: Encoded event.
+    :rtype: bytes
+    """
+    head = f"id: {version}\n" if version is not None else ""
+    return f"{head}event: {event}\n".encode() + b"data: " + orjson.dumps(data) + b"\n\n"
+
+
+class ContactEventBus:
+    """
+    Fans contact change events out to the connected clients of the same account.
+
+    Events are published to the account's Redis channel, which every worker subscribes to
+    while one of its clients listens to the account, so a change made through one worker
+    reaches clients connected to any other, and workers only receive the events of their own
+    clients. Without Redis, or while it is down, events are only delivered inside the current
+    process.
+
+    Attributes:
+        buffer_size (int): Maximum number of undelivered events per connection.
+        redis: Redis client, set by :meth:`start`.
+    """
+
+    def __init__(self, buffer_size: int):
+        self.buffer_size = buffer_size
+        self.redis = None
+        self._pubsub = None
+        self._listener = None
+        self._follower = None
+        self._subscribers = defaultdict(set)
+        self._accounts_changed: Optional[asyncio.Event] = None
+        self._listening: Optional[asyncio.Event] = None
+
+    async def start(self, redis):
+        """
+        Start listening for events published by all workers.
+
+        Channels are subscribed to in the background, again and again while Redis is down.
+
+        :param redis: Redis client.
+        :type redis: redis.asyncio.Redis
+        """
+        self.redis = redis
+        self._pubsub = redis.pubsub()
+        self._accounts_changed = asyncio.Event()
+        self._accounts_changed.set()
+        self._listening = asyncio.Event()
+        self._follower = asyncio.create_task(self._follow_subscribers())
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        """
+        Stop listening for events.
+        """
+        for task in (self._follower, self._listener):
+            if task is not None:
+                task.cancel()
+        self._follower = self._listener = None
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
+        self.redis = None
+
+    async def publish(self, account_id: int, message: bytes):
+        """
+        Publish an event to all clients of an account.
+
+        :param account_id: Account ID.
+        :type account_id: int
+        :param message: Event rendered with :func:`format_event`.
+        :type message: bytes
+        """
+        pending = _deferred.get()
+        if pending is not None:
+            pending.append((account_id, message))
+            return
+        if self.redis is not None:
+            try:
+                await self.redis.publish(f"{CHANNEL_PREFIX}{account_id}", message)
+                return
+            except RedisError as e:
+                logger.warning("Could not publish contact event for account %s: %s", account_id, e)
+        self._dispatch(account_id, message)
+
+    async def publish_many(self, account_id: int, messages: List[bytes]):
+        """
+        Publish several events of an account in one Redis round trip.
+
+        :param account_id: Account ID.
+        :type account_id: int
+        :param messages: Events rendered with :func:`format_event`, in order.
+        :type messages: list[bytes]
+        """
+        if not messages:
+            return
+        pending = _deferred.get()
+        if pending is not None:
+            pending.extend((account_id, message) for message in messages)
+            return
+        if self.redis is not None:
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for message in messages:
+                        pipe.publish(f"{CHANNEL_PREFIX}{account_id}", message)
+                    await pipe.execute()
+                return
+            except RedisError as e:
+                logger.warning("Could not publish contact events for account %s: %s", account_id, e)
+        for message in messages:
+            self._dispatch(account_id, message)
+
+    @contextmanager
+    def deferred(self):
+        """
+        Hold back the events published inside the block, for changes that may still be rolled back.
+
+        :return: Held events as ``(account_id, message)`` pairs, to pass to :meth:`flush` after commit.
+        :rtype: list[tuple[int, bytes]]
+        """
+        pending = []
+        token = _deferred.set(pending)
+        try:
+            yield pending
+        finally:
+            _deferred.reset(token)
+
+    async def flush(self, pending: List[Tuple[int, bytes]]):
+        """
+        Publish events held back by :meth:`deferred`.
+
+        :param pending: Held events.
+        :type pending: list[tuple[int, bytes]]
+        """
+        by_account = defaultdict(list)
+        for account_id, message in pending:
+            by_account[account_id].append(message)
+        for account_id, messages in by_account.items():
+            await self.publish_many(account_id, messages)
+
+    @contextmanager
+    def subscribe(self, account_id: int):
+        """
+        Register a connection for the events of an account.
+
+        :param account_id: Account ID.
+        :type account_id: int
+        :return: Queue receiving the rendered events.
+        :rtype: asyncio.Queue
+        """
+        queue = asyncio.Queue(maxsize=self.buffer_size)
+        if account_id not in self._subscribers:
+            self._notify_accounts_changed()
+        self._subscribers[account_id].add(queue)
+        try:
+            yield queue
+        finally:
+            self._subscribers[account_id].discard(queue)
+            if not self._subscribers[account_id]:
+                del self._subscribers[account_id]
+                self._notify_accounts_changed()
+
+    def _notify_accounts_changed(self):
+        if self._accounts_changed is not None:
+            self._accounts_changed.set()
+
+    def _dispatch(self, account_id: int, message: bytes):
+        for queue in self._subscribers.get(account_id, ()):
+            if queue.full():
+                # The client fell behind: drop its backlog and let it catch up from the changes feed.
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(RESYNC)
+            else:
+                queue.put_nowait(message)
+
+    async def _follow_subscribers(self):
+        # Subscribes to the channels of the accounts with local clients, and only to those.
+        while True:
+            await self._accounts_changed.wait()
+            self._accounts_changed.clear()
+            wanted = {f"{CHANNEL_PREFIX}{account_id}" for account_id in self._subscribers}
+            current = {
+                channel.decode() if isinstance(channel, bytes) else channel
+                for channel in set(self._pubsub.channels).difference(self._pubsub.pending_unsubscribe_channels)
+            }
+            try:
+                if wanted - current:
+                    await self._pubsub.subscribe(*(wanted - current))
+                    self._listening.set()
+                if current - wanted:
+                    await self._pubsub.unsubscribe(*(current - wanted))
+            except RedisError as e:
+                logger.warning("Could not subscribe to contact events: %s", e)
+                await asyncio.sleep(RECONNECT_DELAY)
+                self._accounts_changed.set()
+
+    async def _listen(self):
+        while True:
+            try:
+                if not self._pubsub.subscribed:
+                    self._listening.clear()
+                    await self._listening.wait()
+                async for message in self._pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    channel = message["channel"]
+                    if isinstance(channel, bytes):
+                        channel = channel.decode()
+                    data = message["data"]
+                    if isinstance(data, str):
+                        data = data.encode()
+                    self._dispatch(int(channel[len(CHANNEL_PREFIX):]), data)
+            except asyncio.CancelledError:
+                raise
+            except RedisError as e:
+                logger.warning("Contact events listener lost Redis connection: %s", e)
+                await asyncio.sleep(RECONNECT_DELAY)
+
+
+contact_events = ContactEventBus(settings.events_buffer_size)
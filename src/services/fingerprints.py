@@ -0,0 +1,43 @@
+import re
+import unicodedata
+from typing import Optional
+
+
+_NOT_WORD = re.compile(r"[\W_]+")
+
+
+def email_key(email: Optional[str]) -> Optional[str]:
+    """
+    Blocking key of an email address: case folded, without a ``+tag`` in the local part.
+
+    :param email: Email address as entered.
+    :type email: str, optional
+    :return: Normalized address, or None if empty.
+    :rtype: str or None
+    """
+    if not email or not email.strip():
+        return None
+    local, at, domain = email.strip().casefold().rpartition("@")
+    if not at:
+        return domain
+    return f"{local.split('+', 1)[0]}@{domain}"[:100]
+
+
+def name_key(name: Optional[str]) -> Optional[str]:
+    """
+    Blocking key of a name: case folded words without accents or punctuation, in sorted order.
+
+    ``"José-Luis"`` and ``"luis jose"`` share the key ``"jose luis"``.
+
+    :param name: Name as entered.
+    :type name: str, optional
+    :return: Fingerprint, or None if the name has no letters or digits.
+    :rtype: str or None
+    """
+    if not name:
+        return None
+    text = "".join(
+        char for char in unicodedata.normalize("NFKD", name) if not unicodedata.combining(char)
+    ).casefold()
+    words = sorted(word for word in _NOT_WORD.split(text) if word)
+    return " ".join(words)[:50] or None
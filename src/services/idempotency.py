@@ -0,0 +1,277 @@
+import asyncio
+import base64
+import hashlib
+import logging
+import time
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+import orjson
+from redis.exceptions import RedisError
+
+from src.conf.config import settings
+from src.services.auth import auth_service
+
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "idempotency:"
+PENDING = "pending"
+MAX_KEY_LENGTH = 255
+# Client errors a retry of the same request may not get again.
+TRANSIENT_STATUSES = frozenset({408, 409, 425, 429})
+
+
+class StoredResponse(NamedTuple):
+    """
+    First response to a request with an ``Idempotency-Key``, replayed for its retries.
+    """
+    fingerprint: str
+    status: int
+    headers: List[Tuple[str, str]]
+    body: bytes
+
+    def dumps(self) -> str:
+        return orjson.dumps({
+            "fingerprint": self.fingerprint,
+            "status": self.status,
+            "headers": self.headers,
+            "body": base64.b64encode(self.body).decode(),
+        }).decode()
+
+    @classmethod
+    def loads(cls, value) -> "StoredResponse":
+        data = orjson.loads(value)
+        return cls(
+            data["fingerprint"], data["status"], [tuple(header) for header in data["headers"]],
+            base64.b64decode(data["body"]),
+        )
+
+
+class IdempotencyInProgress(Exception):
+    """
+    Raised when the first request with a key is still running after the wait timeout.
+    """
+
+
+class IdempotencyStore:
+    """
+    Keeps the responses of idempotent requests in Redis, or in process memory without Redis.
+
+    A key is first reserved with a short lock, so concurrent duplicates wait for the first
+    request instead of running it again, then replaced with the response for ``ttl`` seconds.
+
+    :param ttl: How long responses are replayed, in seconds.
+    :type ttl: int
+    :param lock_ttl: How long a reservation survives a crashed worker, in seconds.
+    :type lock_ttl: int
+    :param wait: How long a duplicate waits for the first request, in seconds.
+    :type wait: float
+    """
+
+    def __init__(self, ttl: int, lock_ttl: int, wait: float, poll_interval: float = 0.05):
+        self.ttl = ttl
+        self.lock_ttl = lock_ttl
+        self.wait = wait
+        self.poll_interval = poll_interval
+        self.redis = None
+        self._local = {}
+
+    def start(self, redis):
+        """
+        Keep responses in Redis, shared by all workers.
+
+        :param redis: Redis client.
+        :type redis: redis.asyncio.Redis
+        """
+        self.redis = redis
+
+    async def begin(self, key: str) -> Optional[StoredResponse]:
+        """
+        Reserve a key, or wait for the response of the request holding it.
+
+        :param key: Store key.
+        :type key: str
+        :return: None if the caller holds the key and must run the request, else the stored response.
+        :rtype: StoredResponse or None
+        :raises IdempotencyInProgress: If the first request does not finish in time.
+        """
+        deadline = time.monotonic() + self.wait
+        while True:
+            if await self._reserve(key):
+                return None
+            value = await self._get(key)
+            if value is not None and value != PENDING:
+                return StoredResponse.loads(value)
+            if time.monotonic() >= deadline:
+                raise IdempotencyInProgress(key)
+            await asyncio.sleep(self.poll_interval)
+
+    async def save(self, key: str, response: StoredResponse):
+        """
+        Store the response of a reserved key.
+
+        :param key: Store key.
+        :type key: str
+        :param response: Response to replay.
+        :type response: StoredResponse
+        """
+        value = response.dumps()
+        if self.redis is not None:
+            try:
+                await self.redis.set(key, value, ex=self.ttl)
+                return
+            except RedisError as e:
+                logger.warning("Could not store idempotent response: %s", e)
+        now = time.monotonic()
+        for expired in [name for name, (expires, _) in self._local.items() if expires <= now]:
+            del self._local[expired]
+        self._local[key] = (now + self.ttl, value)
+
+    async def release(self, key: str):
+        """
+        Drop a reservation without a response, so that a retry runs the request again.
+
+        :param key: Store key.
+        :type key: str
+        """
+        if self.redis is not None:
+            try:
+                await self.redis.delete(key)
+                return
+            except RedisError as e:
+                logger.warning("Could not release idempotency key: %s", e)
+        self._local.pop(key, None)
+
+    async def _reserve(self, key: str) -> bool:
+        if self.redis is not None:
+            try:
+                return bool(await self.redis.set(key, PENDING, nx=True, ex=self.lock_ttl))
+            except RedisError as e:
+                logger.warning("Could not reserve idempotency key: %s", e)
+        now = time.monotonic()
+        entry = self._local.get(key)
+        if entry is not None and entry[0] > now:
+            return False
+        self._local[key] = (now + self.lock_ttl, PENDING)
+        return True
+
+    async def _get(self, key: str):
+        if self.redis is not None:
+            try:
+                return await self.redis.get(key)
+            except RedisError as e:
+                logger.warning("Could not read idempotency key: %s", e)
+        entry = self._local.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+        return entry[1]
+
+
+class IdempotencyMiddleware:
+    """
+    Replays the first response of requests retried with the same ``Idempotency-Key`` header.
+
+    Keys are scoped by method, path and authenticated account, so a retry sent with a
+    refreshed access token still replays the first response. Reusing a key with another
+    request body answers ``422``. Only successes and client errors a retry would get again are
+    stored: server errors, rate limits, timeouts and conflicts can be retried.
+    Operations of a batch request are not deduplicated, an atomic batch may still roll them back.
+
+    :param app: ASGI application.
+    :param store: Response store.
+    :type store: IdempotencyStore
+    :param routes: ``(method, path)`` pairs accepting the header.
+    :type routes: Iterable[tuple[str, str]]
+    """
+
+    def __init__(self, app, store: IdempotencyStore, routes: Iterable[Tuple[str, str]]):
+        self.app = app
+        self.store = store
+        self.routes = frozenset(routes)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or "batch" in scope or (scope["method"], scope["path"]) not in self.routes:
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        idempotency_key = headers.get(b"idempotency-key")
+        if idempotency_key is None:
+            return await self.app(scope, receive, send)
+        if not idempotency_key or len(idempotency_key) > MAX_KEY_LENGTH:
+            return await _send_error(send, 400, "Invalid Idempotency-Key header")
+
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body", False):
+                break
+        fingerprint = hashlib.sha256(body).hexdigest()
+        subject = auth_service.access_token_subject(headers.get(b"authorization", b"")) or ""
+        key = KEY_PREFIX + hashlib.sha256(
+            b"\n".join((scope["method"].encode(), scope["path"].encode(), subject.encode(), idempotency_key))
+        ).hexdigest()
+
+        try:
+            stored = await self.store.begin(key)
+        except IdempotencyInProgress:
+            return await _send_error(send, 409, "A request with this Idempotency-Key is in progress")
+        if stored is not None:
+            if stored.fingerprint != fingerprint:
+                return await _send_error(send, 422, "Idempotency-Key was used with another request body")
+            response_headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in stored.headers]
+            response_headers.append((b"idempotent-replayed", b"true"))
+            await send({"type": "http.response.start", "status": stored.status, "headers": response_headers})
+            return await send({"type": "http.response.body", "body": stored.body})
+
+        replayed = False
+
+        async def replay_body():
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        start = {}
+        chunks = []
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                start.update(message)
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, replay_body, capture)
+        except BaseException:
+            await self.store.release(key)
+            raise
+        if start and _replayable(start["status"]):
+            await self.store.save(key, StoredResponse(
+                fingerprint,
+                start["status"],
+                [(name.decode("latin-1"), value.decode("latin-1")) for name, value in start.get("headers", [])],
+                b"".join(chunks),
+            ))
+        else:
+            await self.store.release(key)
+
+
+def _replayable(status: int) -> bool:
+    return 200 <= status < 300 or (400 <= status < 500 and status not in TRANSIENT_STATUSES)
+
+
+async def _send_error(send, status: int, detail: str):
+    body = orjson.dumps({"detail": detail})
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+idempotency_store = IdempotencyStore(
+    settings.idempotency_ttl_seconds, settings.idempotency_lock_seconds, settings.idempotency_wait_seconds
+)
@@ -0,0 +1,204 @@
+import asyncio
+from typing import Iterable, Optional, Tuple
+
+import orjson
+
+from src.conf.config import settings
+from src.services.metrics import metrics
+
+
+CRITICAL = "critical"
+NORMAL = "normal"
+LOW = "low"
+
+metrics.describe("event_loop_lag_seconds", "Smoothed delay of the event loop in running a ready callback")
+metrics.describe("requests_in_flight", "Requests admitted and not yet answered")
+metrics.describe("shed_requests_total", "Requests answered 503 because the worker was overloaded")
+
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop runs a timer, the time a ready request waits for the loop.
+
+    A task sleeps ``interval`` seconds in a loop and records how much later than asked it wakes
+    up. The lag follows spikes immediately and decays smoothly, so one fast sample after a
+    burst does not readmit the whole backlog at once.
+
+    :param interval: Seconds between samples.
+    :type interval: float
+    :param smoothing: Weight of a new sample below the current lag, between 0 and 1.
+    :type smoothing: float
+    """
+
+    def __init__(self, interval: float = 0.1, smoothing: float = 0.3):
+        self.interval = interval
+        self.smoothing = smoothing
+        self.lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """
+        Start sampling on the running loop.
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop sampling.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def record(self, sample: float):
+        """
+        Add a lag sample.
+
+        :param sample: Seconds the loop was late.
+        :type sample: float
+        """
+        if sample >= self.lag:
+            self.lag = sample
+        else:
+            self.lag += (sample - self.lag) * self.smoothing
+        metrics.set("event_loop_lag_seconds", self.lag)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.record(max(0.0, loop.time() - started - self.interval))
+
+
+class LoadSheddingMiddleware:
+    """
+    Answers ``503`` with ``Retry-After`` to part of the traffic while the worker is overloaded.
+
+    The worker is overloaded when the event loop lag or the number of requests in flight
+    (admitted and not yet answered) is above its threshold. Low priority requests are shed
+    first; the others only past ``hard_factor`` times the thresholds, and critical ones, like
+    token refreshes, never. Rejecting early keeps the requests that are admitted fast instead of
+    queueing everyone until they time out.
+
+    :param app: ASGI application.
+    :param monitor: Event loop lag monitor.
+    :type monitor: LoopLagMonitor
+    :param max_lag: Lag above which low priority requests are shed, in seconds.
+    :type max_lag: float
+    :param max_in_flight: Requests in flight above which low priority requests are shed.
+    :type max_in_flight: int
+    :param low_priority: ``(method, path)`` pairs shed first, e.g. lists and exports.
+    :type low_priority: Iterable[tuple[str, str]]
+    :param critical: Paths never shed.
+    :type critical: Iterable[str]
+    :param hard_factor: Multiple of the thresholds above which normal requests are shed too.
+    :type hard_factor: float
+    :param retry_after: ``Retry-After`` value, in seconds.
+    :type retry_after: int
+    """
+
+    def __init__(
+        self, app, monitor: LoopLagMonitor, max_lag: float, max_in_flight: int,
+        low_priority: Iterable[Tuple[str, str]] = (), critical: Iterable[str] = (), hard_factor: float = 2.0,
+        retry_after: int = 5,
+    ):
+        self.app = app
+        self.monitor = monitor
+        self.max_lag = max_lag
+        self.max_in_flight = max_in_flight
+        self.low_priority = frozenset(low_priority)
+        self.critical = frozenset(critical)
+        self.hard_factor = hard_factor
+        self.retry_after = retry_after
+        self.in_flight = 0
+
+    def priority(self, method: str, path: str) -> str:
+        """
+        Priority of a request.
+
+        :param method: HTTP method.
+        :type method: str
+        :param path: URL path.
+        :type path: str
+        :return: ``critical``, ``normal`` or ``low``.
+        :rtype: str
+        """
+        if path in self.critical:
+            return CRITICAL
+        if (method, path) in self.low_priority:
+            return LOW
+        return NORMAL
+
+    def load(self) -> float:
+        """
+        Current load relative to the thresholds, above 1 when overloaded.
+
+        :rtype: float
+        """
+        return max(self.monitor.lag / self.max_lag, self.in_flight / self.max_in_flight)
+
+    def should_shed(self, priority: str) -> bool:
+        """
+        Whether a request of this priority is rejected at the current load.
+
+        :param priority: Request priority.
+        :type priority: str
+        :rtype: bool
+        """
+        if priority == CRITICAL:
+            return False
+        return self.load() > (1.0 if priority == LOW else self.hard_factor)
+
+    async def __call__(self, scope, receive, send):
+        # Operations of a batch were admitted with the batch.
+        if scope["type"] != "http" or "batch" in scope:
+            return await self.app(scope, receive, send)
+        priority = self.priority(scope["method"], scope["path"])
+        if self.should_shed(priority):
+            metrics.inc("shed_requests_total", priority=priority)
+            return await _send_overloaded(send, self.retry_after)
+
+        answered = False
+
+        async def send_answer(message):
+            nonlocal answered
+            if message["type"] == "http.response.start" and not answered:
+                # Streamed bodies, like server-sent events, do not keep the worker busy.
+                answered = True
+                self._leave()
+            await send(message)
+
+        self.in_flight += 1
+        metrics.set("requests_in_flight", self.in_flight)
+        try:
+            await self.app(scope, receive, send_answer)
+        finally:
+            if not answered:
+                self._leave()
+
+    def _leave(self):
+        self.in_flight -= 1
+        metrics.set("requests_in_flight", self.in_flight)
+
+
+loop_monitor = LoopLagMonitor(settings.loop_lag_interval)
+
+
+async def _send_overloaded(send, retry_after: int):
+    body = orjson.dumps({"detail": "Server is overloaded, retry shortly"})
+    await send({
+        "type": "http.response.start",
+        "status": 503,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(retry_after).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
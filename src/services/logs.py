@@ -0,0 +1,240 @@
+"""
+Structured logging that never blocks the event loop.
+
+Logging calls only render the message and put the record on an in-memory queue; a
+background thread formats it, as one JSON object per line, and writes it to stdout. A slow
+terminal or log collector therefore delays the log lines, never the requests. When the queue
+is full, records are dropped and counted rather than waited on.
+
+Every record carries the id of the request that emitted it, read from the ``X-Request-ID``
+header or generated by :class:`RequestIdMiddleware`, so the lines of one request, including
+those of its worker threads and of uvicorn's access log, can be found together. Debug lines
+are sampled per request: a sampled request logs all of them, the others none.
+"""
+import copy
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+import uuid
+import zlib
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Optional, TextIO
+
+import orjson
+
+from src.conf.config import settings
+from src.services.metrics import metrics
+
+
+REQUEST_ID_HEADER = b"x-request-id"
+UVICORN_LOGGERS = ("uvicorn", "uvicorn.error", "uvicorn.access")
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"
+
+request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+_VALID_REQUEST_ID = re.compile(r"[A-Za-z0-9._:-]{1,128}")
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "request_id"}
+
+metrics.describe("log_records_dropped_total", "Log records dropped because the log queue was full")
+
+
+class RequestIdFilter(logging.Filter):
+    """
+    Adds the id of the current request to records, ``None`` outside of requests.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        return True
+
+
+class DebugSampler(logging.Filter):
+    """
+    Keeps the debug records of a ``rate`` share of the requests and passes every other level.
+
+    The decision hashes the request id, so a request keeps all its debug lines or none of
+    them. Records emitted outside of requests are sampled one by one.
+
+    :param rate: Share of the requests whose debug records are kept, between 0 and 1.
+    :type rate: float
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate >= 1:
+            return True
+        current = getattr(record, "request_id", None)
+        if current is None:
+            return random.random() < self.rate
+        return zlib.crc32(current.encode()) < self.rate * 2 ** 32
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as a JSON object on one line.
+
+    Besides time, level, logger, message and request id, the object holds the fields passed
+    with ``extra=`` and the traceback of the logged exception, if any.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "request_id", None) is not None:
+            entry["request_id"] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return orjson.dumps(entry, default=str).decode()
+
+
+class RecordQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records on a bounded queue without waiting, dropping them when it is full.
+
+    The message is rendered right away, since its arguments may change before the listener
+    thread gets to it; the expensive part, formatting and writing, is left to that thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc("log_records_dropped_total")
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # Only called on shutdown: wait for room in the queue rather than lose the stop signal.
+        self.queue.put(self._sentinel)
+
+
+class LogPipeline:
+    """
+    Routes the records of the root logger and of uvicorn through a queue to a writer thread.
+
+    :param level: Level of the root logger, e.g. ``INFO``.
+    :type level: str
+    :param json: Whether to write JSON lines rather than plain text.
+    :type json: bool
+    :param debug_sample_rate: Share of the requests whose debug records are written.
+    :type debug_sample_rate: float
+    :param queue_size: Records waiting for the writer thread beyond which new ones are dropped.
+    :type queue_size: int
+    :param stream: Output stream, stdout by default.
+    :type stream: TextIO
+    """
+
+    def __init__(
+        self, level: str, json: bool = True, debug_sample_rate: float = 1.0, queue_size: int = 10000,
+        stream: Optional[TextIO] = None,
+    ):
+        self.level = level.upper()
+        self.json = json
+        self.debug_sample_rate = debug_sample_rate
+        self.queue_size = queue_size
+        self.stream = stream
+        self.handler: Optional[RecordQueueHandler] = None
+        self._listener: Optional[_QueueListener] = None
+        self._uvicorn = {}
+
+    def start(self):
+        """
+        Install the queue handler and start the writer thread.
+        """
+        if self._listener is not None:
+            return
+        output = logging.StreamHandler(self.stream or sys.stdout)
+        output.setFormatter(JsonFormatter() if self.json else logging.Formatter(TEXT_FORMAT))
+        records = queue.Queue(self.queue_size)
+        self.handler = RecordQueueHandler(records)
+        # Filters run in the logging thread, where the request id is set; sampling needs it.
+        self.handler.addFilter(RequestIdFilter())
+        self.handler.addFilter(DebugSampler(self.debug_sample_rate))
+        self._listener = _QueueListener(records, output)
+        self._listener.start()
+
+        root = logging.getLogger()
+        root.addHandler(self.handler)
+        root.setLevel(self.level)
+        # uvicorn writes to its own blocking handlers; send its records through the queue too.
+        for name in UVICORN_LOGGERS:
+            logger = logging.getLogger(name)
+            self._uvicorn[name] = (logger.handlers, logger.propagate)
+            logger.handlers = []
+            logger.propagate = True
+
+    def stop(self):
+        """
+        Restore the previous handlers and write the queued records before returning.
+        """
+        if self._listener is None:
+            return
+        for name, (handlers, propagate) in self._uvicorn.items():
+            logger = logging.getLogger(name)
+            logger.handlers = handlers
+            logger.propagate = propagate
+        self._uvicorn = {}
+        logging.getLogger().removeHandler(self.handler)
+        self._listener.stop()
+        self._listener = None
+        self.handler = None
+
+
+class RequestIdMiddleware:
+    """
+    Sets the request id of every HTTP request and returns it in the ``X-Request-ID`` header.
+
+    The id sent by the client or a proxy is kept when it is a short token, so one id follows
+    the request across services; otherwise a new one is generated.
+
+    :param app: ASGI application.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        # Operations of a batch keep the id of the batch request.
+        if scope["type"] != "http" or "batch" in scope:
+            return await self.app(scope, receive, send)
+        current = dict(scope["headers"]).get(REQUEST_ID_HEADER, b"").decode("latin-1")
+        if not _VALID_REQUEST_ID.fullmatch(current):
+            current = uuid.uuid4().hex
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), (REQUEST_ID_HEADER, current.encode())]
+            await send(message)
+
+        token = request_id.set(current)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id.reset(token)
+
+
+log_pipeline = LogPipeline(
+    settings.log_level, settings.log_json, settings.log_debug_sample_rate, settings.log_queue_size
+)
@@ -0,0 +1,85 @@
+from collections import defaultdict
+from typing import Dict, Tuple
+
+
+class Metrics:
+    """
+    In-process counters and gauges, rendered in the Prometheus text format by ``GET /metrics``.
+
+    Every worker keeps its own values; the scraper sums them per instance.
+    """
+
+    def __init__(self):
+        self._counters: Dict[str, Dict[Tuple[Tuple[str, str], ...], float]] = defaultdict(lambda: defaultdict(float))
+        self._gauges: Dict[str, Dict[Tuple[Tuple[str, str], ...], float]] = defaultdict(dict)
+        self._help: Dict[str, str] = {}
+
+    def describe(self, name: str, help_text: str):
+        """
+        Set the help line of a metric.
+
+        :param name: Metric name.
+        :type name: str
+        :param help_text: Description.
+        :type help_text: str
+        """
+        self._help[name] = help_text
+
+    def inc(self, name: str, value: float = 1, **labels: str):
+        """
+        Increase a counter.
+
+        :param name: Metric name.
+        :type name: str
+        :param value: Increment.
+        :type value: float
+        :param labels: Label values.
+        """
+        self._counters[name][tuple(sorted(labels.items()))] += value
+
+    def set(self, name: str, value: float, **labels: str):
+        """
+        Set a gauge.
+
+        :param name: Metric name.
+        :type name: str
+        :param value: Current value.
+        :type value: float
+        :param labels: Label values.
+        """
+        self._gauges[name][tuple(sorted(labels.items()))] = value
+
+    def value(self, name: str, **labels: str) -> float:
+        """
+        Current value of a counter or gauge.
+
+        :param name: Metric name.
+        :type name: str
+        :param labels: Label values.
+        :return: Metric value, 0 if never set.
+        :rtype: float
+        """
+        series = self._gauges[name] if name in self._gauges else self._counters.get(name, {})
+        return series.get(tuple(sorted(labels.items())), 0.0)
+
+    def render(self) -> str:
+        """
+        Render all metrics.
+
+        :return: Prometheus text exposition.
+        :rtype: str
+        """
+        lines = []
+        metrics = [(name, "counter", series) for name, series in self._counters.items()]
+        metrics += [(name, "gauge", series) for name, series in self._gauges.items()]
+        for name, kind, series in sorted(metrics, key=lambda metric: metric[0]):
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(series.items()):
+                label_text = ",".join(f'{key}="{val}"' for key, val in labels)
+                lines.append(f"{name}{{{label_text}}} {value:g}" if label_text else f"{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
@@ -0,0 +1,95 @@
+import re
+from typing import NamedTuple, Optional
+
+from src.conf.config import settings
+
+
+SUFFIX_DIGITS = 9
+MIN_E164_DIGITS = 8
+MAX_E164_DIGITS = 15
+
+_EXTENSION = re.compile(r"(?i)\s*(?:;ext=|ext\.?|x|#).*$")
+_NON_DIGITS = re.compile(r"\D")
+
+
+class PhoneKeys(NamedTuple):
+    """
+    Lookup keys of a phone number.
+
+    ``e164`` is None when the number can not be normalized, e.g. a national number without a
+    configured default country code. ``suffix`` holds the last ``SUFFIX_DIGITS`` digits and
+    matches the number whether or not it was written with its country code.
+    """
+    e164: Optional[str]
+    suffix: Optional[str]
+
+
+def to_e164(raw: Optional[str], country_code: str = None) -> Optional[str]:
+    """
+    Normalize a free-form phone number to E.164, e.g. ``067 123-45-67`` to ``+380671234567``.
+
+    Numbers written with ``+`` or ``00`` keep their country code. National numbers get the
+    default country code, without their ``0`` trunk prefix.
+
+    :param raw: Phone number as entered.
+    :type raw: str, optional
+    :param country_code: Default country calling code, ``settings.phone_country_code`` if omitted.
+    :type country_code: str, optional
+    :return: E.164 number, or None if it can not be normalized.
+    :rtype: str or None
+    """
+    if not raw:
+        return None
+    country_code = settings.phone_country_code if country_code is None else country_code
+    number = _EXTENSION.sub("", raw.strip())
+    digits = _NON_DIGITS.sub("", number)
+    if number.startswith("+"):
+        pass
+    elif digits.startswith("00"):
+        digits = digits[2:]
+    elif not country_code:
+        return None
+    elif digits.startswith("0"):
+        digits = country_code + digits[1:]
+    elif not (digits.startswith(country_code) and len(digits) >= len(country_code) + SUFFIX_DIGITS):
+        # Digits already starting with the country code are an international number without "+".
+        digits = country_code + digits
+    if not MIN_E164_DIGITS <= len(digits) <= MAX_E164_DIGITS or digits.startswith("0"):
+        return None
+    return "+" + digits
+
+
+def phone_suffix(raw: Optional[str]) -> Optional[str]:
+    """
+    Last ``SUFFIX_DIGITS`` digits of a phone number, shared by its national and international forms.
+
+    :param raw: Phone number as entered.
+    :type raw: str, optional
+    :return: Digits, or None if the number has none.
+    :rtype: str or None
+    """
+    digits = _NON_DIGITS.sub("", _EXTENSION.sub("", raw.strip())) if raw else ""
+    return digits[-SUFFIX_DIGITS:] or None
+
+
+def phone_keys(raw: Optional[str]) -> PhoneKeys:
+    """
+    Lookup keys stored next to a phone number.
+
+    :param raw: Phone number as entered.
+    :type raw: str, optional
+    :rtype: PhoneKeys
+    """
+    return PhoneKeys(to_e164(raw), phone_suffix(raw))
+
+
+def has_country_code(raw: str) -> bool:
+    """
+    Whether a number was written in international form.
+
+    :param raw: Phone number as entered.
+    :type raw: str
+    :rtype: bool
+    """
+    raw = raw.strip()
+    return raw.startswith("+") or _NON_DIGITS.sub("", raw).startswith("00")
@@ -0,0 +1,186 @@
+import hashlib
+import hmac
+import logging
+import time
+from collections import deque
+from pathlib import Path
+from urllib.parse import parse_qs
+
+from src.conf.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_QUERY = "profile"
+EVENT_STREAM = b"text/event-stream"
+
+
+def sign_profile_request(method: str, path: str, expires: int) -> str:
+    """
+    Create the token that allows profiling of one route until ``expires``.
+
+    :param method: HTTP method of the profiled request.
+    :type method: str
+    :param path: URL path of the profiled request.
+    :type path: str
+    :param expires: Unix timestamp after which the token is rejected.
+    :type expires: int
+    :return: Token for the ``X-Profile`` header or the ``profile`` query parameter.
+    :rtype: str
+    """
+    message = f"{method.upper()} {path} {expires}".encode()
+    signature = hmac.new(settings.secret_key.encode(), message, hashlib.sha256).hexdigest()
+    return f"{expires}:{signature}"
+
+
+def verify_profile_token(token: str, method: str, path: str) -> bool:
+    """
+    Check a profiling token created by :func:`sign_profile_request`.
+
+    :param token: Token from the request.
+    :type token: str
+    :param method: HTTP method of the request.
+    :type method: str
+    :param path: URL path of the request.
+    :type path: str
+    :return: True if the token is valid and not expired.
+    :rtype: bool
+    """
+    expires, _, _ = token.partition(":")
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(token, sign_profile_request(method, path, int(expires)))
+
+
+class ProfileRateLimiter:
+    """
+    Sliding window limit on the number of profiled requests.
+
+    Attributes:
+        max_profiles (int): Profiles allowed per window.
+        window (float): Window length in seconds.
+    """
+
+    def __init__(self, max_profiles: int, window: float = 60.0):
+        self.max_profiles = max_profiles
+        self.window = window
+        self._started = deque()
+
+    def acquire(self) -> bool:
+        """
+        Reserve a slot for one profile.
+
+        :return: True if the request may be profiled.
+        :rtype: bool
+        """
+        now = time.monotonic()
+        while self._started and now - self._started[0] > self.window:
+            self._started.popleft()
+        if len(self._started) >= self.max_profiles:
+            return False
+        self._started.append(now)
+        return True
+
+
+class ProfilerMiddleware:
+    """
+    Samples a request with pyinstrument when it carries a valid signed ``X-Profile`` header
+    or ``profile`` query parameter.
+
+    Untriggered requests are passed straight to the application. The profile is returned
+    instead of the response, or written to ``settings.profiler_output_dir`` when it is set;
+    the response is then streamed through unchanged, with the file name in ``X-Profile-File``.
+    Event streams are never profiled: they have no end to wait for.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.limiter = ProfileRateLimiter(settings.profiler_max_per_minute)
+        self.running = False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        token = self._token(scope)
+        if token is None or EVENT_STREAM in dict(scope["headers"]).get(b"accept", b""):
+            return await self.app(scope, receive, send)
+        if not verify_profile_token(token, scope["method"], scope["path"]):
+            logger.warning("Rejected profiling token for %s %s", scope["method"], scope["path"])
+            return await self.app(scope, receive, send)
+        if self.running or not self.limiter.acquire():
+            logger.info("Profiling of %s %s skipped by rate limit", scope["method"], scope["path"])
+            return await self.app(scope, receive, send)
+        try:
+            from pyinstrument import Profiler
+            from pyinstrument.renderers import SpeedscopeRenderer
+        except ImportError:
+            logger.warning("pyinstrument is not installed, profiling is unavailable")
+            return await self.app(scope, receive, send)
+
+        self.running = True
+        profiler = Profiler(interval=settings.profiler_interval, async_mode="enabled")
+        path = self._path(scope) if settings.profiler_output_dir is not None else None
+        streaming = False
+
+        async def forward(message):
+            nonlocal streaming
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                if EVENT_STREAM in dict(headers).get(b"content-type", b""):
+                    streaming = True
+                    profiler.stop()
+                elif path is not None:
+                    message["headers"] = headers + [(b"x-profile-file", path.name.encode())]
+            # The response is dropped when the profile replaces it.
+            if streaming or path is not None:
+                await send(message)
+
+        try:
+            profiler.start()
+            try:
+                await self.app(scope, receive, forward)
+            finally:
+                if profiler.is_running:
+                    profiler.stop()
+            if streaming:
+                return
+            profile = profiler.output(SpeedscopeRenderer()).encode()
+        finally:
+            self.running = False
+
+        if path is None:
+            return await self._send_profile(profile, send)
+        path.write_bytes(profile)
+        logger.info("Stored profile of %s %s in %s", scope["method"], scope["path"], path)
+
+    @staticmethod
+    def _token(scope):
+        for name, value in scope["headers"]:
+            if name == PROFILE_HEADER:
+                return value.decode("latin-1")
+        if b"profile=" in scope["query_string"]:
+            values = parse_qs(scope["query_string"].decode("latin-1")).get(PROFILE_QUERY)
+            if values:
+                return values[0]
+        return None
+
+    @staticmethod
+    def _path(scope) -> Path:
+        directory = Path(settings.profiler_output_dir)
+        directory.mkdir(parents=True, exist_ok=True)
+        route = scope["path"].strip("/").replace("/", "_") or "root"
+        return directory / f"{time.strftime('%Y%m%d-%H%M%S')}-{scope['method']}-{route}.speedscope.json"
+
+    @staticmethod
+    async def _send_profile(profile: bytes, send):
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(profile)).encode()),
+                (b"content-disposition", b'attachment; filename="profile.speedscope.json"'),
+            ],
+        })
+        await send({"type": "http.response.body", "body": profile})
@@ -0,0 +1,203 @@
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from fastapi import Request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from src.conf.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def route_label(scope: Optional[dict]) -> str:
+    """
+    Label of a request in logs and metrics.
+
+    :param scope: ASGI scope of the request.
+    :type scope: dict, optional
+    :return: Method and route path template, or "-" outside of a request.
+    :rtype: str
+    """
+    if scope is None:
+        return "-"
+    route = scope.get("route")
+    path = getattr(route, "path", None) or scope.get("path", "")
+    return f"{scope.get('method', '')} {path}"
+
+
+class QueryStats:
+    """
+    Collects the SQL statements executed while handling one request.
+
+    Attributes:
+        scope (dict): ASGI scope of the request, used to label slow queries with their route.
+        count (int): Number of executed statements.
+        duration (float): Total time spent in the database, in seconds.
+        statements (Counter): Number of executions per SQL statement.
+    """
+    __slots__ = ("scope", "count", "duration", "statements")
+
+    def __init__(self, scope: Optional[dict] = None):
+        self.scope = scope
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    @property
+    def route(self) -> str:
+        """
+        Route label of the traced request.
+
+        :return: Method and route path template, or "-" outside of a request.
+        :rtype: str
+        """
+        return route_label(self.scope)
+
+    def add(self, statement: str, elapsed: float):
+        """
+        Record one executed statement.
+
+        :param statement: SQL statement.
+        :type statement: str
+        :param elapsed: Execution time in seconds.
+        :type elapsed: float
+        """
+        self.count += 1
+        self.duration += elapsed
+        self.statements[statement] += 1
+
+    def repeated(self, threshold: int):
+        """
+        Statements executed at least ``threshold`` times, the usual sign of an N+1 pattern.
+
+        :param threshold: Minimal number of executions.
+        :type threshold: int
+        :return: List of (statement, executions) pairs.
+        :rtype: list[tuple[str, int]]
+        """
+        return [(sql, n) for sql, n in self.statements.most_common() if n >= threshold]
+
+    def server_timing(self) -> str:
+        """
+        Render the stats as a ``Server-Timing`` header value.
+
+        :return: Header value.
+        :rtype: str
+        """
+        return f'db;dur={self.duration * 1000:.2f};desc="{self.count} queries"'
+
+
+_current_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _record(conn, statement)
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(exception_context):
+    # A failed statement gets no after_cursor_execute: drop its start time, or the pooled
+    # connection would time its next statements against it.
+    conn = exception_context.connection
+    if conn is not None and exception_context.execution_context is not None and conn.info.get("query_start_time"):
+        _record(conn, exception_context.statement)
+
+
+def _record(conn, statement: str):
+    elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.add(statement, elapsed)
+    if elapsed * 1000 >= settings.slow_query_ms:
+        route = stats.route if stats is not None else "-"
+        logger.warning("Slow query (%.1f ms) on %s: %s", elapsed * 1000, route, statement)
+
+
+@contextmanager
+def trace_queries(scope: Optional[dict] = None):
+    """
+    Collect the statements executed inside the block.
+
+    :param scope: ASGI scope of the traced request.
+    :type scope: dict, optional
+    :return: Stats filled while the block runs.
+    :rtype: QueryStats
+    """
+    stats = QueryStats(scope)
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+
+
+async def query_tracing_middleware(request: Request, call_next):
+    """
+    Count and time the statements of every request and report them in the ``Server-Timing`` header.
+
+    :param request: Incoming request.
+    :type request: Request
+    :param call_next: Next ASGI handler.
+    :return: Response with the ``Server-Timing`` header.
+    :rtype: Response
+    """
+    with trace_queries(request.scope) as stats:
+        response = await call_next(request)
+    response.headers.append("Server-Timing", stats.server_timing())
+    for statement, executions in stats.repeated(settings.n_plus_one_threshold):
+        logger.warning("Possible N+1 on %s: %d executions of %s", stats.route, executions, statement)
+    return response
+
+
+@contextmanager
+def assert_max_queries(limit: int):
+    """
+    Fail when the code inside the block executes more than ``limit`` statements.
+
+    :param limit: Query budget.
+    :type limit: int
+    :return: Stats filled while the block runs.
+    :rtype: QueryStats
+    :raises AssertionError: If the budget is exceeded.
+    """
+    with trace_queries() as stats:
+        yield stats
+    if stats.count > limit:
+        executed = "\n".join(f"{n} x {sql}" for sql, n in stats.statements.items())
+        raise AssertionError(f"Expected at most {limit} queries, got {stats.count}:\n{executed}")
+
+
+_SERVER_TIMING_QUERIES = re.compile(r'db;dur=[\d.]+;desc="(\d+) queries"')
+
+
+def assert_query_budget(response, limit: int):
+    """
+    Fail when the request behind ``response`` executed more than ``limit`` statements.
+
+    Works with ``TestClient`` responses, where the request runs outside of the test's context.
+
+    :param response: Response returned by the application.
+    :param limit: Query budget.
+    :type limit: int
+    :raises AssertionError: If the header is missing or the budget is exceeded.
+    """
+    match = _SERVER_TIMING_QUERIES.search(response.headers.get("Server-Timing", ""))
+    if match is None:
+        raise AssertionError("Response has no database Server-Timing entry")
+    count = int(match.group(1))
+    if count > limit:
+        raise AssertionError(f"{response.request.method} {response.request.url.path} "
+                             f"executed {count} queries, budget is {limit}")
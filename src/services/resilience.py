@@ -0,0 +1,280 @@
+"""
+Isolation of the external services: Cloudinary, the SMTP server and Redis.
+
+Every call to a service goes through its :class:`Dependency`, which bounds it three ways:
+
+* a timeout, so a hanging service answers an error instead of holding the request;
+* a bulkhead, a cap on concurrent calls, so a slow service can only tie up its own slots
+  (and, for blocking clients, its own threads) and never the workers serving contacts;
+* a circuit breaker, which stops calling a failing service for ``reset_timeout`` seconds,
+  then lets one probe call through to test whether it recovered.
+
+Rejected and failed calls raise :class:`DependencyUnavailable`, and callers pick the
+fallback: answer ``503``, skip the email, or let a request through without rate limiting.
+"""
+import asyncio
+import logging
+import time
+from functools import partial
+from typing import Optional, Tuple, Type
+
+import anyio.to_thread
+from anyio import CapacityLimiter
+from fastapi import Request, Response
+from fastapi_limiter import FastAPILimiter
+from fastapi_limiter.depends import RateLimiter
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+
+from src.conf.config import settings
+from src.services.metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+metrics.describe("dependency_calls_total", "Calls to external services by outcome")
+metrics.describe("dependency_calls_in_flight", "Bulkhead slots in use per external service")
+metrics.describe("circuit_state", "Circuit breaker state per external service: 0 closed, 1 half-open, 2 open")
+
+
+class DependencyUnavailable(Exception):
+    """
+    Raised when an external service call is rejected, times out or fails.
+
+    :param dependency: Service name.
+    :type dependency: str
+    :param reason: What went wrong.
+    :type reason: str
+    """
+
+    def __init__(self, dependency: str, reason: str):
+        super().__init__(f"{dependency} is unavailable: {reason}")
+        self.dependency = dependency
+        self.reason = reason
+
+
+class CircuitBreaker:
+    """
+    Opens after ``failure_threshold`` consecutive failures and rejects calls while open.
+
+    After ``reset_timeout`` seconds it turns half-open and lets a single probe call through:
+    a success closes it, a failure opens it again for another ``reset_timeout``.
+
+    :param name: Service name, used as metrics label.
+    :type name: str
+    :param failure_threshold: Consecutive failures opening the circuit.
+    :type failure_threshold: int
+    :param reset_timeout: Seconds the circuit stays open before a probe call.
+    :type reset_timeout: float
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._set(CLOSED)
+
+    def allow(self) -> bool:
+        """
+        Whether a call may go through now, reserving the probe when half-open.
+
+        :rtype: bool
+        """
+        if self.state == OPEN:
+            if self.clock() - self.opened_at < self.reset_timeout:
+                return False
+            self._set(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self._probing:
+                return False
+            self._probing = True
+        return True
+
+    def success(self):
+        """
+        Record a call the service answered.
+        """
+        self._probing = False
+        self.failures = 0
+        if self.state != CLOSED:
+            logger.info("Circuit of %s closed", self.name)
+            self._set(CLOSED)
+
+    def cancel(self):
+        """
+        Forget a call that ended without an answer, e.g. cancelled with its request.
+        """
+        self._probing = False
+
+    def failure(self):
+        """
+        Record a failed or timed out call.
+        """
+        self._probing = False
+        self.failures += 1
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+            logger.warning("Circuit of %s opened after %s failures", self.name, self.failures)
+            self.opened_at = self.clock()
+            self._set(OPEN)
+
+    def _set(self, state: str):
+        self.state = state
+        metrics.set("circuit_state", _STATE_VALUES[state], dependency=self.name)
+
+
+class Dependency:
+    """
+    Timeout, bulkhead and circuit breaker of one external service.
+
+    :param name: Service name, used as metrics label.
+    :type name: str
+    :param timeout: Seconds a call may take.
+    :type timeout: float
+    :param max_concurrent: Concurrent calls allowed, the bulkhead size.
+    :type max_concurrent: int
+    :param failure_threshold: Consecutive failures opening the circuit.
+    :type failure_threshold: int
+    :param reset_timeout: Seconds the circuit stays open before a probe call.
+    :type reset_timeout: float
+    :param max_wait: Seconds a call may wait for a free slot, 0 to reject it at once.
+    :type max_wait: float
+    :param failures: Exceptions counted as failures of the service. Other exceptions mean
+        the service answered; they propagate unchanged.
+    :type failures: tuple[type[Exception], ...]
+    """
+
+    def __init__(
+        self, name: str, timeout: float, max_concurrent: int, failure_threshold: int, reset_timeout: float,
+        max_wait: float = 0.0, failures: Tuple[Type[BaseException], ...] = (Exception,),
+    ):
+        self.name = name
+        self.timeout = timeout
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self.failures = failures
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self.in_flight = 0
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._threads: Optional[CapacityLimiter] = None
+
+    async def call(self, func, *args, **kwargs):
+        """
+        Await a coroutine function of the service client.
+
+        :param func: Coroutine function.
+        :return: Its result.
+        :raises DependencyUnavailable: If the call was rejected, timed out or failed.
+        """
+        return await self._run(lambda: func(*args, **kwargs))
+
+    async def call_sync(self, func, *args, **kwargs):
+        """
+        Run a blocking function of the service client in a worker thread.
+
+        The call takes one of the ``max_concurrent`` thread slots of this service instead of a slot
+        of the default thread limiter, so a hanging client never starves the database queries.
+
+        :param func: Blocking function.
+        :return: Its result.
+        :raises DependencyUnavailable: If the call was rejected, timed out or failed.
+        """
+        if self._threads is None:
+            self._threads = CapacityLimiter(self.max_concurrent)
+        return await self._run(lambda: anyio.to_thread.run_sync(
+            partial(func, *args, **kwargs), abandon_on_cancel=True, limiter=self._threads
+        ))
+
+    async def _acquire(self):
+        if self._slots.locked():
+            if not self.max_wait:
+                self._reject("bulkhead full")
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.max_wait)
+            except asyncio.TimeoutError:
+                self._reject("bulkhead full")
+        else:
+            await self._slots.acquire()
+        self.in_flight += 1
+        metrics.set("dependency_calls_in_flight", self.in_flight, dependency=self.name)
+
+    def _release(self):
+        self.in_flight -= 1
+        metrics.set("dependency_calls_in_flight", self.in_flight, dependency=self.name)
+        self._slots.release()
+
+    def _reject(self, reason: str):
+        metrics.inc("dependency_calls_total", dependency=self.name, outcome="rejected")
+        raise DependencyUnavailable(self.name, reason)
+
+    async def _run(self, start):
+        await self._acquire()
+        try:
+            if not self.breaker.allow():
+                self._reject("circuit open")
+            try:
+                result = await asyncio.wait_for(start(), self.timeout)
+            except asyncio.TimeoutError:
+                self.breaker.failure()
+                metrics.inc("dependency_calls_total", dependency=self.name, outcome="timeout")
+                raise DependencyUnavailable(self.name, f"no answer within {self.timeout:g}s")
+            except self.failures as e:
+                self.breaker.failure()
+                metrics.inc("dependency_calls_total", dependency=self.name, outcome="failure")
+                raise DependencyUnavailable(self.name, str(e) or type(e).__name__) from e
+            except Exception:
+                self.breaker.success()
+                raise
+            except BaseException:
+                self.breaker.cancel()
+                raise
+            self.breaker.success()
+            metrics.inc("dependency_calls_total", dependency=self.name, outcome="success")
+            return result
+        finally:
+            self._release()
+
+
+class FailOpenRateLimiter(RateLimiter):
+    """
+    Rate limiter letting requests through, unlimited, while Redis is unavailable.
+
+    Rate limits protect the service; failing every request with them when Redis is down
+    would cause the outage they are meant to prevent. Only the public ``__call__`` of the
+    limiter is wrapped. A worker started while Redis was down loads the limiter script with
+    the first call that reaches Redis again, through the circuit breaker of ``redis_calls``.
+    """
+
+    async def __call__(self, request: Request, response: Response):
+        try:
+            await redis_calls.call(self._limit, request, response)
+        except DependencyUnavailable as e:
+            logger.warning("Rate limit not enforced: %s", e)
+
+    async def _limit(self, request: Request, response: Response):
+        if FastAPILimiter.lua_sha is None:
+            FastAPILimiter.lua_sha = await FastAPILimiter.redis.script_load(FastAPILimiter.lua_script)
+        await super().__call__(request, response)
+
+
+cloudinary_calls = Dependency(
+    "cloudinary", settings.cloudinary_timeout_seconds, settings.cloudinary_max_concurrent,
+    settings.circuit_failure_threshold, settings.circuit_reset_seconds,
+)
+smtp_calls = Dependency(
+    "smtp", settings.smtp_timeout_seconds, settings.smtp_max_concurrent,
+    settings.circuit_failure_threshold, settings.circuit_reset_seconds,
+    max_wait=settings.smtp_timeout_seconds,
+)
+redis_calls = Dependency(
+    "redis", settings.redis_timeout_seconds, settings.redis_max_concurrent,
+    settings.circuit_failure_threshold, settings.circuit_reset_seconds,
+    failures=(RedisConnectionError, RedisTimeoutError, OSError),
+)
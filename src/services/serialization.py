@@ -0,0 +1,198 @@
+from datetime import date
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+import orjson
+from fastapi.responses import JSONResponse, Response
+from pydantic import TypeAdapter
+from typing_extensions import TypedDict
+
+
+class ORJSONResponse(JSONResponse):
+    """
+    JSON response rendered with orjson instead of the stdlib ``json`` module.
+    """
+
+    def render(self, content: Any) -> bytes:
+        """
+        Serialize the response content.
+
+        :param content: Data to serialize.
+        :type content: Any
+        :return: JSON document.
+        :rtype: bytes
+        """
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+class UserRecord(TypedDict):
+    """
+    Serialization shape of a user row, mirroring :class:`src.schemas.UserResponse`.
+
+    Rows come from the database and were validated when written, so the fields are
+    plain types and nothing is re-validated on the way out.
+    """
+    id: int
+    name: str
+    surname: Optional[str]
+    email: str
+    phone: str
+    birthdate: date
+    additional_data: Optional[Dict[str, Any]]
+    version: int
+
+
+user_adapter = TypeAdapter(UserRecord)
+users_adapter = TypeAdapter(List[UserRecord])
+
+
+class UserChangesRecord(TypedDict):
+    """
+    Serialization shape of a change feed page, mirroring :class:`src.schemas.UserChanges`.
+    """
+    changed: List[UserRecord]
+    deleted: List[int]
+    version: int
+    has_more: bool
+
+
+changes_adapter = TypeAdapter(UserChangesRecord)
+
+
+@lru_cache(maxsize=128)
+def record_adapters(fields: Optional[Tuple[str, ...]] = None):
+    """
+    Precompiled adapters for a sparse fieldset of :class:`UserRecord`.
+
+    :param fields: Field names, None for the full record.
+    :type fields: tuple[str, ...], optional
+    :return: Adapters for one record and for a list of records.
+    :rtype: tuple[TypeAdapter, TypeAdapter]
+    """
+    if fields is None or fields == tuple(UserRecord.__annotations__):
+        return user_adapter, users_adapter
+    record = TypedDict("PartialUserRecord", {name: UserRecord.__annotations__[name] for name in fields})
+    return TypeAdapter(record), TypeAdapter(List[record])
+
+
+def users_json_response(rows, fields: Optional[Tuple[str, ...]] = None) -> Response:
+    """
+    Serialize user rows straight to a JSON response with a precompiled adapter.
+
+    :param rows: Rows selected with ``src.repository.users.USER_COLUMNS`` or a subset of them.
+    :type rows: list[UserRow]
+    :param fields: Selected fields, None for all of them.
+    :type fields: tuple[str, ...], optional
+    :return: JSON response.
+    :rtype: Response
+    """
+    adapter = record_adapters(fields)[1]
+    return Response(adapter.dump_json([row._asdict() for row in rows]), media_type="application/json")
+
+
+def user_json_response(row, fields: Optional[Tuple[str, ...]] = None) -> Response:
+    """
+    Serialize one user row straight to a JSON response with a precompiled adapter.
+
+    The user version is sent as the ``ETag``, to be used in ``If-Match`` on later writes.
+
+    :param row: Row selected with ``src.repository.users.USER_COLUMNS`` or a subset of them.
+    :type row: UserRow
+    :param fields: Selected fields, None for all of them.
+    :type fields: tuple[str, ...], optional
+    :return: JSON response.
+    :rtype: Response
+    """
+    adapter = record_adapters(fields)[0]
+    response = Response(adapter.dump_json(row._asdict()), media_type="application/json")
+    response.headers["ETag"] = f'"{row.version}"'
+    return response
+
+
+def changes_json_response(changes) -> Response:
+    """
+    Serialize a change feed page straight to a JSON response with the precompiled ``changes_adapter``.
+
+    :param changes: Page returned by ``src.repository.users_read.get_changes``.
+    :type changes: ChangeSet
+    :return: JSON response.
+    :rtype: Response
+    """
+    content = changes_adapter.dump_json({
+        "changed": [row._asdict() for row in changes.changed],
+        "deleted": changes.deleted,
+        "version": changes.version,
+        "has_more": changes.has_more,
+    })
+    return Response(content, media_type="application/json")
+
+
+def duplicates_json_response(groups, fields: Optional[Tuple[str, ...]] = None) -> Response:
+    """
+    Serialize duplicate groups, their users with the precompiled adapter of the fieldset.
+
+    :param groups: Groups returned by ``src.repository.users_read.find_duplicates``.
+    :type groups: list[DuplicateGroup]
+    :param fields: Selected fields, None for all of them.
+    :type fields: tuple[str, ...], optional
+    :return: JSON response mirroring a list of :class:`src.schemas.DuplicateGroup`.
+    :rtype: Response
+    """
+    adapter = record_adapters(fields)[1]
+    items = [
+        b'{"reasons":%s,"users":%s}' % (
+            orjson.dumps(group.reasons), adapter.dump_json([row._asdict() for row in group.users])
+        )
+        for group in groups
+    ]
+    return Response(b"[%s]" % b",".join(items), media_type="application/json")
+
+
+class BulkResultRecord(TypedDict):
+    """
+    Serialization shape of a bulk operation outcome, mirroring :class:`src.schemas.BulkResult`.
+    """
+    id: int
+    status: str
+    version: Optional[int]
+
+
+bulk_results_adapter = TypeAdapter(List[BulkResultRecord])
+
+
+def bulk_json_response(results) -> Response:
+    """
+    Serialize the per-user outcomes of a bulk operation with the precompiled ``bulk_results_adapter``.
+
+    :param results: Outcomes returned by the bulk repository functions.
+    :type results: list[dict]
+    :return: JSON response.
+    :rtype: Response
+    """
+    return Response(bulk_results_adapter.dump_json(results), media_type="application/json")
+
+
+def batch_json_response(results, committed: bool) -> Response:
+    """
+    Serialize the responses of a batch request.
+
+    JSON bodies of the operations are embedded as they are, without being parsed again.
+
+    :param results: Operation results returned by ``src.services.batch.run_batch``.
+    :type results: list[OperationResult]
+    :param committed: Whether the changes of the batch were committed.
+    :type committed: bool
+    :return: JSON response mirroring :class:`src.schemas.BatchResponse`.
+    :rtype: Response
+    """
+    items = []
+    for result in results:
+        if result.content_type.startswith("application/json") and result.body:
+            body = result.body
+        else:
+            body = orjson.dumps(result.body.decode("utf-8", "replace") or None)
+        items.append(
+            b'{"status":%d,"headers":%s,"body":%s}' % (result.status, orjson.dumps(result.headers), body)
+        )
+    content = b'{"responses":[%s],"committed":%s}' % (b",".join(items), b"true" if committed else b"false")
+    return Response(content, media_type="application/json")
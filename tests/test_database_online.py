@@ -0,0 +1,38 @@
+import unittest
+
+import sqlalchemy as sa
+
+from src.database.online import backfill_users
+
+
+class TestBackfillUsers(unittest.TestCase):
+    def setUp(self):
+        self.engine = sa.create_engine("sqlite://")
+        self.users = sa.Table(
+            "users", sa.MetaData(),
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("account_id", sa.Integer, nullable=True),
+            sa.Column("name", sa.String),
+            sa.Column("name_key", sa.String),
+        )
+        self.users.metadata.create_all(self.engine)
+        with self.engine.begin() as connection:
+            connection.execute(sa.insert(self.users), [
+                {"id": 1, "account_id": 1, "name": "Ann"},
+                {"id": 2, "account_id": None, "name": "Bob"},
+                {"id": 5, "account_id": 2, "name": "Eve"},
+            ])
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_every_row_is_written(self):
+        with self.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            backfill_users(connection, ["name"], lambda row: {"name_key": row.name.lower()}, batch_size=2)
+        with self.engine.connect() as connection:
+            keys = connection.execute(sa.select(self.users.c.id, self.users.c.name_key).order_by("id")).all()
+        self.assertEqual(keys, [(1, "ann"), (2, "bob"), (5, "eve")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import asyncio
+import unittest
+from datetime import date
+from unittest.mock import AsyncMock, patch
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from src.database.models import Base, User, Account
+from src.database.replicas import ReplicaRouter
+from src.database.shards import ShardedSession
+from src.repository import users as users_repo
+from src.repository import users_read
+from src.schemas import UserPatch
+
+
+def memory_engine():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    return engine
+
+
+class TestReplicaRouter(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.replicas = [memory_engine(), memory_engine()]
+        self.router = ReplicaRouter(self.replicas, max_lag=5, sticky_seconds=5, check_interval=60)
+
+    async def asyncTearDown(self):
+        await self.router.stop()
+
+    async def test_round_robin(self):
+        await self.router.start()
+        picked = {await self.router.read_bind(1) for _ in range(4)}
+        self.assertEqual(picked, set(self.replicas))
+
+    async def test_lagging_and_failed_replicas(self):
+        self.router.lag[self.replicas[0]] = 30.0
+        self.assertEqual({await self.router.read_bind(1) for _ in range(4)}, {self.replicas[1]})
+        self.router.lag[self.replicas[1]] = None
+        self.assertIsNone(await self.router.read_bind(1))
+
+    async def test_read_your_writes(self):
+        self.router.mark_write(1)
+        self.assertIsNone(await self.router.read_bind(1))
+        self.assertIsNotNone(await self.router.read_bind(2))
+
+    async def test_shared_sticky_marks_are_kept_until_stored(self):
+        redis = AsyncMock()
+        await self.router.start(redis)
+        self.router.mark_write(1)
+        self.assertEqual(len(self.router._shares), 1)
+        await self.router.stop()
+        redis.set.assert_awaited_once()
+        self.assertEqual(len(self.router._shares), 0)
+
+    async def test_without_replicas(self):
+        router = ReplicaRouter([], max_lag=5, sticky_seconds=5, check_interval=60)
+        router.mark_write(1)
+        self.assertIsNone(await router.read_bind(1))
+
+
+class TestReplicaReads(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.primary = memory_engine()
+        self.replica = memory_engine()
+        for engine, name in ((self.primary, "Primary"), (self.replica, "Replica")):
+            db = sessionmaker(bind=engine)()
+            db.add(Account(login="test", email="test@gmail.com", password="secret"))
+            db.add(User(name=name, phone="123", birthdate=date(2000, 1, 1), account_id=1))
+            db.commit()
+            db.close()
+        self.db = sessionmaker(autocommit=False, autoflush=False, bind=self.primary)()
+        self.account = self.db.get(Account, 1)
+        self.router = ReplicaRouter([self.replica], max_lag=5, sticky_seconds=5, check_interval=60)
+        self.original_router = users_read.replica_router
+        users_read.replica_router = self.router
+
+    def tearDown(self):
+        users_read.replica_router = self.original_router
+        self.db.close()
+
+    async def test_reads_use_replica(self):
+        self.assertEqual((await users_read.get_user(1, self.account, self.db)).name, "Replica")
+        self.assertEqual((await users_read.get_users(0, 10, self.account, self.db))[0].name, "Replica")
+
+    async def test_reads_after_write_use_primary(self):
+        self.router.mark_write(self.account.id)
+        self.assertEqual((await users_read.get_user(1, self.account, self.db)).name, "Primary")
+        self.assertEqual((await users_read.find_user("Primary", None, None, self.account, self.db)).name, "Primary")
+
+    async def test_sticky_reads_do_not_join_replica_reads(self):
+        other = sessionmaker(autocommit=False, autoflush=False, bind=self.primary)()
+        try:
+            replica_read = asyncio.create_task(users_read.get_users(0, 10, self.account, other))
+            await asyncio.sleep(0)
+            self.router.mark_write(self.account.id)
+            primary_read = await users_read.get_users(0, 10, self.account, self.db)
+            self.assertEqual((await replica_read)[0].name, "Replica")
+            self.assertEqual(primary_read[0].name, "Primary")
+        finally:
+            other.close()
+
+    async def test_only_committed_writes_are_sticky(self):
+        db = ShardedSession(bind=self.primary, autoflush=False, expire_on_commit=False)
+        try:
+            with patch("src.database.db.replica_router", self.router):
+                await users_repo.patch_user(99, UserPatch(name="Missing"), self.account, db)
+                self.assertIsNotNone(await self.router.read_bind(self.account.id))
+                await users_repo.patch_user(1, UserPatch(name="Patched"), self.account, db)
+                self.assertIsNone(await self.router.read_bind(self.account.id))
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
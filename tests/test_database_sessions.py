@@ -0,0 +1,52 @@
+import unittest
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from src.database.db import ROUTE, release, track_connection_holds
+from src.database.models import Base, Account
+from src.services.metrics import metrics
+
+
+class TestConnectionRelease(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://", poolclass=QueuePool, pool_size=1, max_overflow=0)
+        Base.metadata.create_all(bind=self.engine)
+        self.session_local = sessionmaker(autoflush=False, bind=self.engine, expire_on_commit=False)
+        track_connection_holds(self.session_local)
+        self.route = f"GET /{self.id()}"
+        self.db = self.session_local(info={ROUTE: self.route})
+
+    def tearDown(self):
+        self.db.close()
+        self.engine.dispose()
+
+    def test_release_returns_connection(self):
+        self.db.add(Account(login="test", email="test@gmail.com", password="secret"))
+        self.db.commit()
+        self.assertEqual(self.engine.pool.checkedout(), 0)
+
+        account = self.db.execute(select(Account)).scalar_one()
+        self.assertEqual(self.engine.pool.checkedout(), 1)
+        release(self.db)
+        self.assertEqual(self.engine.pool.checkedout(), 0)
+        self.assertEqual(account.email, "test@gmail.com")
+        self.assertEqual(self.engine.pool.checkedout(), 0)
+        self.assertEqual(metrics.value("db_connection_holds_total", route=self.route), 2)
+        self.assertGreater(metrics.value("db_connection_hold_seconds_total", route=self.route), 0)
+
+    def test_release_keeps_pending_changes(self):
+        self.db.add(Account(login="test", email="test@gmail.com", password="secret"))
+        self.db.commit()
+        account = self.db.execute(select(Account)).scalar_one()
+        account.login = "changed"
+        release(self.db)
+        self.assertTrue(self.db.in_transaction())
+        self.db.rollback()
+        self.assertEqual(self.db.execute(select(Account.login)).scalar_one(), "test")
+
+    def test_release_without_transaction(self):
+        release(self.db)
+        self.assertFalse(self.db.in_transaction())
+        self.assertEqual(metrics.value("db_connection_holds_total", route=self.route), 0)
@@ -0,0 +1,129 @@
+import unittest
+from datetime import date
+from unittest.mock import patch
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from src.database.models import Base, User, Account, AccountVersion, UserTombstone
+from src.database.shards import (
+    ShardMap, ShardedSession, ShardUnavailable, move_account, parse_shard_urls, user_id_range, DEFAULT_SHARD,
+    USER_ID_BLOCK,
+)
+from src.repository import users as users_repo
+from src.repository import users_read
+from src.schemas import UserModel
+
+
+def memory_engine():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    return engine
+
+
+def count_users(engine, account_id):
+    with Session(engine) as db:
+        return db.execute(select(func.count(User.id)).where(User.account_id == account_id)).scalar()
+
+
+class TestShardMap(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.primary = memory_engine()
+        self.other = memory_engine()
+        self.shard_map = ShardMap(self.primary, {"b": self.other}, ["b"])
+        self.db = sessionmaker(autoflush=False, bind=self.primary, class_=ShardedSession)()
+        self.account = Account(login="test", email="test@gmail.com", password="secret", shard="b")
+        self.db.add(self.account)
+        self.db.commit()
+        self.shard_map.register(self.account)
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_parse_shard_urls(self):
+        self.assertEqual(parse_shard_urls(" a=sqlite://, b=postgresql://x "), {"a": "sqlite://", "b": "postgresql://x"})
+        self.assertEqual(parse_shard_urls(""), {})
+        with self.assertRaises(ValueError):
+            parse_shard_urls("sqlite://")
+        with self.assertRaises(ValueError):
+            parse_shard_urls(f"{DEFAULT_SHARD}=sqlite://")
+
+    def test_place(self):
+        self.assertEqual(self.shard_map.place("new@gmail.com"), "b")
+        spread = ShardMap(self.primary, {"b": self.other})
+        self.assertEqual({spread.place(f"{i}@gmail.com") for i in range(20)}, {None, "b"})
+
+    async def test_contacts_go_to_the_account_shard(self):
+        self.shard_map.bind(self.db, self.account)
+        body = UserModel(name="Sharded", email="s@gmail.com", phone="123", birthdate=date(2000, 1, 1))
+        user = await users_repo.create_user(body, self.account, self.db)
+        self.assertEqual(user.version, 1)
+        self.assertEqual(count_users(self.other, self.account.id), 1)
+        self.assertEqual(count_users(self.primary, self.account.id), 0)
+        rows = await users_read.get_users(0, 10, self.account, self.db)
+        self.assertEqual([row.name for row in rows], ["Sharded"])
+        self.assertEqual(self.db.query(Account).filter(Account.email == "test@gmail.com").count(), 1)
+
+    def test_register_twice(self):
+        self.shard_map.register(self.account)
+        with Session(self.other) as db:
+            self.assertEqual(db.get(AccountVersion, self.account.id).version, 0)
+
+    def test_user_id_ranges_are_disjoint(self):
+        self.assertEqual(user_id_range(None), (1, USER_ID_BLOCK - 1))
+        self.assertEqual(user_id_range(DEFAULT_SHARD), user_id_range(None))
+        ranges = sorted(user_id_range(f"shard{n}") for n in range(64))
+        self.assertGreaterEqual(ranges[0][0], USER_ID_BLOCK)
+        self.assertLessEqual(ranges[-1][1], 2 ** 63 - 1)
+        for (_, last), (first, _) in zip(ranges, ranges[1:]):
+            self.assertLess(last, first)
+
+    def test_shards_sharing_a_user_id_block(self):
+        with patch("src.database.shards.user_id_block", side_effect=lambda name: 0 if name == DEFAULT_SHARD else 1):
+            with self.assertRaises(ValueError):
+                ShardMap(self.primary, {"a": self.other, "b": self.other})
+
+    def test_locked_account(self):
+        self.account.shard_locked = True
+        with self.assertRaises(ShardUnavailable):
+            self.shard_map.bind(self.db, self.account)
+
+
+class TestMoveAccount(unittest.TestCase):
+    def setUp(self):
+        self.primary = memory_engine()
+        self.other = memory_engine()
+        self.shard_map = ShardMap(self.primary, {"b": self.other})
+        with Session(self.primary) as db:
+            account = Account(
+                login="test", email="test@gmail.com", password="secret", version_counter=AccountVersion(version=3)
+            )
+            db.add(account)
+            db.flush()
+            db.add_all([
+                User(name=f"U_{i}", phone="123", birthdate=date(2000, 1, 1), account_id=account.id, version=i)
+                for i in range(1, 4)
+            ])
+            db.add(UserTombstone(user_id=99, account_id=account.id, version=2))
+            db.commit()
+            self.account_id = account.id
+
+    def test_move_and_back(self):
+        self.assertEqual(move_account(self.shard_map, self.account_id, "b", batch_size=2, grace=0), 3)
+        with Session(self.primary) as db:
+            account = db.get(Account, self.account_id)
+            self.assertEqual((account.shard, account.shard_locked), ("b", False))
+            self.assertIsNone(db.get(AccountVersion, self.account_id))
+        self.assertEqual(count_users(self.primary, self.account_id), 0)
+        self.assertEqual(count_users(self.other, self.account_id), 3)
+        with Session(self.other) as db:
+            self.assertEqual(db.get(AccountVersion, self.account_id).version, 3)
+            self.assertEqual(db.execute(select(UserTombstone.user_id)).scalars().all(), [99])
+            self.assertEqual(db.get(Account, self.account_id).password, "")
+
+        self.assertEqual(move_account(self.shard_map, self.account_id, DEFAULT_SHARD, grace=0), 3)
+        self.assertEqual(count_users(self.primary, self.account_id), 3)
+        self.assertEqual(count_users(self.other, self.account_id), 0)
+        with Session(self.primary) as db:
+            self.assertIsNone(db.get(Account, self.account_id).shard)
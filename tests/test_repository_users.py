@@ -3,21 +3,21 @@ from unittest.mock import MagicMock
 from datetime import datetime, timedelta
 
 from src.database.models import User, Account
-from src.schemas import UserModel, UserUpdate
+from src.schemas import UserModel, UserUpdate, UserPatch
+from src.repository.users_read import UserRow
 from src.repository.users import (
-    get_users,
-    get_user,
-    find_user,
-    upcoming_birthdays,
     create_user,
     remove_user,
     update_user,
+    patch_user,
+    VersionConflict,
 )
 
 
 class TestUserRepository(unittest.IsolatedAsyncioTestCase):
     def setUp(self):
         self.mock_session = MagicMock()
+        self.mock_session.execute().scalar.return_value = 1
         self.current_user = Account(id=1)
         self.user_model = UserModel(
             name="U_Test",
@@ -25,7 +25,7 @@ class TestUserRepository(unittest.IsolatedAsyncioTestCase):
             email="u_test.sur_test@gmail.com",
             phone="123456789",
             birthdate=datetime.now().date(),
-            additional_data="Info",
+            additional_data={"note": "Info"},
         )
         self.user_update = UserUpdate(
             name="New Name",
@@ -33,33 +33,12 @@ class TestUserRepository(unittest.IsolatedAsyncioTestCase):
             email="new.email@gmail.com",
             phone="987654321",
             birthdate=datetime.now().date() - timedelta(days=365 * 30),
-            additional_data="New info",
+            additional_data={"note": "New info"},
         )
-
-    async def test_get_users(self):
-        self.mock_session.query().filter().offset().limit().all.return_value = [User(), User(), User()]
-        result = await get_users(skip=0, limit=10, account=self.current_user, db=self.mock_session)
-        self.assertEqual(len(result), 3)
-        self.assertIsInstance(result[0], User)
-
-    async def test_get_user(self):
-        self.mock_session.query().filter().first.return_value = User(id=1, name="U_Test", email="U_Test@gmail.com")
-        result = await get_user(user_id=1, account=self.current_user, db=self.mock_session)
-        self.assertIsInstance(result, User)
-
-    async def test_find_user(self):
-        expected_user = User(id=1, name="U_Test", email="U_Test@gmail.com")
-        self.mock_session.query().filter().filter().filter().first.return_value = expected_user
-        result = await find_user(
-            user_name="U_Test", user_surname="Doe", user_email="U_Test@gmail.com", account=self.current_user, db=self.mock_session
+        self.user_row = UserRow(
+            id=1, name="U_Test", surname=None, email="U_Test@gmail.com", phone="123",
+            birthdate=datetime.now().date(), additional_data=None, version=1,
         )
-        self.assertEqual(result, expected_user)
-
-    async def test_upcoming_birthdays(self):
-        self.mock_session.query().filter().all.return_value = [User(), User(), User()]
-        result = await upcoming_birthdays(db=self.mock_session, account=self.current_user, days=7)
-        self.assertEqual(len(result), 3)
-        self.assertIsInstance(result[0], User)
 
     async def test_create_user(self):
         self.mock_session.add.return_value = None
@@ -69,17 +48,38 @@ class TestUserRepository(unittest.IsolatedAsyncioTestCase):
         self.assertIsInstance(result, User)
 
     async def test_remove_user(self):
-        self.mock_session.query().filter().first.return_value = User(id=1, name="U_Test", email="U_Test@gmail.com")
-        self.mock_session.delete.return_value = None
+        self.mock_session.execute().first.return_value = self.user_row
         self.mock_session.commit.return_value = None
         result = await remove_user(user_id=1, account=self.current_user, db=self.mock_session)
-        self.assertIsInstance(result, User)
+        self.assertEqual(result, self.user_row)
+        self.mock_session.commit.assert_called_once()
+
+    async def test_remove_user_not_found(self):
+        self.mock_session.execute().first.return_value = None
+        result = await remove_user(user_id=1, account=self.current_user, db=self.mock_session)
+        self.assertIsNone(result)
+        self.mock_session.commit.assert_not_called()
 
     async def test_update_user(self):
-        self.mock_session.query().filter().first.return_value = User(id=1, name="U_Test", email="U_Test@gmail.com")
+        self.mock_session.execute().first.return_value = self.user_row
         self.mock_session.commit.return_value = None
         result = await update_user(user_id=1, body=self.user_update, account=self.current_user, db=self.mock_session)
-        self.assertIsInstance(result, User)
+        self.assertEqual(result, self.user_row)
+
+    async def test_update_user_version_conflict(self):
+        self.mock_session.execute().first.return_value = None
+        self.mock_session.execute().scalar.return_value = 2
+        with self.assertRaises(VersionConflict):
+            await update_user(
+                user_id=1, body=self.user_update, account=self.current_user, db=self.mock_session, expected_version=1
+            )
+
+    async def test_patch_user(self):
+        self.mock_session.execute().first.return_value = self.user_row
+        result = await patch_user(
+            user_id=1, body=UserPatch(name="New Name"), account=self.current_user, db=self.mock_session
+        )
+        self.assertEqual(result, self.user_row)
 
 
 if __name__ == "__main__":
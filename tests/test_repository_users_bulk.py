@@ -0,0 +1,76 @@
+import unittest
+from datetime import date
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from src.database.models import Base, User, Account, AccountVersion, UserTombstone
+from src.repository import users as users_repo
+from src.schemas import UserBulkPatch
+from src.services.query_tracer import assert_max_queries
+
+
+class TestBulkOperations(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        Base.metadata.create_all(bind=self.engine)
+        self.db = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)()
+        self.account = Account(
+            login="test", email="test@gmail.com", password="secret", version_counter=AccountVersion(version=0)
+        )
+        self.other = Account(login="other", email="other@gmail.com", password="secret")
+        self.db.add_all([self.account, self.other])
+        self.db.commit()
+        self.db.add_all(
+            [User(name=f"U_{i}", phone="123", birthdate=date(2000, 1, 1), account_id=self.account.id) for i in range(1200)]
+        )
+        self.db.add(User(name="Foreign", phone="123", birthdate=date(2000, 1, 1), account_id=self.other.id))
+        self.db.commit()
+        self.db.refresh(self.account)
+        self.foreign_id = 1201
+
+    def tearDown(self):
+        self.db.close()
+        self.engine.dispose()
+
+    async def test_bulk_patch(self):
+        body = UserBulkPatch(items=[{"id": i, "changes": {"surname": f"S_{i}"}} for i in range(1, 1201)])
+        with assert_max_queries(4):
+            results = await users_repo.bulk_patch_users(body.items, self.account, self.db)
+        self.assertTrue(all(result["status"] == "updated" for result in results))
+        self.assertEqual(len({result["version"] for result in results}), 1200)
+        surnames = self.db.execute(select(User.surname).where(User.id.in_([1, 600, 1200]))).scalars().all()
+        self.assertEqual(surnames, ["S_1", "S_600", "S_1200"])
+        self.assertEqual(self.db.get(User, 2).name, "U_1")
+
+    async def test_bulk_patch_conflicts(self):
+        body = UserBulkPatch(items=[
+            {"id": 1, "version": 0, "changes": {"name": "A"}},
+            {"id": 2, "version": 5, "changes": {"name": "B"}},
+            {"id": self.foreign_id, "changes": {"name": "C"}},
+        ])
+        results = await users_repo.bulk_patch_users(body.items, self.account, self.db)
+        self.assertEqual([result["status"] for result in results], ["updated", "conflict", "not_found"])
+        self.assertEqual(results[1]["version"], 0)
+        self.assertEqual(self.db.get(User, 2).name, "U_1")
+        self.assertEqual(self.db.get(User, self.foreign_id).name, "Foreign")
+
+    def test_bulk_patch_duplicate_ids(self):
+        with self.assertRaises(ValueError):
+            UserBulkPatch(items=[{"id": 1, "changes": {"name": "A"}}, {"id": 1, "changes": {"name": "B"}}])
+
+    async def test_bulk_remove(self):
+        ids = list(range(1, 1001)) + [self.foreign_id, 5000]
+        # The counter lock, three DELETE chunks, the versions and the tombstones.
+        with assert_max_queries(6) as stats:
+            results = await users_repo.bulk_remove_users(ids, self.account, self.db)
+        self.assertIn("FROM account_versions", next(iter(stats.statements)))
+        self.assertEqual([result["status"] for result in results[-3:]], ["deleted", "not_found", "not_found"])
+        self.assertEqual(self.db.query(User).filter(User.account_id == self.account.id).count(), 200)
+        self.assertEqual(self.db.query(UserTombstone).count(), 1000)
+        self.assertIsNotNone(self.db.get(User, self.foreign_id))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+import unittest
+from datetime import date
+from unittest.mock import patch
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from src.database.models import Base, User, Account, AccountVersion, UserTombstone
+from src.repository import users as users_repo
+from src.repository import users_read
+from src.schemas import UserModel
+from src.services.fingerprints import email_key, name_key
+from src.services.query_tracer import assert_max_queries
+
+
+class TestFingerprints(unittest.TestCase):
+    def test_email_key(self):
+        self.assertEqual(email_key(" J.Doe+work@Mail.COM "), "j.doe@mail.com")
+        self.assertEqual(email_key("not-an-email"), "not-an-email")
+        self.assertIsNone(email_key(" "))
+
+    def test_name_key(self):
+        self.assertEqual(name_key("José-Luis"), "jose luis")
+        self.assertEqual(name_key("luis  JOSE"), "jose luis")
+        self.assertIsNone(name_key("--"))
+        self.assertIsNone(name_key(None))
+
+
+class TestDuplicates(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        Base.metadata.create_all(bind=self.engine)
+        self.db = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)()
+        self.account = Account(
+            login="test", email="test@gmail.com", password="secret", version_counter=AccountVersion(version=0)
+        )
+        self.other = Account(login="other", email="other@gmail.com", password="secret")
+        self.db.add_all([self.account, self.other])
+        self.db.commit()
+        self.db.refresh(self.account)
+        contacts = [
+            ("Jane", "Doe", "jane@gmail.com", "+380671111111", None),
+            ("Jane", "Doe-Smith", "Jane+import@Gmail.com", "0672222222", {"company": "Acme"}),
+            ("J.", "", "jd@gmail.com", "067 222 22 22", {"company": "Globex", "city": "Kyiv"}),
+            ("Bob", "Stone", "bob@gmail.com", "+380673333333", None),
+            ("Ann", "Lee", "ann@gmail.com", "+380674444444", None),
+            ("ann", "LEE", "lee@gmail.com", "+380675555555", None),
+        ]
+        for name, surname, email, phone, data in contacts:
+            body = UserModel(
+                name=name, surname=surname, email=email, phone=phone, birthdate=date(1990, 1, 1), additional_data=data
+            )
+            await users_repo.create_user(body, self.account, self.db)
+        body = UserModel(name="Jane", surname="Doe", email="jane@gmail.com", phone="1", birthdate=date(1990, 1, 1))
+        await users_repo.create_user(body, self.other, self.db)
+
+    def tearDown(self):
+        self.db.close()
+        self.engine.dispose()
+
+    async def test_find_duplicates(self):
+        groups = await users_read.find_duplicates(0, 10, self.account, self.db)
+        self.assertEqual([[user.id for user in group.users] for group in groups], [[1, 2, 3], [5, 6]])
+        self.assertEqual(groups[0].reasons, ["email", "phone"])
+        self.assertEqual(groups[1].reasons, ["name"])
+        page = await users_read.find_duplicates(1, 10, self.account, self.db, ("id", "name", "version"))
+        self.assertEqual([user._asdict() for user in page[0].users], [
+            {"id": 5, "name": "Ann", "version": 5}, {"id": 6, "name": "ann", "version": 6},
+        ])
+
+    async def test_groups_are_detected_again_only_after_a_write(self):
+        with patch.object(users_read, "_duplicate_groups", wraps=users_read._duplicate_groups) as detect:
+            await users_read.find_duplicates(0, 1, self.account, self.db)
+            page = await users_read.find_duplicates(1, 1, self.account, self.db)
+            self.assertEqual([[user.id for user in group.users] for group in page], [[5, 6]])
+            self.assertEqual(detect.call_count, 1)
+            await users_repo.merge_users(5, [6], self.account, self.db)
+            self.assertEqual(len(await users_read.find_duplicates(0, 10, self.account, self.db)), 1)
+            self.assertEqual(detect.call_count, 2)
+
+    async def test_oversized_buckets_are_ignored(self):
+        with patch.object(users_read, "MAX_BUCKET_SIZE", 1):
+            self.assertEqual(await users_read.find_duplicates(0, 10, self.account, self.db), [])
+
+    async def test_merge(self):
+        with assert_max_queries(10) as stats:
+            user = await users_repo.merge_users(1, [3, 2], self.account, self.db)
+        statements = list(stats.statements)
+        locks = [next(n for n, sql in enumerate(statements) if table in sql) for table in ("account_versions", "users")]
+        self.assertLess(*locks)
+        self.assertEqual((user.id, user.surname, user.email, user.phone), (1, "Doe", "jane@gmail.com", "+380671111111"))
+        self.assertEqual(user.additional_data, {"company": "Globex", "city": "Kyiv"})
+        self.assertEqual(user.version, 9)
+        remaining = self.db.execute(select(User.id).where(User.account_id == self.account.id).order_by(User.id)).scalars().all()
+        self.assertEqual(remaining, [1, 4, 5, 6])
+        tombstones = self.db.execute(select(UserTombstone.user_id, UserTombstone.version)).all()
+        self.assertEqual(sorted(tombstones), [(2, 8), (3, 7)])
+        groups = await users_read.find_duplicates(0, 10, self.account, self.db)
+        self.assertEqual([[user.id for user in group.users] for group in groups], [[5, 6]])
+
+    async def test_merge_fills_empty_fields(self):
+        user = await users_repo.merge_users(3, [2], self.account, self.db)
+        self.assertEqual(user.surname, "Doe-Smith")
+        self.assertEqual(user.additional_data, {"company": "Globex", "city": "Kyiv"})
+
+    async def test_merge_missing_user(self):
+        self.assertIsNone(await users_repo.merge_users(1, [7], self.account, self.db))
+        self.assertIsNone(await users_repo.merge_users(1, [99], self.account, self.db))
+        self.assertEqual(self.db.execute(select(User.id).order_by(User.id)).scalars().all(), [1, 2, 3, 4, 5, 6, 7])
+
+
+class TestDuplicateGroupsCache(unittest.TestCase):
+    def test_bounded_by_cached_ids(self):
+        cache = users_read.DuplicateGroupsCache(max_ids=5)
+        cache.put("a", 1, [([1, 2], ["email"])])
+        cache.put("b", 1, [([3, 4, 5], ["phone"])])
+        self.assertEqual(cache.get("a", 1), [([1, 2], ["email"])])
+        cache.put("c", 1, [([6, 7], ["name"])])
+        self.assertEqual(cache.ids, 4)
+        self.assertIsNone(cache.get("b", 1))
+        self.assertIsNotNone(cache.get("a", 1))
+        cache.put("d", 1, [([1, 2, 3], ["email"]), ([4, 5, 6], ["name"])])
+        self.assertIsNone(cache.get("d", 1))
+        self.assertEqual(cache.ids, 4)
+
+    def test_outdated_groups(self):
+        cache = users_read.DuplicateGroupsCache(max_ids=10)
+        cache.put("a", 2, [([1, 2], ["email"])])
+        cache.put("a", 1, [([1, 2, 3], ["email"])])
+        self.assertIsNone(cache.get("a", 3))
+        self.assertEqual(cache.get("a", 2), [([1, 2], ["email"])])
+        cache.put("a", 3, [([1, 2, 3], ["email"])])
+        self.assertEqual(cache.ids, 3)
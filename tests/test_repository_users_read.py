@@ -0,0 +1,235 @@
+import asyncio
+import unittest
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from src.database.models import Base, User, Account, AccountVersion, UserTombstone
+from src.repository import users as users_repo
+from src.repository import users_read
+from src.schemas import UserModel
+from src.services.metrics import metrics
+from src.repository.users_read import UserRow, USER_FIELDS, parse_fields, parse_data_filters, data_condition
+
+
+class TestUsersReadRepository(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        Base.metadata.create_all(bind=self.engine)
+        self.db = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)()
+        self.account = Account(login="test", email="test@gmail.com", password="secret")
+        self.other_account = Account(login="other", email="other@gmail.com", password="secret")
+        self.db.add_all([self.account, self.other_account])
+        self.db.commit()
+        today = date.today()
+        self.db.add_all([
+            User(name="U_Test", surname="Sur_Test", email="u_test@gmail.com", phone="123",
+                 birthdate=today.replace(year=1990), account_id=self.account.id,
+                 additional_data={"company": "Acme", "size": 30, "address": {"city": "Kyiv"}}),
+            User(name="U_Late", surname="Sur_Late", email="u_late@gmail.com", phone="456",
+                 birthdate=(today + timedelta(days=60)).replace(year=1990), account_id=self.account.id,
+                 additional_data={"company": "Globex", "size": "30"}),
+            User(name="U_Other", surname="Sur_Other", email="u_other@gmail.com", phone="789",
+                 birthdate=today.replace(year=1990), account_id=self.other_account.id),
+        ])
+        self.db.commit()
+        self.db.refresh(self.account)
+        self.db.refresh(self.other_account)
+
+    def tearDown(self):
+        self.db.close()
+        self.engine.dispose()
+
+    async def test_get_users(self):
+        loaded = len(self.db.identity_map)
+        result = await users_read.get_users(skip=0, limit=10, account=self.account, db=self.db)
+        self.assertEqual([row.name for row in result], ["U_Test", "U_Late"])
+        self.assertIsInstance(result[0], UserRow)
+        self.assertEqual(len(self.db.identity_map), loaded)
+
+    async def test_concurrent_reads_share_a_query_off_the_sessions(self):
+        sessions = [sessionmaker(autocommit=False, autoflush=False, bind=self.engine)() for _ in range(3)]
+        coalesced = metrics.value("coalesced_reads_total", flight="users_read")
+        results = await asyncio.gather(*[
+            users_read.get_users(skip=0, limit=10, account=self.account, db=db) for db in sessions
+        ])
+        self.assertEqual(metrics.value("coalesced_reads_total", flight="users_read"), coalesced + 2)
+        self.assertTrue(all(result is results[0] for result in results))
+        for db in sessions:
+            self.assertFalse(db.in_transaction())
+            db.close()
+
+    async def test_transaction_bound_session_reads_alone(self):
+        connection = self.engine.connect()
+        transaction = connection.begin()
+        db = Session(bind=connection, join_transaction_mode="create_savepoint", autoflush=False)
+        try:
+            executed = metrics.value("executed_reads_total", flight="users_read")
+            result = await users_read.get_users(skip=0, limit=10, account=self.account, db=db)
+            self.assertEqual(len(result), 2)
+            self.assertEqual(metrics.value("executed_reads_total", flight="users_read"), executed)
+        finally:
+            db.close()
+            transaction.rollback()
+            connection.close()
+
+    async def test_get_user(self):
+        result = await users_read.get_user(user_id=1, account=self.account, db=self.db)
+        self.assertIsInstance(result, UserRow)
+        self.assertEqual(result.email, "u_test@gmail.com")
+
+    async def test_get_user_other_account(self):
+        result = await users_read.get_user(user_id=3, account=self.account, db=self.db)
+        self.assertIsNone(result)
+
+    async def test_find_user(self):
+        result = await users_read.find_user(
+            user_name="U_Late", user_surname=None, user_email=None, account=self.account, db=self.db
+        )
+        self.assertEqual(result.id, 2)
+
+    async def test_find_user_without_filters_stays_in_account(self):
+        result = await users_read.find_user(
+            user_name=None, user_surname=None, user_email=None, account=self.other_account, db=self.db
+        )
+        self.assertEqual(result.id, 3)
+
+    async def test_upcoming_birthdays(self):
+        result = await users_read.upcoming_birthdays(db=self.db, account=self.account, days=7)
+        self.assertEqual([row.name for row in result], ["U_Test"])
+
+    async def test_get_users_sparse_fields(self):
+        result = await users_read.get_users(
+            skip=0, limit=10, account=self.account, db=self.db, fields=parse_fields("phone,name")
+        )
+        self.assertEqual(result[0]._asdict(), {"id": 1, "name": "U_Test", "phone": "123", "version": 0})
+
+    def test_parse_fields(self):
+        self.assertEqual(parse_fields(None), USER_FIELDS)
+        self.assertEqual(parse_fields("phone, name"), ("id", "name", "phone", "version"))
+        with self.assertRaises(ValueError):
+            parse_fields("name,password")
+
+    async def test_get_users_data_filters(self):
+        async def names(query):
+            data = parse_data_filters(query)
+            return [row.name for row in await users_read.get_users(0, 10, self.account, self.db, data=data)]
+
+        self.assertEqual(await names([("data.company", "Acme")]), ["U_Test"])
+        self.assertEqual(await names([("data.address.city", "Kyiv"), ("skip", "0")]), ["U_Test"])
+        self.assertEqual(await names([("data.size", "30")]), ["U_Test", "U_Late"])
+        self.assertEqual(await names([("data.company", "Acme"), ("data.size", "31")]), [])
+        self.assertEqual(await names([("data.company", "Initech")]), [])
+
+    async def test_find_by_phone(self):
+        for name, phone in (("U_Phone", "+380 (67) 123-45-67"), ("U_National", "067 123 45 67")):
+            body = UserModel(name=name, email=f"{name}@gmail.com", phone=phone, birthdate=date(1990, 1, 1))
+            await users_repo.create_user(body, self.account, self.db)
+
+        for number in ("+380671234567", "00380 67 123 4567"):
+            rows = await users_read.find_by_phone(number, self.account, self.db)
+            self.assertEqual([row.name for row in rows], ["U_Phone", "U_National"])
+        rows = await users_read.find_by_phone("+44 20 7123 4567", self.account, self.db)
+        self.assertEqual(rows, [])
+        rows = await users_read.find_by_phone("(67) 123-45-67", self.account, self.db)
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(await users_read.find_by_phone("671234567", self.other_account, self.db), [])
+        self.assertEqual(await users_read.find_by_phone("none", self.account, self.db), [])
+
+    def test_parse_data_filters(self):
+        self.assertEqual(
+            parse_data_filters([("data.b", "2"), ("fields", "name"), ("data.a.c", "1")]),
+            ((("a", "c"), "1"), (("b",), "2")),
+        )
+        with self.assertRaises(ValueError):
+            parse_data_filters([("data.", "1")])
+        with self.assertRaises(ValueError):
+            parse_data_filters([(f"data.k{i}", "1") for i in range(users_read.MAX_DATA_FILTERS + 1)])
+
+    def test_postgres_data_condition_uses_containment(self):
+        condition = data_condition(parse_data_filters([("data.company", "Acme")]), "postgresql")
+        compiled = condition.compile(dialect=postgresql.dialect())
+        self.assertIn("users.additional_data @> %(param_1)s", str(compiled))
+        self.assertEqual(compiled.params["param_1"], {"company": "Acme"})
+
+
+class TestChangeFeed(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        Base.metadata.create_all(bind=self.engine)
+        self.db = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)()
+        self.account = Account(
+            login="test", email="test@gmail.com", password="secret", version_counter=AccountVersion(version=0)
+        )
+        self.db.add(self.account)
+        self.db.commit()
+        self.db.refresh(self.account)
+
+    def tearDown(self):
+        self.db.close()
+        self.engine.dispose()
+
+    async def create(self, name):
+        body = UserModel(name=name, email=f"{name}@gmail.com", phone="123", birthdate=date(1990, 1, 1))
+        return await users_repo.create_user(body, self.account, self.db)
+
+    async def test_changes_since_watermark(self):
+        first = await self.create("first")
+        second = await self.create("second")
+        changes = await users_read.get_changes(since=0, limit=100, account=self.account, db=self.db)
+        self.assertEqual([row.id for row in changes.changed], [first.id, second.id])
+        self.assertEqual(changes.version, 2)
+        self.assertFalse(changes.has_more)
+
+        first_id = first.id
+        await users_repo.remove_user(first_id, self.account, self.db)
+        third = await self.create("third")
+        changes = await users_read.get_changes(since=changes.version, limit=100, account=self.account, db=self.db)
+        self.assertEqual([row.id for row in changes.changed], [third.id])
+        self.assertEqual(changes.deleted, [first_id])
+        self.assertEqual(changes.version, 4)
+
+    async def test_changes_pagination(self):
+        for name in ("a", "b", "c"):
+            await self.create(name)
+        changes = await users_read.get_changes(since=0, limit=2, account=self.account, db=self.db)
+        self.assertEqual([row.name for row in changes.changed], ["a", "b"])
+        self.assertTrue(changes.has_more)
+        changes = await users_read.get_changes(since=changes.version, limit=2, account=self.account, db=self.db)
+        self.assertEqual([row.name for row in changes.changed], ["c"])
+        self.assertFalse(changes.has_more)
+
+    async def test_no_changes(self):
+        changes = await users_read.get_changes(since=0, limit=10, account=self.account, db=self.db)
+        self.assertEqual(changes, users_read.ChangeSet([], [], 0, False))
+
+    async def test_pruned_tombstones_require_resync(self):
+        first = await self.create("first")
+        await self.create("second")
+        await users_repo.remove_user(first.id, self.account, self.db)
+        await self.create("third")
+        pruned = users_repo.prune_tombstones(self.db, datetime.now() + timedelta(minutes=1))
+        self.assertEqual(pruned, 1)
+        self.assertEqual(self.db.scalar(select(func.count(UserTombstone.id))), 0)
+
+        with self.assertRaises(users_read.ResyncRequired) as raised:
+            await users_read.get_changes(since=2, limit=100, account=self.account, db=self.db)
+        self.assertEqual(raised.exception.pruned_version, 3)
+        changes = await users_read.get_changes(since=3, limit=100, account=self.account, db=self.db)
+        self.assertEqual([row.name for row in changes.changed], ["third"])
+        changes = await users_read.get_changes(since=0, limit=100, account=self.account, db=self.db)
+        self.assertEqual([row.name for row in changes.changed], ["second", "third"])
+
+    async def test_version_counter_created_on_first_write(self):
+        account = Account(login="new", email="new@gmail.com", password="secret")
+        self.db.add(account)
+        self.db.commit()
+        self.assertEqual(users_repo.next_version(account.id, self.db), 1)
+        self.assertEqual(users_repo.next_version(account.id, self.db, count=2), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
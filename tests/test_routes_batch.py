@@ -0,0 +1,114 @@
+import asyncio
+import unittest
+from datetime import date
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from main import app
+from src.database.db import get_db
+from src.database.models import Base, User, Account, AccountVersion
+from src.repository import accounts
+from src.services.auth import auth_service
+
+
+class TestBatchRoute(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+
+        # Let pysqlite run real transactions and savepoints, as atomic batches rely on them.
+        @event.listens_for(self.engine, "connect")
+        def connect(dbapi_connection, connection_record):
+            dbapi_connection.isolation_level = None
+
+        @event.listens_for(self.engine, "begin")
+        def begin(conn):
+            conn.exec_driver_sql("BEGIN")
+
+        Base.metadata.create_all(bind=self.engine)
+        self.session_local = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        db = self.session_local()
+        account = Account(
+            login="test", email="test@gmail.com", password="secret", version_counter=AccountVersion(version=0)
+        )
+        db.add(account)
+        db.commit()
+        db.add_all(
+            [User(name=f"U_{i}", email=f"u{i}@gmail.com", phone="123", birthdate=date(2000, 1, 1), account_id=account.id)
+             for i in range(3)]
+        )
+        db.commit()
+        db.refresh(account)
+        db.close()
+
+        self.overrides = dict(app.dependency_overrides)
+        app.dependency_overrides.pop(get_db, None)
+        app.dependency_overrides.pop(auth_service.get_current_user, None)
+        self.session_patch = patch("src.database.db.SessionLocal", self.session_local)
+        self.session_patch.start()
+        self.auth_patch = patch.object(accounts, "get_user_by_email", wraps=accounts.get_user_by_email)
+        self.get_user_by_email = self.auth_patch.start()
+        token = asyncio.run(auth_service.create_access_token(data={"sub": "test@gmail.com"}))
+        self.client = TestClient(app, headers={"Authorization": f"Bearer {token}"})
+
+    def tearDown(self):
+        self.auth_patch.stop()
+        self.session_patch.stop()
+        app.dependency_overrides.clear()
+        app.dependency_overrides.update(self.overrides)
+        self.engine.dispose()
+
+    def user_name(self, user_id):
+        db = self.session_local()
+        try:
+            return db.get(User, user_id).name
+        finally:
+            db.close()
+
+    def test_batch(self):
+        response = self.client.post("/api/batch", json={"operations": [
+            {"method": "GET", "path": "/api/users/1?fields=name"},
+            {"method": "PATCH", "path": "/api/users/2", "headers": {"If-Match": '"0"'}, "body": {"name": "New"}},
+            {"method": "DELETE", "path": "/api/users/99"},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertTrue(data["committed"])
+        self.assertEqual([item["status"] for item in data["responses"]], [200, 200, 404])
+        self.assertEqual(data["responses"][0]["body"], {"id": 1, "name": "U_0", "version": 0})
+        self.assertEqual(data["responses"][1]["headers"]["etag"], '"1"')
+        self.assertEqual(self.user_name(2), "New")
+        self.assertEqual(self.get_user_by_email.call_count, 1)
+
+    def test_atomic_batch_rollback(self):
+        response = self.client.post("/api/batch", json={"atomic": True, "operations": [
+            {"method": "PATCH", "path": "/api/users/1", "body": {"name": "New"}},
+            {"method": "DELETE", "path": "/api/users/99"},
+            {"method": "DELETE", "path": "/api/users/2"},
+        ]})
+        data = response.json()
+        self.assertFalse(data["committed"])
+        self.assertEqual([item["status"] for item in data["responses"]], [200, 404, 424])
+        self.assertEqual(self.user_name(1), "U_0")
+        self.assertEqual(self.user_name(2), "U_1")
+
+    def test_atomic_batch_commit(self):
+        response = self.client.post("/api/batch", json={"atomic": True, "operations": [
+            {"method": "PATCH", "path": "/api/users/1", "body": {"name": "New"}},
+            {"method": "GET", "path": "/api/users/1"},
+        ]})
+        data = response.json()
+        self.assertTrue(data["committed"])
+        self.assertEqual(data["responses"][1]["body"]["name"], "New")
+        self.assertEqual(self.user_name(1), "New")
+
+    def test_excluded_path(self):
+        response = self.client.post("/api/batch", json={"operations": [{"method": "GET", "path": "/api/users/events"}]})
+        self.assertEqual(response.status_code, 422)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+import os
+import unittest
+from unittest.mock import patch
+
+from src import server
+from src.conf.config import Settings, settings
+
+
+class TestSettings(unittest.TestCase):
+    def test_fixed_pools(self):
+        config = Settings(server_workers=4)
+        self.assertEqual(config.worker_count, 4)
+        self.assertEqual(config.db_pool_options(), {"pool_size": 5, "max_overflow": 10})
+        self.assertIsNone(config.redis_max_connections())
+
+    def test_budgets_split_between_workers(self):
+        config = Settings(server_workers=4, db_connection_budget=50, redis_connection_budget=3)
+        self.assertEqual(config.db_pool_options(), {"pool_size": 12, "max_overflow": 0})
+        # One for the events subscription, one for the requests.
+        self.assertEqual(config.redis_max_connections(), 2)
+        self.assertEqual(Settings(server_workers=4, redis_connection_budget=40).redis_max_connections(), 10)
+
+    def test_one_worker_per_cpu(self):
+        with patch("src.conf.config.os.cpu_count", return_value=6):
+            self.assertEqual(Settings(server_workers=0).worker_count, 6)
+
+
+class TestRun(unittest.TestCase):
+    def test_run(self):
+        with patch.object(server.uvicorn, "run") as run, patch.dict(os.environ), \
+                patch.object(settings, "server_workers", 3), patch.object(server, "_installed", return_value=False):
+            server.run()
+            self.assertEqual(os.environ[server.WORKERS_ENV], "3")
+        run.assert_called_once_with(
+            "main:app", host=settings.server_host, port=settings.server_port, workers=3, loop="asyncio",
+            http="h11", timeout_graceful_shutdown=settings.server_graceful_timeout,
+        )
@@ -0,0 +1,63 @@
+import asyncio
+import unittest
+
+from src.services.coalescing import SingleFlight
+from src.services.metrics import metrics
+
+
+class TestSingleFlight(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_calls_share_result(self):
+        flight = SingleFlight("test_share")
+        calls = 0
+
+        async def query():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.02)
+            return [calls]
+
+        results = await asyncio.gather(*[flight.do(("users", 1), query) for _ in range(5)])
+        self.assertEqual(calls, 1)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(metrics.value("coalesced_reads_total", flight="test_share"), 4)
+        self.assertEqual(flight.in_flight(), 0)
+
+        await flight.do(("users", 1), query)
+        self.assertEqual(calls, 2)
+
+    async def test_different_keys(self):
+        flight = SingleFlight("test_keys")
+
+        async def query():
+            await asyncio.sleep(0.01)
+            return object()
+
+        first, second = await asyncio.gather(flight.do(("users", 1), query), flight.do(("users", 2), query))
+        self.assertIsNot(first, second)
+
+    async def test_errors_are_shared(self):
+        flight = SingleFlight("test_errors")
+
+        async def query():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        results = await asyncio.gather(*[flight.do("key", query) for _ in range(3)], return_exceptions=True)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+    async def test_cancelled_caller_does_not_cancel_query(self):
+        flight = SingleFlight("test_cancel")
+
+        async def query():
+            await asyncio.sleep(0.02)
+            return "rows"
+
+        first = asyncio.ensure_future(flight.do("key", query))
+        second = asyncio.ensure_future(flight.do("key", query))
+        await asyncio.sleep(0)
+        first.cancel()
+        self.assertEqual(await second, "rows")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import gzip
+import unittest
+
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.testclient import TestClient
+
+from src.services.compression import CompressionMiddleware, ENCODERS, negotiate_encoding
+
+
+class TestNegotiateEncoding(unittest.TestCase):
+    def test_gzip(self):
+        self.assertEqual(negotiate_encoding("gzip, deflate"), "gzip")
+
+    def test_weights(self):
+        self.assertEqual(negotiate_encoding("br;q=0.1, gzip;q=0.9"), "gzip")
+        self.assertIsNone(negotiate_encoding("gzip;q=0"))
+
+    def test_unsupported(self):
+        self.assertIsNone(negotiate_encoding("identity"))
+        self.assertIsNone(negotiate_encoding(""))
+
+    @unittest.skipUnless("br" in ENCODERS, "brotli is not installed")
+    def test_prefers_brotli(self):
+        self.assertEqual(negotiate_encoding("gzip, br"), "br")
+
+
+class TestCompressionMiddleware(unittest.TestCase):
+    def setUp(self):
+        app = FastAPI()
+        app.add_middleware(CompressionMiddleware, minimum_size=500, route_levels={"/large": 1})
+
+        @app.get("/small")
+        def small():
+            return PlainTextResponse("x" * 10)
+
+        @app.api_route("/large", methods=["GET", "HEAD"])
+        def large():
+            return PlainTextResponse("x" * 5000)
+
+        @app.get("/varied")
+        def varied():
+            return PlainTextResponse("x" * 5000, headers={"Vary": "Origin"})
+
+        @app.get("/not-modified")
+        def not_modified():
+            return StreamingResponse(iter([b""]), status_code=304, media_type="text/plain")
+
+        @app.get("/stream")
+        def stream():
+            return StreamingResponse((f"line {i}\n" for i in range(100)), media_type="text/plain")
+
+        self.client = TestClient(app)
+
+    def test_small_body_not_compressed(self):
+        response = self.client.get("/small", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("content-encoding", response.headers)
+        self.assertEqual(response.text, "x" * 10)
+
+    def test_large_body_compressed(self):
+        response = self.client.get("/large", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["content-encoding"], "gzip")
+        self.assertEqual(response.headers["vary"], "Accept-Encoding")
+        self.assertLess(int(response.headers["content-length"]), 5000)
+        self.assertEqual(response.text, "x" * 5000)
+
+    def test_head_not_compressed(self):
+        response = self.client.head("/large", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("content-encoding", response.headers)
+        self.assertEqual(response.headers["content-length"], "5000")
+
+    def test_bodyless_status_not_compressed(self):
+        response = self.client.get("/not-modified", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.status_code, 304)
+        self.assertNotIn("content-encoding", response.headers)
+
+    def test_vary_merged(self):
+        response = self.client.get("/varied", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers.get_list("vary"), ["Origin, Accept-Encoding"])
+
+    def test_no_accept_encoding(self):
+        response = self.client.get("/large", headers={"Accept-Encoding": "identity"})
+        self.assertNotIn("content-encoding", response.headers)
+
+    def test_streaming_body_compressed(self):
+        with self.client.stream("GET", "/stream", headers={"Accept-Encoding": "gzip"}) as response:
+            raw = b"".join(response.iter_raw())
+        self.assertEqual(response.headers["content-encoding"], "gzip")
+        self.assertNotIn("content-length", response.headers)
+        self.assertEqual(gzip.decompress(raw).decode(), "".join(f"line {i}\n" for i in range(100)))
+
+
+if __name__ == "__main__":
+    unittest.main()
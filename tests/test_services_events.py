@@ -0,0 +1,101 @@
+import asyncio
+import unittest
+from unittest.mock import MagicMock, patch
+
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from src.services import events
+from src.services.events import ContactEventBus, RESYNC, format_event
+
+
+class FakePubSub:
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.channels = {}
+        self.pending_unsubscribe_channels = set()
+        self.messages = asyncio.Queue()
+
+    @property
+    def subscribed(self):
+        return bool(self.channels)
+
+    async def subscribe(self, *channels):
+        if self.failures:
+            self.failures -= 1
+            raise RedisConnectionError("refused")
+        self.channels.update(dict.fromkeys(channels))
+
+    async def unsubscribe(self, *channels):
+        for channel in channels:
+            self.channels.pop(channel, None)
+
+    async def listen(self):
+        while self.subscribed:
+            yield await self.messages.get()
+
+    async def aclose(self):
+        pass
+
+
+class TestContactEventBus(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.bus = ContactEventBus(buffer_size=2)
+
+    async def test_publish_to_account_subscribers(self):
+        message = format_event("created", {"id": 1}, 5)
+        with self.bus.subscribe(1) as queue, self.bus.subscribe(2) as other:
+            await self.bus.publish(1, message)
+            self.assertEqual(queue.get_nowait(), message)
+            self.assertTrue(other.empty())
+
+    async def test_unsubscribe(self):
+        with self.bus.subscribe(1):
+            pass
+        await self.bus.publish(1, format_event("created", {"id": 1}))
+        self.assertNotIn(1, self.bus._subscribers)
+
+    async def test_overflow_requests_resync(self):
+        with self.bus.subscribe(1) as queue:
+            for version in range(3):
+                await self.bus.publish(1, format_event("updated", {"id": 1}, version))
+            self.assertEqual(queue.qsize(), 1)
+            self.assertEqual(queue.get_nowait(), RESYNC)
+
+    async def start(self, pubsub: FakePubSub):
+        redis = MagicMock()
+        redis.pubsub.return_value = pubsub
+        await self.bus.start(redis)
+        self.addAsyncCleanup(self.bus.stop)
+
+    async def wait_for_channels(self, pubsub: FakePubSub, channels):
+        for _ in range(100):
+            if set(pubsub.channels) == set(channels):
+                return
+            await asyncio.sleep(0)
+        self.fail(f"Subscribed to {set(pubsub.channels)}, expected {set(channels)}")
+
+    async def test_subscribes_to_accounts_with_local_clients(self):
+        pubsub = FakePubSub()
+        await self.start(pubsub)
+        await self.wait_for_channels(pubsub, [])
+        message = format_event("created", {"id": 1}, 5)
+        with self.bus.subscribe(1) as queue:
+            with self.bus.subscribe(1), self.bus.subscribe(2):
+                await self.wait_for_channels(pubsub, ["contacts:1", "contacts:2"])
+            await self.wait_for_channels(pubsub, ["contacts:1"])
+            await pubsub.messages.put({"type": "message", "channel": b"contacts:1", "data": message})
+            self.assertEqual(await asyncio.wait_for(queue.get(), 1), message)
+        await self.wait_for_channels(pubsub, [])
+
+    async def test_subscribes_once_redis_is_back(self):
+        pubsub = FakePubSub(failures=2)
+        with patch.object(events, "RECONNECT_DELAY", 0), self.bus.subscribe(1):
+            await self.start(pubsub)
+            await self.wait_for_channels(pubsub, ["contacts:1"])
+
+    def test_format_event(self):
+        self.assertEqual(format_event("deleted", {"id": 3}, 7), b'id: 7\nevent: deleted\ndata: {"id":3}\n\n')
+
+
+if __name__ == "__main__":
+    unittest.main()
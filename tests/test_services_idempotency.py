@@ -0,0 +1,96 @@
+import asyncio
+import unittest
+
+import httpx
+from fastapi import FastAPI, HTTPException, Request
+
+from src.services.auth import auth_service
+from src.services.idempotency import IdempotencyMiddleware, IdempotencyStore
+
+
+class TestIdempotencyMiddleware(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.calls = 0
+        self.store = IdempotencyStore(ttl=60, lock_ttl=5, wait=1, poll_interval=0.01)
+        app = FastAPI()
+
+        @app.post("/items")
+        async def create_item(request: Request):
+            self.calls += 1
+            await asyncio.sleep(0.05)
+            body = await request.json()
+            if body.get("fail"):
+                raise RuntimeError("boom")
+            if body.get("limited") and self.calls == 1:
+                raise HTTPException(status_code=429, detail="Too Many Requests")
+            if body.get("invalid"):
+                raise HTTPException(status_code=400, detail="Invalid")
+            return {"id": self.calls, **body}
+
+        app.add_middleware(IdempotencyMiddleware, store=self.store, routes=[("POST", "/items")])
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+
+    async def test_replay(self):
+        first = await self.client.post("/items", json={"name": "a"}, headers={"Idempotency-Key": "k1"})
+        second = await self.client.post("/items", json={"name": "a"}, headers={"Idempotency-Key": "k1"})
+        self.assertEqual(first.json(), {"id": 1, "name": "a"})
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second.headers["idempotent-replayed"], "true")
+        self.assertEqual(self.calls, 1)
+
+    async def test_concurrent_duplicates_wait(self):
+        responses = await asyncio.gather(*[
+            self.client.post("/items", json={"name": "a"}, headers={"Idempotency-Key": "k2"}) for _ in range(3)
+        ])
+        self.assertEqual({response.json()["id"] for response in responses}, {1})
+        self.assertEqual(self.calls, 1)
+
+    async def test_other_body(self):
+        await self.client.post("/items", json={"name": "a"}, headers={"Idempotency-Key": "k3"})
+        response = await self.client.post("/items", json={"name": "b"}, headers={"Idempotency-Key": "k3"})
+        self.assertEqual(response.status_code, 422)
+
+    async def test_without_key(self):
+        await self.client.post("/items", json={"name": "a"})
+        await self.client.post("/items", json={"name": "a"})
+        self.assertEqual(self.calls, 2)
+
+    async def test_scoped_by_account(self):
+        first_token = await auth_service.create_access_token(data={"sub": "a@gmail.com"})
+        refreshed_token = await auth_service.create_access_token(data={"sub": "a@gmail.com"}, expires_delta=600)
+        other_token = await auth_service.create_access_token(data={"sub": "b@gmail.com"})
+        for token in (first_token, refreshed_token, other_token):
+            await self.client.post("/items", json={"name": "a"}, headers={
+                "Idempotency-Key": "k5", "Authorization": f"Bearer {token}",
+            })
+        self.assertEqual(self.calls, 2)
+
+    async def test_errors_are_not_stored(self):
+        with self.assertRaises(RuntimeError):
+            await self.client.post("/items", json={"fail": True}, headers={"Idempotency-Key": "k4"})
+        with self.assertRaises(RuntimeError):
+            await self.client.post("/items", json={"fail": True}, headers={"Idempotency-Key": "k4"})
+        self.assertEqual(self.calls, 2)
+
+
+    async def test_transient_client_errors_are_not_stored(self):
+        first = await self.client.post("/items", json={"limited": True}, headers={"Idempotency-Key": "k6"})
+        second = await self.client.post("/items", json={"limited": True}, headers={"Idempotency-Key": "k6"})
+        self.assertEqual(first.status_code, 429)
+        self.assertEqual(second.status_code, 200)
+        self.assertNotIn("idempotent-replayed", second.headers)
+        self.assertEqual(self.calls, 2)
+
+    async def test_client_errors_are_stored(self):
+        await self.client.post("/items", json={"invalid": True}, headers={"Idempotency-Key": "k7"})
+        second = await self.client.post("/items", json={"invalid": True}, headers={"Idempotency-Key": "k7"})
+        self.assertEqual(second.status_code, 400)
+        self.assertEqual(second.headers["idempotent-replayed"], "true")
+        self.assertEqual(self.calls, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
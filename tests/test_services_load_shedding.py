@@ -0,0 +1,74 @@
+import asyncio
+import time
+import unittest
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src.services.load_shedding import LoadSheddingMiddleware, LoopLagMonitor
+from src.services.metrics import metrics
+
+
+class TestLoopLagMonitor(unittest.IsolatedAsyncioTestCase):
+    async def test_measures_blocked_loop(self):
+        monitor = LoopLagMonitor(interval=0.01)
+        await monitor.start()
+        await asyncio.sleep(0.03)
+        time.sleep(0.1)
+        await asyncio.sleep(0.02)
+        await monitor.stop()
+        self.assertGreaterEqual(monitor.lag, 0.05)
+        self.assertEqual(metrics.value("event_loop_lag_seconds"), monitor.lag)
+        self.assertIn("# TYPE event_loop_lag_seconds gauge", metrics.render())
+
+    def test_lag_decays_smoothly(self):
+        monitor = LoopLagMonitor(smoothing=0.5)
+        monitor.record(1.0)
+        monitor.record(0.0)
+        self.assertEqual(monitor.lag, 0.5)
+        monitor.record(2.0)
+        self.assertEqual(monitor.lag, 2.0)
+
+
+class TestLoadSheddingMiddleware(unittest.TestCase):
+    def setUp(self):
+        self.monitor = LoopLagMonitor()
+        app = FastAPI()
+        app.add_middleware(
+            LoadSheddingMiddleware, monitor=self.monitor, max_lag=0.2, max_in_flight=10,
+            low_priority=[("GET", "/list")], critical=["/refresh"], hard_factor=2.0, retry_after=7,
+        )
+
+        for path in ("/list", "/item", "/refresh"):
+            app.get(path)(lambda: {"ok": True})
+
+        self.client = TestClient(app)
+
+    def statuses(self):
+        return {path: self.client.get(path).status_code for path in ("/list", "/item", "/refresh")}
+
+    def test_not_overloaded(self):
+        self.monitor.lag = 0.1
+        self.assertEqual(self.statuses(), {"/list": 200, "/item": 200, "/refresh": 200})
+
+    def test_sheds_low_priority_first(self):
+        self.monitor.lag = 0.3
+        shed = metrics.value("shed_requests_total", priority="low")
+        self.assertEqual(self.statuses(), {"/list": 503, "/item": 200, "/refresh": 200})
+        response = self.client.get("/list")
+        self.assertEqual(response.headers["retry-after"], "7")
+        self.assertEqual(response.json(), {"detail": "Server is overloaded, retry shortly"})
+        self.assertEqual(metrics.value("shed_requests_total", priority="low"), shed + 2)
+
+    def test_keeps_critical_requests(self):
+        self.monitor.lag = 1.0
+        self.assertEqual(self.statuses(), {"/list": 503, "/item": 503, "/refresh": 200})
+
+    def test_requests_in_flight(self):
+        self.client.get("/item")
+        self.assertEqual(metrics.value("requests_in_flight"), 0)
+        middleware = self.client.app.middleware_stack
+        while not isinstance(middleware, LoadSheddingMiddleware):
+            middleware = middleware.app
+        middleware.in_flight = 15
+        self.assertEqual(self.statuses(), {"/list": 503, "/item": 200, "/refresh": 200})
@@ -0,0 +1,129 @@
+import io
+import logging
+import threading
+import time
+import unittest
+
+import orjson
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src.services.logs import DebugSampler, LogPipeline, RequestIdMiddleware, request_id
+from src.services.metrics import metrics
+
+
+logger = logging.getLogger("tests.logging")
+
+
+class TestLogPipeline(unittest.TestCase):
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.pipeline = LogPipeline("DEBUG", stream=self.stream)
+        self.level = logging.getLogger().level
+        self.pipeline.start()
+
+    def tearDown(self):
+        self.pipeline.stop()
+        logging.getLogger().setLevel(self.level)
+
+    def lines(self):
+        self.pipeline.stop()
+        return [orjson.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_json_lines(self):
+        token = request_id.set("abc")
+        try:
+            logger.warning("Contact %s not found", 7, extra={"contact_id": 7})
+        finally:
+            request_id.reset(token)
+        try:
+            raise ValueError("bad input")
+        except ValueError:
+            logger.exception("Failed")
+
+        warning, error = self.lines()
+        self.assertEqual(warning["level"], "WARNING")
+        self.assertEqual(warning["logger"], "tests.logging")
+        self.assertEqual(warning["message"], "Contact 7 not found")
+        self.assertEqual(warning["request_id"], "abc")
+        self.assertEqual(warning["contact_id"], 7)
+        self.assertNotIn("request_id", error)
+        self.assertIn("ValueError: bad input", error["exception"])
+
+    def test_renders_message_when_logged(self):
+        contact = {"name": "Ann"}
+        logger.info("Contact %s", contact)
+        contact["name"] = "Bob"
+        self.assertEqual(self.lines()[0]["message"], "Contact {'name': 'Ann'}")
+
+    def test_writes_on_another_thread(self):
+        threads = []
+
+        class Recorder(logging.Handler):
+            def emit(self, record):
+                threads.append(threading.current_thread())
+
+        recorder = Recorder()
+        self.pipeline._listener.handlers += (recorder,)
+        logger.info("Started")
+        self.lines()
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.current_thread())
+
+    def test_drops_records_when_queue_full(self):
+        writing, release = threading.Event(), threading.Event()
+
+        class SlowStream(io.StringIO):
+            def write(self, text):
+                writing.set()
+                release.wait()
+                return super().write(text)
+
+        self.pipeline.stop()
+        self.pipeline = LogPipeline("INFO", queue_size=1, stream=SlowStream())
+        self.pipeline.start()
+        logger.info("Written")
+        writing.wait(1)
+        dropped = metrics.value("log_records_dropped_total")
+        started = time.perf_counter()
+        for _ in range(3):
+            logger.info("Flood")
+        self.assertLess(time.perf_counter() - started, 0.1)
+        self.assertEqual(metrics.value("log_records_dropped_total"), dropped + 2)
+        release.set()
+
+
+class TestDebugSampler(unittest.TestCase):
+    def record(self, level, current):
+        record = logging.LogRecord("tests", level, __file__, 1, "message", (), None)
+        record.request_id = current
+        return record
+
+    def test_samples_debug_by_request(self):
+        sampler = DebugSampler(0.5)
+        kept = [str(i) for i in range(200) if sampler.filter(self.record(logging.DEBUG, str(i)))]
+        self.assertTrue(50 < len(kept) < 150)
+        self.assertTrue(all(sampler.filter(self.record(logging.DEBUG, current)) for current in kept))
+        self.assertTrue(all(sampler.filter(self.record(logging.INFO, str(i))) for i in range(200)))
+        self.assertFalse(DebugSampler(0).filter(self.record(logging.DEBUG, "1")))
+
+
+class TestRequestIdMiddleware(unittest.TestCase):
+    def setUp(self):
+        app = FastAPI()
+        app.add_middleware(RequestIdMiddleware)
+        app.get("/id")(lambda: {"request_id": request_id.get()})
+        self.client = TestClient(app)
+
+    def test_generates_id(self):
+        response = self.client.get("/id")
+        self.assertEqual(len(response.headers["x-request-id"]), 32)
+        self.assertEqual(response.json(), {"request_id": response.headers["x-request-id"]})
+
+    def test_keeps_valid_id(self):
+        response = self.client.get("/id", headers={"X-Request-ID": "edge-42"})
+        self.assertEqual(response.headers["x-request-id"], "edge-42")
+        self.assertEqual(response.json(), {"request_id": "edge-42"})
+
+        response = self.client.get("/id", headers={"X-Request-ID": "bad id\n"})
+        self.assertNotEqual(response.headers["x-request-id"], "bad id\n")
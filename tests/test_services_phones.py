@@ -0,0 +1,39 @@
+import unittest
+from unittest.mock import patch
+
+from src.services import phones
+from src.services.phones import to_e164, phone_suffix, phone_keys, has_country_code
+
+
+class TestPhones(unittest.TestCase):
+    def test_international_numbers(self):
+        self.assertEqual(to_e164("+380 (67) 123-45-67", ""), "+380671234567")
+        self.assertEqual(to_e164("00380671234567", ""), "+380671234567")
+        self.assertEqual(to_e164("+1 (415) 555-2671 ext. 12", ""), "+14155552671")
+
+    def test_national_numbers(self):
+        self.assertEqual(to_e164("067 123 45 67", "380"), "+380671234567")
+        self.assertEqual(to_e164("67 123 45 67", "380"), "+380671234567")
+        self.assertEqual(to_e164("380671234567", "380"), "+380671234567")
+        self.assertIsNone(to_e164("067 123 45 67", ""))
+
+    def test_invalid_numbers(self):
+        self.assertIsNone(to_e164("123", "380"))
+        self.assertIsNone(to_e164("+1234567890123456", ""))
+        self.assertIsNone(to_e164("", "380"))
+        self.assertIsNone(to_e164(None, "380"))
+
+    def test_suffix(self):
+        self.assertEqual(phone_suffix("+380 (67) 123-45-67"), "671234567")
+        self.assertEqual(phone_suffix("067 123 45 67"), "671234567")
+        self.assertEqual(phone_suffix("12-3"), "123")
+        self.assertIsNone(phone_suffix("n/a"))
+
+    def test_phone_keys_use_the_default_country(self):
+        with patch.object(phones.settings, "phone_country_code", "380"):
+            self.assertEqual(phone_keys("067 123 45 67"), ("+380671234567", "671234567"))
+
+    def test_has_country_code(self):
+        self.assertTrue(has_country_code(" +380671234567"))
+        self.assertTrue(has_country_code("00 380 67 123 45 67"))
+        self.assertFalse(has_country_code("0671234567"))
@@ -0,0 +1,103 @@
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from src.conf.config import settings
+from src.services.profiler import ProfilerMiddleware, ProfileRateLimiter, sign_profile_request, verify_profile_token
+
+
+class TestProfilerTokens(unittest.TestCase):
+    def test_valid_token(self):
+        token = sign_profile_request("GET", "/api/users/", int(time.time()) + 60)
+        self.assertTrue(verify_profile_token(token, "GET", "/api/users/"))
+
+    def test_token_bound_to_route(self):
+        token = sign_profile_request("GET", "/api/users/", int(time.time()) + 60)
+        self.assertFalse(verify_profile_token(token, "GET", "/api/profile/my_profile"))
+        self.assertFalse(verify_profile_token(token, "DELETE", "/api/users/"))
+
+    def test_expired_token(self):
+        token = sign_profile_request("GET", "/api/users/", int(time.time()) - 1)
+        self.assertFalse(verify_profile_token(token, "GET", "/api/users/"))
+
+    def test_malformed_token(self):
+        self.assertFalse(verify_profile_token("garbage", "GET", "/api/users/"))
+
+
+class TestProfileRateLimiter(unittest.TestCase):
+    def test_limit(self):
+        limiter = ProfileRateLimiter(max_profiles=2)
+        self.assertTrue(limiter.acquire())
+        self.assertTrue(limiter.acquire())
+        self.assertFalse(limiter.acquire())
+
+    def test_window_expires(self):
+        limiter = ProfileRateLimiter(max_profiles=1, window=0.0)
+        self.assertTrue(limiter.acquire())
+        time.sleep(0.001)
+        self.assertTrue(limiter.acquire())
+
+
+class TestProfilerMiddleware(unittest.TestCase):
+    def setUp(self):
+        app = FastAPI()
+        app.add_middleware(ProfilerMiddleware)
+        app.get("/item")(lambda: {"ok": True})
+
+        @app.get("/events")
+        def events():
+            return StreamingResponse(iter([b"data: 1\n\n", b"data: 2\n\n"]), media_type="text/event-stream")
+
+        self.client = TestClient(app)
+        self.directory = tempfile.TemporaryDirectory()
+        self.output_patch = patch.object(settings, "profiler_output_dir", self.directory.name)
+        self.output_patch.start()
+
+    def tearDown(self):
+        self.output_patch.stop()
+        self.directory.cleanup()
+
+    def token(self, path):
+        return sign_profile_request("GET", path, int(time.time()) + 60)
+
+    def profiles(self):
+        return list(Path(self.directory.name).iterdir())
+
+    def test_untriggered_request(self):
+        response = self.client.get("/item")
+        self.assertEqual(response.json(), {"ok": True})
+        self.assertNotIn("x-profile-file", response.headers)
+        self.assertEqual(self.profiles(), [])
+
+    def test_invalid_token(self):
+        response = self.client.get("/item", headers={"X-Profile": self.token("/other")})
+        self.assertEqual(response.json(), {"ok": True})
+        self.assertNotIn("x-profile-file", response.headers)
+        self.assertEqual(self.profiles(), [])
+
+    def test_valid_token_writes_profile(self):
+        response = self.client.get("/item", headers={"X-Profile": self.token("/item")})
+        self.assertEqual(response.json(), {"ok": True})
+        self.assertEqual([path.name for path in self.profiles()], [response.headers["x-profile-file"]])
+
+    def test_valid_token_returns_profile(self):
+        with patch.object(settings, "profiler_output_dir", None):
+            response = self.client.get(f"/item?profile={self.token('/item')}")
+        self.assertIn("speedscope", response.headers["content-disposition"])
+        self.assertIn("profiles", response.json())
+
+    def test_event_stream_not_profiled(self):
+        response = self.client.get("/events", headers={"X-Profile": self.token("/events")})
+        self.assertEqual(response.text, "data: 1\n\ndata: 2\n\n")
+        self.assertNotIn("x-profile-file", response.headers)
+        self.assertEqual(self.profiles(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,159 @@
+import asyncio
+import unittest
+from datetime import date
+from unittest.mock import patch
+
+from fastapi import FastAPI, Request, Response
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from main import app
+from src.database.db import get_db
+from src.database.models import Base, User, Account, AccountVersion
+from src.repository import users as users_repo
+from src.repository import users_read
+from src.schemas import UserUpdate
+from src.services.auth import auth_service
+from src.services.resilience import FailOpenRateLimiter
+from src.services.query_tracer import (
+    assert_max_queries,
+    assert_query_budget,
+    query_tracing_middleware,
+)
+
+
+class TestQueryBudgets(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        Base.metadata.create_all(bind=self.engine)
+        self.db = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)()
+        self.account = Account(
+            login="test", email="test@gmail.com", password="secret", version_counter=AccountVersion(version=0)
+        )
+        self.db.add(self.account)
+        self.db.commit()
+        self.db.add_all(
+            [User(name=f"U_{i}", phone="123", birthdate=date(2000, 1, 1), account_id=self.account.id) for i in range(10)]
+        )
+        self.db.commit()
+        self.db.refresh(self.account)
+
+    def tearDown(self):
+        self.db.close()
+        self.engine.dispose()
+
+    async def test_get_users_budget(self):
+        with assert_max_queries(1):
+            result = await users_read.get_users(0, 100, self.account, self.db)
+        self.assertEqual(len(result), 10)
+
+    async def test_update_user_budget(self):
+        body = UserUpdate(name="New", email="new@gmail.com", phone="1", birthdate=date(2000, 1, 1))
+        with assert_max_queries(2):
+            await users_repo.update_user(1, body, self.account, self.db)
+
+    async def test_remove_user_budget(self):
+        with assert_max_queries(3):
+            await users_repo.remove_user(1, self.account, self.db)
+
+    def test_budget_exceeded(self):
+        with self.assertRaises(AssertionError):
+            with assert_max_queries(1) as stats:
+                with self.engine.connect() as conn:
+                    conn.execute(text("SELECT 1"))
+                    conn.execute(text("SELECT 2"))
+        self.assertEqual(stats.count, 2)
+
+    def test_failed_statement(self):
+        with assert_max_queries(2) as stats:
+            with self.engine.connect() as conn:
+                with self.assertRaises(OperationalError):
+                    conn.execute(text("SELECT * FROM missing"))
+                self.assertEqual(conn.info["query_start_time"], [])
+                conn.execute(text("SELECT 1"))
+        self.assertEqual(stats.count, 2)
+
+
+class TestQueryTracingMiddleware(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        app = FastAPI()
+        app.middleware("http")(query_tracing_middleware)
+
+        @app.get("/three")
+        def three():
+            with self.engine.connect() as conn:
+                for _ in range(3):
+                    conn.execute(text("SELECT 1"))
+            return {}
+
+        self.client = TestClient(app)
+
+    def test_server_timing_header(self):
+        response = self.client.get("/three")
+        self.assertIn('desc="3 queries"', response.headers["Server-Timing"])
+        assert_query_budget(response, 3)
+        with self.assertRaises(AssertionError):
+            assert_query_budget(response, 2)
+
+
+async def _no_rate_limit(self, request: Request, response: Response):
+    return None
+
+
+class TestRouteQueryBudgets(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        Base.metadata.create_all(bind=self.engine)
+        session_local = sessionmaker(autocommit=False, autoflush=False, bind=self.engine, expire_on_commit=False)
+        db = session_local()
+        account = Account(
+            login="test", email="test@gmail.com", password="secret", version_counter=AccountVersion(version=0)
+        )
+        db.add(account)
+        db.commit()
+        db.add_all(
+            [User(name=f"U_{i}", email=f"u{i}@gmail.com", phone="123", birthdate=date(2000, 1, 1), account_id=account.id)
+             for i in range(20)]
+        )
+        db.commit()
+        db.close()
+
+        self.overrides = dict(app.dependency_overrides)
+        app.dependency_overrides.pop(get_db, None)
+        app.dependency_overrides.pop(auth_service.get_current_user, None)
+        self.session_patch = patch("src.database.db.SessionLocal", session_local)
+        self.session_patch.start()
+        self.limiter_patch = patch.object(FailOpenRateLimiter, "__call__", _no_rate_limit)
+        self.limiter_patch.start()
+        token = asyncio.run(auth_service.create_access_token(data={"sub": "test@gmail.com"}))
+        self.client = TestClient(app, headers={"Authorization": f"Bearer {token}"})
+
+    def tearDown(self):
+        self.limiter_patch.stop()
+        self.session_patch.stop()
+        app.dependency_overrides.clear()
+        app.dependency_overrides.update(self.overrides)
+        self.engine.dispose()
+
+    def test_list_users(self):
+        response = self.client.get("/api/users/?limit=20")
+        self.assertEqual(len(response.json()), 20)
+        assert_query_budget(response, 2)
+
+    def test_get_user(self):
+        response = self.client.get("/api/users/3")
+        self.assertEqual(response.json()["name"], "U_2")
+        assert_query_budget(response, 2)
+
+    def test_patch_user(self):
+        response = self.client.patch("/api/users/3", json={"name": "New"}, headers={"If-Match": '"0"'})
+        self.assertEqual(response.json()["name"], "New")
+        assert_query_budget(response, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import AsyncMock, patch
+
+import httpx
+from fastapi import Depends, FastAPI
+from fastapi_limiter import FastAPILimiter, default_identifier, http_default_callback
+from redis.exceptions import ConnectionError as RedisConnectionError, ResponseError
+
+from src.services import resilience
+from src.services.metrics import metrics
+from src.services.resilience import (
+    CircuitBreaker, Dependency, DependencyUnavailable, FailOpenRateLimiter, CLOSED, HALF_OPEN, OPEN,
+)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.breaker = CircuitBreaker("test_breaker", failure_threshold=2, reset_timeout=10, clock=lambda: self.now)
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.failure()
+        self.breaker.success()
+        self.breaker.failure()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.breaker.failure()
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(metrics.value("circuit_state", dependency="test_breaker"), 2)
+
+    def test_half_open_probe(self):
+        self.breaker.failure()
+        self.breaker.failure()
+        self.now = 10
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.breaker.failure()
+        self.assertEqual(self.breaker.state, OPEN)
+
+        self.now = 20
+        self.assertTrue(self.breaker.allow())
+        self.breaker.success()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertTrue(self.breaker.allow())
+        self.assertTrue(self.breaker.allow())
+
+
+class TestDependency(unittest.IsolatedAsyncioTestCase):
+    def dependency(self, name, **options):
+        return Dependency(name, **{"timeout": 0.05, "max_concurrent": 2, "failure_threshold": 2,
+                                   "reset_timeout": 60, **options})
+
+    async def test_timeout(self):
+        dependency = self.dependency("test_timeout")
+        with self.assertRaisesRegex(DependencyUnavailable, "no answer within 0.05s"):
+            await dependency.call(asyncio.sleep, 1)
+        self.assertEqual(metrics.value("dependency_calls_total", dependency="test_timeout", outcome="timeout"), 1)
+        self.assertEqual(dependency.in_flight, 0)
+
+    async def test_failures_open_the_circuit(self):
+        dependency = self.dependency("test_failures", failures=(ConnectionError,))
+        failing = AsyncMock(side_effect=ConnectionError("refused"))
+        for _ in range(2):
+            with self.assertRaises(DependencyUnavailable) as raised:
+                await dependency.call(failing)
+            self.assertIsInstance(raised.exception.__cause__, ConnectionError)
+        with self.assertRaisesRegex(DependencyUnavailable, "circuit open"):
+            await dependency.call(failing)
+        self.assertEqual(failing.await_count, 2)
+
+    async def test_other_errors_propagate(self):
+        dependency = self.dependency("test_errors", failures=(ConnectionError,))
+        with self.assertRaises(ValueError):
+            await dependency.call(AsyncMock(side_effect=ValueError("bad input")))
+        self.assertEqual(dependency.breaker.failures, 0)
+
+    async def test_bulkhead(self):
+        dependency = self.dependency("test_bulkhead", timeout=1)
+        slow = [asyncio.create_task(dependency.call(asyncio.sleep, 0.05)) for _ in range(2)]
+        await asyncio.sleep(0)
+        with self.assertRaisesRegex(DependencyUnavailable, "bulkhead full"):
+            await dependency.call(asyncio.sleep, 0)
+        await asyncio.gather(*slow)
+
+        waiting = self.dependency("test_bulkhead_wait", timeout=1, max_wait=1)
+        slow = [asyncio.create_task(waiting.call(asyncio.sleep, 0.05)) for _ in range(2)]
+        await asyncio.sleep(0)
+        self.assertEqual(await waiting.call(AsyncMock(return_value="sent")), "sent")
+        await asyncio.gather(*slow)
+
+    async def test_blocking_call_keeps_the_loop_free(self):
+        dependency = self.dependency("test_sync")
+        started = time.perf_counter()
+        ticks = asyncio.create_task(asyncio.sleep(0.01))
+        with self.assertRaises(DependencyUnavailable):
+            await dependency.call_sync(time.sleep, 0.2)
+        self.assertTrue(ticks.done())
+        self.assertLess(time.perf_counter() - started, 0.15)
+        self.assertEqual(await dependency.call_sync(sum, [1, 2]), 3)
+
+
+class TestFailOpenRateLimiter(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        app = FastAPI()
+
+        @app.get("/limited", dependencies=[Depends(FailOpenRateLimiter(times=1, seconds=60))])
+        async def limited():
+            return {}
+
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+        self.redis = AsyncMock()
+        dependency = Dependency("test_limiter", 0.1, 10, 5, 60, failures=(RedisConnectionError,))
+        patches = [
+            patch.object(FastAPILimiter, "redis", self.redis, create=True),
+            patch.object(FastAPILimiter, "lua_sha", "sha", create=True),
+            patch.object(FastAPILimiter, "prefix", "limiter", create=True),
+            patch.object(FastAPILimiter, "identifier", default_identifier, create=True),
+            patch.object(FastAPILimiter, "http_callback", http_default_callback, create=True),
+            patch.object(resilience, "redis_calls", dependency),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.addAsyncCleanup(self.client.aclose)
+
+    async def test_limits_while_redis_is_up(self):
+        self.redis.evalsha.return_value = 0
+        self.assertEqual((await self.client.get("/limited")).status_code, 200)
+        self.redis.evalsha.return_value = 1500
+        self.assertEqual((await self.client.get("/limited")).status_code, 429)
+
+    async def test_redis_down(self):
+        self.redis.evalsha.side_effect = RedisConnectionError("refused")
+        self.assertEqual((await self.client.get("/limited")).status_code, 200)
+        self.redis.evalsha.side_effect = ResponseError("WRONGTYPE")
+        with self.assertRaises(ResponseError):
+            await self.client.get("/limited")
+
+    async def test_started_while_redis_was_down(self):
+        FastAPILimiter.lua_sha = None
+        self.redis.script_load.side_effect = RedisConnectionError("refused")
+        self.assertEqual((await self.client.get("/limited")).status_code, 200)
+        self.redis.evalsha.assert_not_called()
+        self.redis.script_load.side_effect = None
+        self.redis.script_load.return_value = "loaded"
+        self.redis.evalsha.return_value = 0
+        self.assertEqual((await self.client.get("/limited")).status_code, 200)
+        self.assertEqual(FastAPILimiter.lua_sha, "loaded")
+        self.assertEqual(self.redis.evalsha.await_args.args[0], "loaded")
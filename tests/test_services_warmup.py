@@ -0,0 +1,64 @@
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from fastapi.testclient import TestClient
+from fastapi_limiter import FastAPILimiter
+from redis.exceptions import ConnectionError as RedisConnectionError
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+
+from main import app
+from src.services import warmup
+from src.services.events import contact_events
+from src.services.idempotency import idempotency_store
+
+
+class TestWarmUp(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://", poolclass=QueuePool, pool_size=3, max_overflow=10)
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_warm_database_fills_the_pool(self):
+        self.assertEqual(warmup.warm_database(self.engine, 10), 3)
+        self.assertEqual(self.engine.pool.checkedin(), 3)
+        self.assertEqual(self.engine.pool.checkedout(), 0)
+
+    async def test_warm_up(self):
+        redis = AsyncMock()
+        with patch.object(warmup.auth_service, "warm_up") as auth_warm_up, \
+                patch.object(warmup.email, "warm_up") as email_warm_up:
+            await warmup.warm_up([self.engine], redis, 2)
+        self.assertEqual(self.engine.pool.checkedin(), 2)
+        self.assertEqual(redis.ping.await_count, 2)
+        auth_warm_up.assert_called_once_with()
+        email_warm_up.assert_called_once_with()
+
+    def test_email_templates(self):
+        warmup.email.warm_up()
+        self.assertEqual(len(warmup.email.templates().cache), 1)
+        template = warmup.email.templates().get_template(warmup.email.CONFIRMATION_TEMPLATE)
+        self.assertIn("http://test/api/auth/confirmed_email/abc", template.render(host="http://test/", token="abc"))
+
+
+class TestReady(unittest.TestCase):
+    def tearDown(self):
+        app.state.ready = False
+
+    def test_ready_after_warm_up(self):
+        client = TestClient(app)
+        app.state.ready = False
+        self.assertEqual(client.get("/ready").status_code, 503)
+        app.state.ready = True
+        response = client.get("/ready")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"status": "ready"})
+
+    def test_ready_while_redis_is_down(self):
+        with patch.object(FastAPILimiter, "init", AsyncMock(side_effect=RedisConnectionError("refused"))), \
+                patch.object(FastAPILimiter, "redis", None, create=True), TestClient(app) as client:
+            self.assertEqual(client.get("/ready").status_code, 200)
+            # The client is kept, so Redis is used again once it is back.
+            self.assertIsNotNone(contact_events.redis)
+            self.assertIs(idempotency_store.redis, contact_events.redis)
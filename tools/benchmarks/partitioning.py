@@ -0,0 +1,112 @@
+"""
+Compare tenant-scoped queries and vacuum on the plain and the hash partitioned users table.
+
+Run it between the copy and the swap of ``tools/partition_users.py``, when both tables hold
+the same rows (``--plain users --partitioned users_partitioned``), or after the swap against
+``users_unpartitioned`` and ``users``::
+
+    python -m tools.benchmarks.partitioning --account-id 42
+
+For every query it reports the planning and execution time, the buffers touched and how many
+relations the plan scanned: a pruned query on the partitioned table scans a single partition.
+"""
+import argparse
+import json
+import statistics
+import time
+
+from sqlalchemy import text
+
+from src.database.db import engine
+
+
+QUERIES = {
+    "list": "SELECT id, name, phone FROM {table} WHERE account_id = :account_id ORDER BY id LIMIT 100",
+    "by_id": "SELECT * FROM {table} WHERE account_id = :account_id AND id = :user_id",
+    "changes": "SELECT id, version FROM {table} WHERE account_id = :account_id AND version > 0 ORDER BY version LIMIT 500",
+    "count": "SELECT count(*) FROM {table} WHERE account_id = :account_id",
+}
+
+
+def _scanned_relations(plan: dict) -> set:
+    relations = {plan["Relation Name"]} if "Relation Name" in plan else set()
+    for child in plan.get("Plans", []):
+        relations |= _scanned_relations(child)
+    return relations
+
+
+def explain(connection, table: str, sql: str, params: dict, repeat: int) -> dict:
+    """
+    Run ``EXPLAIN (ANALYZE, BUFFERS)`` several times and keep the median timings.
+    """
+    planning, execution, buffers = [], [], []
+    relations = set()
+    for _ in range(repeat):
+        result = connection.execute(
+            text("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql.format(table=table)), params
+        ).scalar()
+        report = (json.loads(result) if isinstance(result, str) else result)[0]
+        planning.append(report["Planning Time"])
+        execution.append(report["Execution Time"])
+        plan = report["Plan"]
+        buffers.append(plan.get("Shared Hit Blocks", 0) + plan.get("Shared Read Blocks", 0))
+        relations = _scanned_relations(plan)
+    return {
+        "planning_ms": statistics.median(planning),
+        "execution_ms": statistics.median(execution),
+        "buffers": statistics.median(buffers),
+        "relations": len(relations),
+    }
+
+
+def vacuum_seconds(table: str) -> float:
+    """
+    Time ``VACUUM (ANALYZE)`` of a table, outside of a transaction.
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        started = time.perf_counter()
+        connection.execute(text(f"VACUUM (ANALYZE) {table}"))
+        return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--account-id", type=int, required=True)
+    parser.add_argument("--plain", default="users")
+    parser.add_argument("--partitioned", default="users_partitioned")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--skip-vacuum", action="store_true")
+    args = parser.parse_args()
+
+    with engine.connect() as connection:
+        user_id = connection.execute(
+            text(f"SELECT min(id) FROM {args.plain} WHERE account_id = :account_id"), {"account_id": args.account_id}
+        ).scalar() or 0
+        partitions = connection.execute(
+            text("SELECT count(*) FROM pg_inherits WHERE inhparent = CAST(:parent AS regclass)"),
+            {"parent": args.partitioned},
+        ).scalar()
+        params = {"account_id": args.account_id, "user_id": user_id}
+        print(f"{'query':<10} {'table':<20} {'plan ms':>9} {'exec ms':>9} {'buffers':>9} {'relations':>9}")
+        for name, sql in QUERIES.items():
+            for table in (args.plain, args.partitioned):
+                row = explain(connection, table, sql, params, args.repeat)
+                print(
+                    f"{name:<10} {table:<20} {row['planning_ms']:>9.3f} {row['execution_ms']:>9.3f} "
+                    f"{row['buffers']:>9.0f} {row['relations']:>9}"
+                )
+        account_partition = connection.execute(
+            text(f"SELECT tableoid::regclass::text FROM {args.partitioned} WHERE account_id = :account_id LIMIT 1"),
+            {"account_id": args.account_id},
+        ).scalar()
+    print(f"\n{partitions} partitions, account {args.account_id} lives in {account_partition}")
+
+    if not args.skip_vacuum:
+        print(f"\n{'vacuum':<32} {'seconds':>9}")
+        for table in (args.plain, args.partitioned, account_partition):
+            if table:
+                print(f"{table:<32} {vacuum_seconds(table):>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Measure how long a fresh worker takes to import the application.
+
+Every run imports ``main`` in a new interpreter, as a worker does after a deploy::
+
+    python -m tools.benchmarks.startup --repeat 10 --top 15
+
+It reports the median import time, the modules with the largest cumulative import time
+(from ``python -X importtime``) and checks that the optional heavy dependencies, imported on
+first use or during the lifespan warm-up, stay out of the import path.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+
+LAZY_MODULES = ("cloudinary", "fastapi_mail", "libgravatar", "passlib")
+
+_MEASURE = """
+import json, sys, time
+started = time.perf_counter()
+import main
+elapsed = time.perf_counter() - started
+print(json.dumps({"seconds": elapsed, "loaded": [name for name in %r if name in sys.modules]}))
+"""
+
+
+def measure_once() -> dict:
+    """
+    Import the application in a new interpreter.
+
+    :return: Import time in seconds and the lazy modules that got imported anyway.
+    :rtype: dict
+    """
+    output = subprocess.run(
+        [sys.executable, "-c", _MEASURE % (LAZY_MODULES,)], capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def slowest_imports(top: int) -> list:
+    """
+    Modules with the largest cumulative import time.
+
+    :param top: Number of modules to return.
+    :type top: int
+    :return: List of (module, milliseconds) pairs.
+    :rtype: list[tuple[str, float]]
+    """
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"], capture_output=True, text=True, check=True
+    ).stderr
+    timings = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        timings.append((name.strip(), int(cumulative) / 1000))
+    return sorted(timings, key=lambda timing: timing[1], reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters to time")
+    parser.add_argument("--top", type=int, default=15, help="slowest modules to list")
+    args = parser.parse_args()
+
+    runs = [measure_once() for _ in range(args.repeat)]
+    seconds = [run["seconds"] for run in runs]
+    print(f"import main: median {statistics.median(seconds) * 1000:.0f} ms, "
+          f"min {min(seconds) * 1000:.0f} ms, max {max(seconds) * 1000:.0f} ms over {args.repeat} runs")
+    print(f"\n{'module':<50} {'cumulative ms':>14}")
+    for name, milliseconds in slowest_imports(args.top):
+        print(f"{name:<50} {milliseconds:>14.1f}")
+    loaded = sorted({name for run in runs for name in run["loaded"]})
+    if loaded:
+        print(f"\nImported eagerly, expected lazy: {', '.join(loaded)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
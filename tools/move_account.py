@@ -0,0 +1,34 @@
+"""
+Move the contacts of an account to another shard.
+
+    python -m tools.move_account --account-id 42 --to eu2
+    python -m tools.move_account --account-id 42 --to default
+
+The account keeps working during the copy, its requests answer 503 only for the final
+catch-up, after a grace period for the requests in flight. Shards are configured with
+``SHARD_DATABASE_URLS`` and migrated with the primary database by ``alembic upgrade head``.
+Add new shards at the end of the list: the position of a shard picks the block of user IDs
+it hands out.
+"""
+import argparse
+import logging
+
+from src.database.db import shard_map
+from src.database.shards import move_account
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--account-id", type=int, required=True)
+    parser.add_argument("--to", required=True, choices=sorted(shard_map.engines), help="target shard")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--grace", type=float, default=5.0, help="seconds to wait for requests in flight")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    moved = move_account(shard_map, args.account_id, args.to, args.batch_size, args.grace)
+    logging.getLogger("move_account").info("Moved %s users of account %s to %s", moved, args.account_id, args.to)
+
+
+if __name__ == "__main__":
+    main()
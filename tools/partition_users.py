@@ -0,0 +1,76 @@
+"""
+Copy ``users`` into the hash partitioned ``users_partitioned`` table online, then swap them.
+
+Run after the ``9f3c2a71d4e8`` migration created ``users_partitioned`` without copying the rows::
+
+    python -m tools.partition_users --batch-size 10000 --pause 0.05
+    python -m tools.partition_users --swap
+
+A stopped copy is resumed with ``--after-id``, the last ID it logged.
+"""
+import argparse
+import logging
+import time
+
+from src.database import partitioning
+from src.database.db import engine
+
+
+logger = logging.getLogger("partition_users")
+
+
+def backfill(after_id: int, batch_size: int, pause: float) -> int:
+    """
+    Copy the users with an ID above ``after_id``, one transaction per batch.
+
+    :param after_id: Last ID already copied.
+    :type after_id: int
+    :param batch_size: Users per batch.
+    :type batch_size: int
+    :param pause: Seconds to sleep between batches, to leave I/O to the application.
+    :type pause: float
+    :return: Number of batches copied.
+    :rtype: int
+    """
+    batches = 0
+    started = time.perf_counter()
+    while True:
+        with engine.begin() as connection:
+            last_id = partitioning.backfill_batch(connection, after_id, batch_size)
+        if last_id is None:
+            break
+        after_id = last_id
+        batches += 1
+        if batches % 10 == 0:
+            logger.info("Copied up to id %s, %.1f batches/s", after_id, batches / (time.perf_counter() - started))
+        time.sleep(pause)
+    logger.info("Copy finished at id %s after %d batches", after_id, batches)
+    return batches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--after-id", type=int, default=0, help="resume after this user ID")
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument("--pause", type=float, default=0.05, help="seconds between batches")
+    parser.add_argument("--swap", action="store_true", help="replace users with the partitioned table")
+    parser.add_argument("--drop-old", action="store_true", help="drop users_unpartitioned after the swap")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    if args.swap:
+        with engine.begin() as connection:
+            if partitioning.is_partitioned(connection):
+                logger.info("users is already partitioned")
+            else:
+                partitioning.swap(connection)
+                logger.info("users is now partitioned, the old table is users_unpartitioned")
+    else:
+        backfill(args.after_id, args.batch_size, args.pause)
+    if args.drop_old:
+        with engine.begin() as connection:
+            connection.exec_driver_sql("DROP TABLE IF EXISTS users_unpartitioned")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""
+Delete the tombstones of users deleted longer ago than the retention period, on every shard.
+
+    python -m tools.prune_tombstones
+    python -m tools.prune_tombstones --days 90
+
+Meant to run daily, e.g. from cron. Clients that last synced before a pruned deletion get
+``410`` from ``GET /api/users/changes`` and sync again from scratch.
+"""
+import argparse
+import datetime
+import logging
+
+from sqlalchemy.orm import Session
+
+from src.conf.config import settings
+from src.database.db import shard_map
+from src.repository.users import prune_tombstones
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=settings.tombstone_retention_days, help="retention period")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    before = datetime.datetime.now() - datetime.timedelta(days=args.days)
+    for name, engine in shard_map.engines.items():
+        with Session(engine) as db:
+            pruned = prune_tombstones(db, before, args.batch_size)
+        logging.getLogger("prune_tombstones").info("Pruned %s tombstones in shard %s", pruned, name)
+
+
+if __name__ == "__main__":
+    main()